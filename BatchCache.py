@@ -0,0 +1,167 @@
+import os
+import shutil
+import pickle
+import hashlib
+import threading
+import numpy as np
+
+# bumped whenever the file layout changes, so caches written by older versions are ignored
+CACHE_VERSION = 1
+
+"""
+Computes a fingerprint of the dataset, so cached batches are never reused after the data changes
+Covers the number of rows, and the path, age and sex of every row
+
+Params
+    csvdata:    the ColumnStore (or pandas dataframe) of the .csv of faces we are using
+
+Returns
+    0:  a hex string identifying the dataset
+"""
+def datasetFingerprint(csvdata):
+    digest = hashlib.sha1(str(len(csvdata)).encode("utf-8"))
+    paths = csvdata["path"]
+    if hasattr(paths, "offsets"):
+        # a ColumnStore string column: hash its packed byte table directly
+        digest.update(np.ascontiguousarray(paths.offsets).tobytes())
+        digest.update(np.ascontiguousarray(paths.data).tobytes())
+    else:
+        digest.update("\n".join(str(p) for p in paths).encode("utf-8"))
+    for name in ["age", "isMale"]:
+        digest.update(np.ascontiguousarray(np.asarray(csvdata[name], dtype=np.float32)).tobytes())
+    return digest.hexdigest()
+
+"""
+A warm-start cache of the first batches a DataLoader produced, so a restarted run can train right away
+while its workers ramp up. Batches are stored as uint8 images in .npy files, which are memory mapped
+when read, so startup only touches the batches that are actually used
+
+Each cache is keyed by the dataset fingerprint, image size and numPerBin, so a cache is never served for
+different data or batch shapes. New caches are recorded into a temp directory, which is flushed and
+renamed into place on a background thread, so a crash never leaves a partial cache behind
+"""
+class WarmStartCache(object):
+    """"""
+
+    """
+    Initialize a WarmStartCache instance, restoring a matching cache if one exists
+
+    Params:
+        fingerprint:    the fingerprint of the dataset, from datasetFingerprint
+        imageSize:  the width/height of the batch images
+        numPerBin:  the number of images per bin in each batch
+        batchSize:  the number of images in each batch
+        cacheDir:   the directory caches are stored in
+        maxBatches: the number of batches to store when writing a new cache
+    """
+    def __init__(self, fingerprint, imageSize, numPerBin, batchSize, cacheDir="./batch_cache", maxBatches=32):
+        self.imageSize = imageSize
+        self.batchSize = batchSize
+        self.maxBatches = maxBatches
+        self.path = os.path.join(cacheDir, "v" + str(CACHE_VERSION) + "_" + fingerprint[:16] + "_" +
+                                 str(imageSize) + "px_" + str(numPerBin) + "perbin")
+        self.nextCached = 0
+        self.numCached = 0
+        self.numRecorded = 0
+        self._writer = None
+        if os.path.exists(os.path.join(self.path, "meta.p")):
+            file = open(os.path.join(self.path, "meta.p"), "rb")
+            meta = pickle.load(file)
+            file.close()
+            if meta["fingerprint"] == fingerprint and meta["batchSize"] == batchSize:
+                self.images = np.load(os.path.join(self.path, "image.npy"), mmap_mode="r")
+                self.labels = np.load(os.path.join(self.path, "labels.npy"), mmap_mode="r")
+                self.numCached = meta["numBatches"]
+        self.fingerprint = fingerprint
+        self.recording = self.numCached == 0
+        self._recordImages = None
+        self._recordLabels = None
+
+    """
+    Returns:
+        0:  the number of cached batches that haven't been served yet
+    """
+    def remaining(self):
+        return self.numCached - self.nextCached
+
+    """
+    Fills a batch dictionary with the next cached batch, scaled the same way getBatch scales them
+
+    Params:
+        out:    a batch dictionary of preallocated float32 arrays to fill
+
+    Returns:
+        0:  False if every cached batch has already been served
+    """
+    def nextBatch(self, out):
+        if self.remaining() <= 0:
+            return False
+        batchNum = self.nextCached
+        self.nextCached = self.nextCached + 1
+        out["image"][:] = self.images[batchNum]
+        out["image"] *= 2 / 255.0
+        out["image"] -= 1
+        out["sex"][:, 0] = self.labels[batchNum, :, 0]
+        out["age"][:, 0] = self.labels[batchNum, :, 1]
+        return True
+
+    """
+    Records a batch produced by the loader, until maxBatches have been seen. The cache is then written
+    to disk on a background thread
+
+    Params:
+        batch:  a batch dictionary, as returned by getBatch
+    """
+    def record(self, batch):
+        if not self.recording or self.numRecorded >= self.maxBatches:
+            return
+        tmpPath = self.path + ".tmp"
+        if self._recordImages is None:
+            # batches are recorded straight into memory mapped files in a temp directory, so a large
+            # cache never has to be held in memory
+            if os.path.exists(tmpPath):
+                shutil.rmtree(tmpPath)
+            os.makedirs(tmpPath)
+            self._recordImages = np.lib.format.open_memmap(os.path.join(tmpPath, "image.npy"), mode="w+", dtype=np.uint8,
+                                                           shape=(self.maxBatches, self.batchSize, self.imageSize, self.imageSize, 3))
+            self._recordLabels = np.lib.format.open_memmap(os.path.join(tmpPath, "labels.npy"), mode="w+", dtype=np.float32,
+                                                           shape=(self.maxBatches, self.batchSize, 2))
+        # getBatch scaled the uint8 pixels to [-1, 1], so this recovers them exactly
+        imageArr = self._recordImages[self.numRecorded]
+        np.rint((batch["image"] + 1) * 127.5, out=imageArr, casting="unsafe")
+        self._recordLabels[self.numRecorded, :, 0] = batch["sex"][:, 0]
+        self._recordLabels[self.numRecorded, :, 1] = batch["age"][:, 0]
+        self.numRecorded = self.numRecorded + 1
+        if self.numRecorded == self.maxBatches:
+            self._writer = threading.Thread(target=self._write)
+            self._writer.daemon = True
+            self._writer.start()
+
+    def _write(self):
+        tmpPath = self.path + ".tmp"
+        for recorded in [self._recordImages, self._recordLabels]:
+            recorded.flush()
+        self._recordImages = None
+        self._recordLabels = None
+        meta = {"version": CACHE_VERSION, "fingerprint": self.fingerprint, "batchSize": self.batchSize,
+                "imageSize": self.imageSize, "numBatches": self.numRecorded}
+        file = open(os.path.join(tmpPath, "meta.p"), "wb")
+        pickle.dump(meta, file)
+        file.flush()
+        os.fsync(file.fileno())
+        file.close()
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+        os.rename(tmpPath, self.path)
+        self.recording = False
+        print("saved " + str(self.numRecorded) + " batches to the warm-start cache")
+
+    """
+    Waits for a cache that is being written to finish
+    If fewer than maxBatches batches were recorded, they are written now as a smaller cache, so they aren't lost
+    """
+    def flush(self):
+        if self._writer is None and self.recording and self.numRecorded > 0:
+            self._write()
+        if self._writer is not None:
+            self._writer.join()
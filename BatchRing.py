@@ -0,0 +1,171 @@
+import time
+import ctypes
+import threading
+import multiprocessing
+import numpy as np
+from collections import deque
+
+"""
+A bounded ring of preallocated batch slots, handed back and forth between producers and a consumer
+Producers take a free slot, fill its arrays in place, and publish it. The consumer takes the oldest
+published slot, reads it, and releases it back to the free list. Only slot numbers change hands, so
+batches are never copied or reallocated, and no lock is held while a slot is being filled or read
+
+For threads, the free and ready lists are deques (whose append/popleft are atomic), with semaphores
+that only block when the ring is full or empty. With shared=True the slots live in shared memory and
+slot numbers are passed through multiprocessing queues, so producers can be separate processes
+
+The ring also keeps counters showing whether the consumer is input-bound:
+    -occupancy: the number of filled slots waiting for the consumer
+    -producer stall time: the time producers spent waiting for a free slot (consumer is the bottleneck)
+    -consumer wait time: the time the consumer spent waiting for a filled slot (producers are the bottleneck)
+"""
+class BatchRing(object):
+    """"""
+
+    """
+    Initialize a BatchRing instance
+
+    Params:
+        numSlots:   the number of batch slots in the ring
+        batchSize:  the number of images in each batch
+        imageSize:  the width/height of the images
+        numProducers:   the number of producers that will fill slots
+        shared:     if true, slots are allocated in shared memory so producers can be worker processes
+    """
+    def __init__(self, numSlots, batchSize, imageSize, numProducers=1, shared=False):
+        self.numSlots = numSlots
+        self.batchSize = batchSize
+        self.imageSize = imageSize
+        self.shared = shared
+        imageFloats = numSlots * batchSize * imageSize * imageSize * 3
+        if shared:
+            self._buffers = (multiprocessing.RawArray(ctypes.c_float, imageFloats),
+                             multiprocessing.RawArray(ctypes.c_float, numSlots * batchSize),
+                             multiprocessing.RawArray(ctypes.c_float, numSlots * batchSize))
+            self._free = multiprocessing.Queue()
+            self._ready = multiprocessing.Queue()
+            for slotNum in range(numSlots):
+                self._free.put(slotNum)
+        else:
+            self._buffers = (np.zeros(imageFloats, dtype=np.float32),
+                             np.zeros(numSlots * batchSize, dtype=np.float32),
+                             np.zeros(numSlots * batchSize, dtype=np.float32))
+            self._free = deque(range(numSlots))
+            self._ready = deque()
+            self._freeCount = threading.Semaphore(numSlots)
+            self._readyCount = threading.Semaphore(0)
+        # each producer only writes its own entry, so the counters need no locking
+        self._produced = multiprocessing.RawArray(ctypes.c_longlong, numProducers)
+        self._producerStall = multiprocessing.RawArray(ctypes.c_double, numProducers)
+        self._consumed = 0
+        self._consumerWaits = 0
+        self._consumerWaitTime = 0.0
+        self._buildSlots()
+
+    def _buildSlots(self):
+        imageBuffer, sexBuffer, ageBuffer = [np.frombuffer(buf, dtype=np.float32) for buf in self._buffers]
+        imageBuffer = imageBuffer.reshape([self.numSlots, self.batchSize, self.imageSize, self.imageSize, 3])
+        sexBuffer = sexBuffer.reshape([self.numSlots, self.batchSize, 1])
+        ageBuffer = ageBuffer.reshape([self.numSlots, self.batchSize, 1])
+        self.slots = [{"image": imageBuffer[i], "sex": sexBuffer[i], "age": ageBuffer[i]} for i in range(self.numSlots)]
+
+    def __getstate__(self):
+        # the numpy views can't be sent to a new process, so rebuild them from the shared buffers on arrival
+        if not self.shared:
+            raise TypeError("only shared BatchRings can be sent to another process")
+        state = self.__dict__.copy()
+        del state["slots"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._buildSlots()
+
+    """
+    Producer side: waits for a free slot to fill
+
+    Params:
+        producerNum:    the number of the producer taking the slot, used for its counters
+
+    Returns:
+        0:  the slot number
+        1:  the slot's batch dictionary, to be filled in place
+    """
+    def acquireFree(self, producerNum=0):
+        startTime = time.time()
+        if self.shared:
+            slotNum = self._free.get()
+        else:
+            self._freeCount.acquire()
+            slotNum = self._free.popleft()
+        self._producerStall[producerNum] += time.time() - startTime
+        return slotNum, self.slots[slotNum]
+
+    """
+    Producer side: hands a filled slot to the consumer
+
+    Params:
+        slotNum:    the slot that was filled
+        info:       a small picklable value delivered to the consumer along with the slot
+        producerNum:    the number of the producer publishing the slot
+    """
+    def publish(self, slotNum, info=None, producerNum=0):
+        self._produced[producerNum] += 1
+        if self.shared:
+            self._ready.put((slotNum, info))
+        else:
+            self._ready.append((slotNum, info))
+            self._readyCount.release()
+
+    """
+    Consumer side: waits for the oldest filled slot
+
+    Returns:
+        0:  the slot number
+        1:  the slot's batch dictionary. Only valid until the slot is released
+        2:  the info the producer published with the slot
+    """
+    def acquireReady(self):
+        startTime = time.time()
+        if self.shared:
+            if self.occupancy() <= 0:
+                self._consumerWaits = self._consumerWaits + 1
+            slotNum, info = self._ready.get()
+        else:
+            if not self._readyCount.acquire(False):
+                self._consumerWaits = self._consumerWaits + 1
+                self._readyCount.acquire()
+            slotNum, info = self._ready.popleft()
+        self._consumerWaitTime = self._consumerWaitTime + (time.time() - startTime)
+        self._consumed = self._consumed + 1
+        return slotNum, self.slots[slotNum], info
+
+    """
+    Consumer side: returns a slot to the free list once its contents are no longer needed
+
+    Params:
+        slotNum:    the slot to release
+    """
+    def release(self, slotNum):
+        if self.shared:
+            self._free.put(slotNum)
+        else:
+            self._free.append(slotNum)
+            self._freeCount.release()
+
+    """
+    Returns:
+        0:  the number of filled slots waiting for the consumer
+    """
+    def occupancy(self):
+        return sum(self._produced) - self._consumed
+
+    """
+    Returns:
+        0:  a dictionary of the ring's counters
+    """
+    def stats(self):
+        return {"slots": self.numSlots, "occupancy": self.occupancy(), "produced": int(sum(self._produced)),
+                "consumed": self._consumed, "producer_stall_sec": float(sum(self._producerStall)),
+                "consumer_waits": self._consumerWaits, "consumer_wait_sec": self._consumerWaitTime}
@@ -0,0 +1,188 @@
+import os
+import re
+import json
+import time
+import threading
+
+"""
+A small index of the checkpoints in a checkpoint directory, updated on every save
+Each entry records the checkpoint's step, file prefix, wall time, the losses at save time, and the most recent
+face detection rate, so the newest or best checkpoint can be found without listing the directory
+
+The manifest also decides which checkpoints are kept: the newest maxToKeep, plus (with keepBest) the one with
+the highest face_acc, so the best checkpoint isn't deleted once training moves past it
+"""
+class CheckpointManifest(object):
+    """"""
+
+    """
+    Initialize a CheckpointManifest instance, restoring the manifest in checkpointDir if there is one
+    Directories saved before manifests existed are indexed once from their file names
+
+    Params:
+        checkpointDir:  the directory the checkpoints are stored in
+        checkpointName: the file name prefix of the checkpoints
+        maxToKeep:  the number of newest checkpoints to keep
+        keepBest:   if true, the checkpoint with the best face_acc is also kept
+    """
+    def __init__(self, checkpointDir, checkpointName, maxToKeep=3, keepBest=True):
+        self.checkpointDir = checkpointDir
+        self.checkpointName = checkpointName
+        self.maxToKeep = maxToKeep
+        self.keepBest = keepBest
+        self.manifestPath = os.path.join(checkpointDir, checkpointName + ".manifest.json")
+        self._lock = threading.Lock()
+        if os.path.exists(self.manifestPath):
+            file = open(self.manifestPath, "r")
+            self.entries = json.load(file)["checkpoints"]
+            file.close()
+        else:
+            self.entries = self._scanDirectory()
+            if len(self.entries) > 0:
+                self._write()
+
+    def _scanDirectory(self):
+        if not os.path.exists(self.checkpointDir):
+            return []
+        # matches both single file checkpoints and the .index/.data-0000x-of-0000y shards
+        pattern = re.compile(re.escape(self.checkpointName) + r"-(\d+)(\.index|\.data-\d+-of-\d+)?$")
+        entries = {}
+        for file in os.listdir(self.checkpointDir):
+            match = pattern.match(file)
+            if match is not None:
+                step = int(match.group(1))
+                entries[step] = {"step": step, "path": self.checkpointName + "-" + str(step),
+                                 "time": os.path.getmtime(os.path.join(self.checkpointDir, file)),
+                                 "d_loss": None, "g_loss": None, "face_acc": None, "face_acc_step": None}
+        return [entries[step] for step in sorted(entries)]
+
+    def _write(self):
+        # write to a temp file first, so a crash mid-write never corrupts the manifest
+        tmpPath = self.manifestPath + ".tmp"
+        file = open(tmpPath, "w")
+        json.dump({"checkpoints": self.entries}, file, indent=2)
+        file.flush()
+        os.fsync(file.fileno())
+        file.close()
+        os.rename(tmpPath, self.manifestPath)
+
+    """
+    Records a newly saved checkpoint, and removes the checkpoints that are no longer kept
+
+    Params:
+        step:       the step the checkpoint was saved at
+        dLoss:      the discriminator loss at save time, or None
+        gLoss:      the generator loss at save time, or None
+        faceAcc:    the most recent face detection rate, or None
+        faceAccStep:    the step faceAcc was measured at
+
+    Returns:
+        0:  the steps of the checkpoints that were removed
+    """
+    def add(self, step, dLoss=None, gLoss=None, faceAcc=None, faceAccStep=None):
+        entry = {"step": step, "path": self.checkpointName + "-" + str(step), "time": time.time(),
+                 "d_loss": _floatOrNone(dLoss), "g_loss": _floatOrNone(gLoss), "face_acc": _floatOrNone(faceAcc),
+                 "face_acc_step": faceAccStep}
+        with self._lock:
+            self.entries = [old for old in self.entries if old["step"] != step] + [entry]
+            removed = self._applyRetention()
+            self._write()
+        for removedStep in removed:
+            self._removeFiles(removedStep)
+        return removed
+
+    def _applyRetention(self):
+        keep = set(old["step"] for old in self.entries[-self.maxToKeep:])
+        best = self._best()
+        if self.keepBest and best is not None:
+            keep.add(best["step"])
+        removed = [old["step"] for old in self.entries if old["step"] not in keep]
+        self.entries = [old for old in self.entries if old["step"] in keep]
+        return removed
+
+    def _removeFiles(self, step):
+        prefix = self.checkpointName + "-" + str(step)
+        for file in os.listdir(self.checkpointDir):
+            if file == prefix or file.startswith(prefix + "."):
+                os.remove(os.path.join(self.checkpointDir, file))
+
+    """
+    Records a face detection rate measured after a checkpoint was saved
+    It's stored on the checkpoint it was measured closest to, if it's closer than that checkpoint's current rate
+
+    Params:
+        step:       the training round the rate was measured at
+        faceAcc:    the face detection rate
+    """
+    def recordFaceAcc(self, step, faceAcc):
+        with self._lock:
+            saved = [entry for entry in self.entries if entry["step"] <= step]
+            if len(saved) == 0:
+                return
+            entry = saved[-1]
+            if entry["face_acc_step"] is not None and abs(entry["step"] - entry["face_acc_step"]) <= step - entry["step"]:
+                return
+            entry["face_acc"] = _floatOrNone(faceAcc)
+            entry["face_acc_step"] = step
+            self._write()
+
+    def _best(self):
+        scored = [entry for entry in self.entries if entry["face_acc"] is not None]
+        if len(scored) == 0:
+            return None
+        # ties go to the newest checkpoint
+        return max(scored, key=lambda entry: (entry["face_acc"], entry["step"]))
+
+    """
+    Returns:
+        0:  the entry of the newest checkpoint whose files exist, or None
+    """
+    def newest(self):
+        with self._lock:
+            for entry in reversed(self.entries):
+                if self.exists(entry):
+                    return entry
+        return None
+
+    """
+    Returns:
+        0:  the entry of the checkpoint with the highest face_acc, or the newest if none have been scored
+    """
+    def best(self):
+        with self._lock:
+            best = self._best()
+        if best is not None and self.exists(best):
+            return best
+        return self.newest()
+
+    """
+    Params:
+        entry:  a manifest entry
+
+    Returns:
+        0:  the full path prefix of the checkpoint, as passed to Saver.restore
+    """
+    def path(self, entry):
+        return os.path.join(self.checkpointDir, entry["path"])
+
+    """
+    Params:
+        entry:  a manifest entry
+
+    Returns:
+        0:  true if the checkpoint's files are still on disk
+    """
+    def exists(self, entry):
+        prefix = self.path(entry)
+        return os.path.exists(prefix) or os.path.exists(prefix + ".index")
+
+    """
+    Returns:
+        0:  the full path prefixes of every kept checkpoint, oldest first
+    """
+    def paths(self):
+        with self._lock:
+            return [self.path(entry) for entry in self.entries]
+
+def _floatOrNone(value):
+    return float(value) if value is not None else None
@@ -0,0 +1,141 @@
+import os
+import time
+import shutil
+import threading
+import tensorflow as tf
+
+def _fsync(filePath):
+    fd = os.open(filePath, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+"""
+Points tensorflow's checkpoint state file at the checkpoints kept by a CheckpointManifest
+
+Params
+    checkpointDir:  the directory the checkpoints are stored in
+    manifest:       the CheckpointManifest of the directory
+"""
+def writeCheckpointState(checkpointDir, manifest):
+    paths = manifest.paths()
+    if len(paths) > 0:
+        tf.train.update_checkpoint_state(checkpointDir, paths[-1], all_model_checkpoint_paths=paths)
+
+"""
+Saves checkpoints without stalling training for the whole write
+Each save copies every variable into a snapshot variable in one session.run, which is the only time training
+is blocked. The snapshot is then serialized by a Saver on a background thread, into a temp directory inside
+the checkpoint directory. Once the files are fsynced they are renamed into place, so a crash never leaves a
+partial checkpoint behind, and the checkpoint is added to the CheckpointManifest, which removes the old ones
+
+The files have the same variable names as the network's own Saver writes, so they are restored the same way.
+The snapshot variables are kept in host memory, so the checkpointed state is held twice
+"""
+class AsyncCheckpointWriter(object):
+    """"""
+
+    """
+    Initialize an AsyncCheckpointWriter instance
+    Must be created while the graph is being built, before the session initializes its variables
+
+    Params:
+        variables:  the variables to checkpoint, usually tf.all_variables()
+        checkpointDir:  the directory checkpoints are written to
+        checkpointName: the file name prefix of the checkpoints
+        manifest:   the CheckpointManifest of checkpointDir, which decides which checkpoints are kept
+    """
+    def __init__(self, variables, checkpointDir, checkpointName, manifest):
+        self.checkpointDir = checkpointDir
+        self.checkpointName = checkpointName
+        self.manifest = manifest
+        snapshots = {}
+        copies = []
+        with tf.device("/cpu:0"):
+            for var in variables:
+                name = var.op.name
+                # local variables, so the network's own Saver never saves the snapshots themselves
+                snapshot = tf.Variable(tf.zeros(var.get_shape(), dtype=var.dtype.base_dtype), trainable=False,
+                                       collections=[tf.GraphKeys.LOCAL_VARIABLES], name="snapshot/" + name)
+                snapshots[name] = snapshot
+                copies += [tf.assign(snapshot, var)]
+        self.snapshot_op = tf.group(*copies)
+        self.saver = tf.train.Saver(snapshots, max_to_keep=0)
+        self.saves = 0
+        self.blockedTime = 0.0
+        self.lastBlocked = 0.0
+        self.lastWrite = 0.0
+        self._thread = None
+        self._error = None
+
+    """
+    Snapshots the variables and starts writing them in the background
+    If the previous checkpoint is still being written, waits for it first
+
+    Params:
+        session:    the session holding the variables
+        step:       the training step the checkpoint is numbered with
+        info:       an optional dictionary of CheckpointManifest.add arguments (dLoss, gLoss, faceAcc, faceAccStep)
+
+    Returns:
+        0:  the number of seconds training was blocked for
+    """
+    def save(self, session, step, info=None):
+        startTime = time.time()
+        self.wait()
+        session.run(self.snapshot_op)
+        blocked = time.time() - startTime
+        self.saves = self.saves + 1
+        self.blockedTime = self.blockedTime + blocked
+        self.lastBlocked = blocked
+        self._thread = threading.Thread(target=self._write, args=[session, step, info])
+        self._thread.daemon = True
+        self._thread.start()
+        return blocked
+
+    def _write(self, session, step, info):
+        try:
+            startTime = time.time()
+            tmpDir = os.path.join(self.checkpointDir, ".tmp_checkpoint")
+            if os.path.exists(tmpDir):
+                shutil.rmtree(tmpDir)
+            os.makedirs(tmpDir)
+            self.saver.save(session, os.path.join(tmpDir, self.checkpointName), global_step=step,
+                            write_meta_graph=False)
+            for file in os.listdir(tmpDir):
+                # the saver's own state file is replaced by update_checkpoint_state below
+                if file == "checkpoint":
+                    continue
+                _fsync(os.path.join(tmpDir, file))
+                os.rename(os.path.join(tmpDir, file), os.path.join(self.checkpointDir, file))
+            _fsync(self.checkpointDir)
+            shutil.rmtree(tmpDir)
+            self.manifest.add(step, **(info or {}))
+            writeCheckpointState(self.checkpointDir, self.manifest)
+            self.lastWrite = time.time() - startTime
+            print(self.checkpointName + " " + str(step) + " written in the background in " + "%.2f" % self.lastWrite + "s")
+        except Exception as e:
+            self._error = e
+
+    """
+    Waits for the checkpoint being written to finish
+    Raises any error from the background write, so failed saves aren't silently lost
+    """
+    def wait(self):
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._error is not None:
+            error = self._error
+            self._error = None
+            raise error
+
+    """
+    Returns:
+        0:  a dictionary with the number of saves, the total and last time training was blocked,
+            and how long the last background write took
+    """
+    def stats(self):
+        return {"saves": self.saves, "blocked_sec": self.blockedTime, "last_blocked_sec": self.lastBlocked,
+                "last_write_sec": self.lastWrite}
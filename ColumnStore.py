@@ -0,0 +1,158 @@
+import os
+import sys
+import shutil
+import pickle
+import numpy as np
+import pandas as pd
+
+"""
+Writes a dataframe to disk as a columnar store that can be memory mapped on open
+Numeric columns are saved as typed .npy arrays, and text columns are packed into a single
+utf-8 byte table per column, with an array of offsets marking where each row's string starts
+
+Params
+    csvdata:    the dataframe to store
+    storeDir:   the directory to write the store to. Any existing store is replaced
+    sourcePath: the path of the file the dataframe was read from, so the store can detect when it's stale
+
+Returns
+    0:  a ColumnStore for the written data
+"""
+def writeColumnStore(csvdata, storeDir, sourcePath=None):
+    # build the store in a temp directory, so a partially written store is never opened
+    tmpDir = storeDir + ".tmp"
+    if os.path.exists(tmpDir):
+        shutil.rmtree(tmpDir)
+    os.makedirs(tmpDir)
+    columns = []
+    for name in csvdata.columns:
+        column = csvdata[name].values
+        if column.dtype.kind == "f":
+            np.save(os.path.join(tmpDir, name + ".npy"), np.asarray(column, dtype=np.float32))
+            columns += [(name, "numeric")]
+        elif column.dtype.kind in "iub":
+            np.save(os.path.join(tmpDir, name + ".npy"), np.asarray(column, dtype=np.int64))
+            columns += [(name, "numeric")]
+        else:
+            _writeStringColumn(column, os.path.join(tmpDir, name))
+            columns += [(name, "string")]
+    np.save(os.path.join(tmpDir, "csvRow.npy"), np.asarray(csvdata.index, dtype=np.int64))
+    sourceMtime = os.path.getmtime(sourcePath) if sourcePath is not None else None
+    meta = {"columns": columns, "numRows": len(csvdata.index), "sourceMtime": sourceMtime}
+    file = open(os.path.join(tmpDir, "meta.p"), "wb")
+    pickle.dump(meta, file)
+    file.close()
+    if os.path.exists(storeDir):
+        shutil.rmtree(storeDir)
+    os.rename(tmpDir, storeDir)
+    return ColumnStore(storeDir)
+
+def _writeStringColumn(column, basePath):
+    encoded = [("" if (value is None or (isinstance(value, float) and np.isnan(value))) else str(value)).encode("utf-8")
+               for value in column]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(value) for value in encoded])
+    file = open(basePath + ".strings", "wb")
+    file.write(b"".join(encoded))
+    file.close()
+    np.save(basePath + ".offsets.npy", offsets)
+
+"""
+A column of strings, read out of a memory mapped byte table
+Supports lookups by a single row (returning a string) or by an array of rows (returning a list)
+"""
+class StringColumn(object):
+    """"""
+
+    def __init__(self, basePath):
+        self.offsets = np.load(basePath + ".offsets.npy", mmap_mode="r")
+        if self.offsets[-1] > 0:
+            self.data = np.memmap(basePath + ".strings", dtype=np.uint8, mode="r")
+        else:
+            self.data = np.zeros(0, dtype=np.uint8)
+
+    def __len__(self):
+        return self.offsets.shape[0] - 1
+
+    def __getitem__(self, idx):
+        if np.ndim(idx) > 0:
+            return [self[i] for i in np.asarray(idx).ravel()]
+        return self.data[self.offsets[idx]:self.offsets[idx + 1]].tobytes().decode("utf-8")
+
+"""
+Read-only columnar view of the dataset csv. Opening is near-instant, since every column is memory mapped
+Columns are accessed like a dataframe (store["age"]), but numeric columns come back as numpy arrays,
+so per-row lookups are plain array indexing
+"""
+class ColumnStore(object):
+    """"""
+
+    """
+    Open a column store
+
+    Params:
+        storeDir:   the directory written by writeColumnStore
+    """
+    def __init__(self, storeDir):
+        file = open(os.path.join(storeDir, "meta.p"), "rb")
+        meta = pickle.load(file)
+        file.close()
+        self.storeDir = storeDir
+        self.numRows = meta["numRows"]
+        self.sourceMtime = meta["sourceMtime"]
+        self.columns = [name for name, _ in meta["columns"]]
+        self._columns = {}
+        for name, kind in meta["columns"]:
+            basePath = os.path.join(storeDir, name)
+            if kind == "numeric":
+                self._columns[name] = np.load(basePath + ".npy", mmap_mode="r")
+            else:
+                self._columns[name] = StringColumn(basePath)
+        # the csv row of each entry, matching the dataframe's index
+        self.index = np.load(os.path.join(storeDir, "csvRow.npy"), mmap_mode="r")
+
+    def __len__(self):
+        return self.numRows
+
+    def __getitem__(self, name):
+        return self._columns[name]
+
+    def __contains__(self, name):
+        return name in self._columns
+
+"""
+Opens the column store for a csv file, building it from the csv first if it's missing or older than the csv
+
+Params
+    csvPath:    the path of the dataset csv
+    storeDir:   the directory of the column store
+
+Returns
+    0:  a ColumnStore for the csv data
+"""
+def LoadColumnStore(csvPath, storeDir="./dataset_store"):
+    csvMtime = os.path.getmtime(csvPath) if os.path.exists(csvPath) else None
+    if os.path.exists(os.path.join(storeDir, "meta.p")):
+        store = ColumnStore(storeDir)
+        if csvMtime is None or store.sourceMtime == csvMtime:
+            print("restoring column store...")
+            return store
+        print("column store is older than " + csvPath + "; rebuilding...")
+    print("building column store from " + csvPath + "...")
+    csvdata = pd.read_csv(csvPath)
+    return writeColumnStore(csvdata, storeDir, sourcePath=csvPath)
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("requires 1 parameter (csv_path) and optionally store_dir")
+        exit()
+
+    csvPath = sys.argv[1]
+    storeDir = sys.argv[2] if len(sys.argv) > 2 else "./dataset_store"
+
+    if not os.path.exists(csvPath):
+        print("csv file not found")
+        exit()
+
+    store = LoadColumnStore(csvPath, storeDir)
+    print(str(len(store)) + " rows, columns: " + ", ".join(store.columns))
@@ -1,9 +1,147 @@
 import os
+import json
 import numpy as np
 import pandas as pd
-import pickle
-from DataLoader import _filterDataframe
+from StratifiedSampler import assignBins
 import  sys
+
+# the columns read to compute the stats. Other columns are never loaded
+_statsColumns = ["age", "isMale", "image_width", "image_height", "face_score"]
+
+"""
+Yields the dataset in chunks of rows, as dictionaries of numpy column arrays
+A csv path is streamed with pandas, so files larger than memory can be processed
+
+Params
+    source:     a csv path, or a ColumnStore/dataframe that is already open
+    chunkSize:  the number of rows in each chunk
+"""
+def _iterChunks(source, chunkSize):
+    if isinstance(source, str):
+        for chunk in pd.read_csv(source, usecols=_statsColumns, chunksize=chunkSize):
+            yield dict((name, chunk[name].values) for name in _statsColumns)
+        return
+    columns = {}
+    for name in _statsColumns:
+        column = source[name]
+        columns[name] = column.values if hasattr(column, "values") else column
+    for start in range(0, len(source), chunkSize):
+        yield dict((name, np.asarray(columns[name][start:start + chunkSize])) for name in _statsColumns)
+
+"""
+Computes summary statistics for the dataset csv in vectorised passes over chunks of rows
+
+Params
+    source:         a csv path (streamed in chunks), or a ColumnStore/dataframe
+    ageRange:       the start and end values of the ages in the age/sex histogram
+    ageRangeLimits: the age bin limits used by createIndices, to count the rows in each sampler bin
+    faceScoreBins:  the edges of the face score histogram bins
+    chunkSize:      the number of rows processed at a time
+
+Returns
+    0:  a dictionary of the stats:
+        -ageSex:    a dataframe of female/male counts for every age in ageRange
+        -binCounts: a dataframe with the number of rows in each createIndices bin
+        -faceScore: a dataframe of face score histogram counts (missing scores are counted as -inf)
+        -resolution:    a dictionary of resolution stats (min/max image size, mean, percentiles)
+"""
+def computeStats(source, ageRange=[10, 100], ageRangeLimits=[20, 30, 40, 50, 60, 70, 80, 101],
+                 faceScoreBins=[-np.inf] + list(np.arange(0, 8.5, 0.5)) + [np.inf], chunkSize=200000):
+    numAges = ageRange[1] - ageRange[0] + 1
+    ageSex = np.zeros([numAges, 2], dtype=np.int64)
+    strata = [("age", ageRangeLimits), ("isMale", [0.5, 1.5])]
+    binCounts = np.zeros(len(ageRangeLimits) * 2, dtype=np.int64)
+    faceScoreCounts = np.zeros(len(faceScoreBins) - 1, dtype=np.int64)
+    # percentiles are found from a histogram of the equivalent square side length (sqrt of the resolution),
+    # so they're accurate to a pixel of side length without holding every resolution in memory
+    sideCounts = np.zeros(1, dtype=np.int64)
+    numRows = 0
+    numImages = 0
+    sumRes = 0.0
+    minRes, maxRes = np.inf, -1
+    minSize, maxSize = None, None
+    for chunk in _iterChunks(source, chunkSize):
+        numRows = numRows + len(chunk["age"])
+        # age/sex histogram, over rows with a known sex and an age in range
+        age = np.floor(np.asarray(chunk["age"], dtype=np.float64))
+        sex = np.asarray(chunk["isMale"], dtype=np.float64)
+        valid = (age >= ageRange[0]) & (age <= ageRange[1]) & ((sex == 0) | (sex == 1))
+        cells = (age[valid] - ageRange[0]).astype(np.int64) * 2 + sex[valid].astype(np.int64)
+        ageSex += np.bincount(cells, minlength=numAges * 2).reshape([numAges, 2])
+        # sampler bins, computed exactly like createIndices does
+        binIds, binValid = assignBins(chunk, strata)
+        binCounts += np.bincount(binIds[binValid], minlength=len(binCounts))
+        # face scores
+        faceScore = np.asarray(chunk["face_score"], dtype=np.float64)
+        faceScore = np.where(np.isnan(faceScore), -np.inf, faceScore)
+        faceScoreCounts += np.histogram(faceScore, bins=faceScoreBins)[0]
+        # resolution, over images that could be read
+        width = np.asarray(chunk["image_width"], dtype=np.float64)
+        height = np.asarray(chunk["image_height"], dtype=np.float64)
+        readable = (width > 0) & (height > 0)
+        width, height = width[readable], height[readable]
+        if width.shape[0] == 0:
+            continue
+        res = width * height
+        numImages = numImages + res.shape[0]
+        sumRes = sumRes + res.sum()
+        if res.min() < minRes:
+            minRes = res.min()
+            minSize = [int(width[res.argmin()]), int(height[res.argmin()])]
+        if res.max() > maxRes:
+            maxRes = res.max()
+            maxSize = [int(width[res.argmax()]), int(height[res.argmax()])]
+        chunkSides = np.bincount(np.round(np.sqrt(res)).astype(np.int64))
+        if chunkSides.shape[0] > sideCounts.shape[0]:
+            sideCounts = np.concatenate([sideCounts, np.zeros(chunkSides.shape[0] - sideCounts.shape[0], dtype=np.int64)])
+        sideCounts[:chunkSides.shape[0]] += chunkSides
+
+    resolution = {"images": numImages, "min": minSize, "max": maxSize,
+                  "mean": sumRes / numImages if numImages > 0 else None}
+    cumulative = np.cumsum(sideCounts)
+    for pct in [1, 5, 25, 50, 75, 95, 99]:
+        if numImages > 0:
+            side = int(np.searchsorted(cumulative, numImages * pct / 100.0))
+            resolution["p" + str(pct)] = side * side
+        else:
+            resolution["p" + str(pct)] = None
+
+    binNames = [("age<" + str(limit), sexName) for limit in ageRangeLimits for sexName in ["female", "male"]]
+    binDf = pd.DataFrame({"age_bin": [name[0] for name in binNames], "sex": [name[1] for name in binNames],
+                          "count": binCounts})
+    faceDf = pd.DataFrame({"min_score": faceScoreBins[:-1], "max_score": faceScoreBins[1:], "count": faceScoreCounts})
+    ageSexDf = pd.DataFrame(ageSex, columns=["female", "male"], index=np.arange(ageRange[0], ageRange[1]+1))
+    return {"rows": numRows, "ageSex": ageSexDf, "binCounts": binDf, "faceScore": faceDf, "resolution": resolution}
+
+"""
+Writes the stats from computeStats to csv files, and optionally a json summary
+
+Params
+    stats:      the dictionary returned by computeStats
+    outPath:    the path of the age/sex csv. The other tables are written next to it, with suffixes
+    jsonPath:   if specified, a json file summarizing every stat is written here
+"""
+def writeStats(stats, outPath="stats.csv", jsonPath=None):
+    base, ext = os.path.splitext(outPath)
+    stats["ageSex"].to_csv(outPath)
+    stats["binCounts"].to_csv(base + "_bins" + ext, index=False)
+    stats["faceScore"].to_csv(base + "_face_score" + ext, index=False)
+    pd.DataFrame([stats["resolution"]]).to_csv(base + "_resolution" + ext, index=False)
+    if jsonPath is not None:
+        summary = {"rows": stats["rows"], "resolution": stats["resolution"],
+                   "age_sex": dict((str(age), [int(f), int(m)]) for age, f, m in
+                                   zip(stats["ageSex"].index, stats["ageSex"]["female"], stats["ageSex"]["male"])),
+                   "bins": [[row.age_bin, row.sex, int(row.count)] for row in stats["binCounts"].itertuples()],
+                   "face_score": [[_finiteOrNone(row.min_score), _finiteOrNone(row.max_score), int(row.count)]
+                                  for row in stats["faceScore"].itertuples()]}
+        file = open(jsonPath, "w")
+        json.dump(summary, file, indent=2)
+        file.close()
+
+def _finiteOrNone(value):
+    # json can't represent infinity, so the open ended face score bins are written as null
+    return float(value) if np.isfinite(value) else None
+
 """
 creates a csv file detailing the age/gender breakdown of the csv dataset
 
@@ -16,15 +154,7 @@ Returns
     0: a pandas dataframe representing the results
 """
 def statsCsv(csvdata, ageRange=[10, 100], outPath="stats.csv"):
-    numRows = len(csvdata.index)
-    numAges = ageRange[1] - ageRange[0] + 1
-    resultsArr = np.zeros([numAges, 2], dtype=int)
-    for i in range(numRows):
-        sex = int(csvdata["isMale"][i])
-        age = int(csvdata["age"][i])
-        adjustedAge = age - ageRange[0]
-        resultsArr[adjustedAge, sex] = resultsArr[adjustedAge, sex] + 1
-    df = pd.DataFrame(resultsArr, columns=["female", "male"], index=np.arange(ageRange[0], ageRange[1]+1))
+    df = computeStats(csvdata, ageRange=ageRange)["ageSex"]
     df.to_csv(outPath)
     return df
 
@@ -38,50 +168,24 @@ Returns
     0:  a string containing information about the min and max res images
 """
 def findImageSizeRange(csvData):
-    numRows = len(csvData.index)
-    minRes = float("inf")
-    maxRes = 0
-    minResStr = ""
-    maxResStr = ""
-    sumRes = 0
-    for i in range(numRows):
-        width = csvData["image_width"][i]
-        height = csvdata["image_height"][i]
-        resStr = "[" + str(width) + ", " + str(height) + "]"
-        res = height * width
-        sumRes = sumRes + res
-
-        if res > maxRes:
-            maxRes = res
-            maxResStr = resStr
-        if res < minRes:
-            minRes = res
-            minResStr = resStr
-        if i % 100000 == 0:
-            print (str(i) + "/" + str(numRows))
-    return "min:" + minResStr + " max:" + maxResStr
+    resolution = computeStats(csvData)["resolution"]
+    return "min:" + str(resolution["min"]) + " max:" + str(resolution["max"])
 
 if __name__ == "__main__":
-    if len(sys.argv) == 3:
-        csvPath = sys.argv[1]
-        indicesPath = sys.argv[2]
-
-        if os.path.exists(csvPath) and os.path.exists(indicesPath):
-            print("restoring csv data...")
-            csvdata = pd.read_csv(csvPath)
+    if len(sys.argv) < 2:
+        print("requires 1 parameter (csv_path) and optionally json_path")
+        exit()
 
-            print("restoring indices data...")
-            file = open(indicesPath, "rb")
-            indices = pickle.load(file)
-            file.close()
+    csvPath = sys.argv[1]
+    jsonPath = sys.argv[2] if len(sys.argv) > 2 else None
 
-            print ("finding image size range...")
-            imgRange = findImageSizeRange(csvdata)
-            print (imgRange)
-            print("generating stats csv...")
-            statsCsv(csvdata)
+    if not os.path.exists(csvPath):
+        print("csv file not found")
+        exit()
 
-        else:
-            print("one or both files not found")
-    else:
-        print("requires 2 parameters (csv_path, indices_path)")
\ No newline at end of file
+    print("generating stats...")
+    stats = computeStats(csvPath)
+    writeStats(stats, jsonPath=jsonPath)
+    print(str(stats["rows"]) + " rows")
+    print("resolution " + str(stats["resolution"]))
+    print(stats["binCounts"])
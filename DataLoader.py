@@ -2,31 +2,30 @@ import os
 from scipy.io import loadmat
 from scipy.misc import imread, imresize
 import pandas as pd
-from datetime import datetime, timedelta
 import numpy as np
-import pickle
 import time
-from PIL import Image
 import threading
-from copy import deepcopy
-from random import  shuffle
-""""
-creates a csv file containing information on all the faces
-uses the information from the dataset's .mat files, and applies filtering to keep only good quality data
+import multiprocessing
+from BatchRing import BatchRing
+from StratifiedSampler import StratifiedSampler
+from DatasetIndexer import matlabDatenumToYear, probeImages
+from ColumnStore import LoadColumnStore, writeColumnStore
+from DatasetFilter import DatasetFilter
+from BatchCache import WarmStartCache, datasetFingerprint
+from random import  seed
+"""
+creates the unfiltered master table of every face in the dataset, from the dataset's .mat files
+thresholds can then be applied to it with _filterDataframe, without re-reading the dataset
 
 Params
     datasetDir: the directory of the IMDBWIKI dataset on the computer's hard drive
-    agetRange:  a vector containing the min and max age to keep. Helps trim out outlier errors in the dataset
-    minScore:   the minimum face score to keep. Removes bad quality data
-    minRes:     the minimum resolution image to keep
-    filterGender:   a bool that determines whether to trim out faces with unlabeled geneders
-    filterRGB:  determines whether we should filter out b/w images (or other encodings)
-    filterMult: determines whether images with multiple faces should be filtered out
+    numProbeWorkers:    the number of threads used to read image headers
+    probeCachePath:     the path used to cache image header results, so indexing can resume if interrupted
 
 Returns
-    0: the dataframe the .csv represents
+    0: the unfiltered dataframe
 """
-def createCsv(datasetDir, ageRange=[10, 100], minScore=1, minRes=(60*60), filterGender=True, filterRGB=True, filterMult=True):
+def createMasterCsv(datasetDir, numProbeWorkers=16, probeCachePath="./probe_cache.p"):
     combinedDf = None
     for fileType in ["wiki", "imdb"]:
         matFile = loadmat(os.path.join(datasetDir, fileType+"_crop", fileType+".mat"))
@@ -39,48 +38,15 @@ def createCsv(datasetDir, ageRange=[10, 100], minScore=1, minRes=(60*60), filter
         faceScore = matFile[fileType]["face_score"][0][0][0]
         faceScore2 = matFile[fileType]["second_face_score"][0][0][0]
 
-        numRows = dateOfBirth.shape[0]
-
-        birthYear = np.zeros(numRows)
-        age = np.zeros(numRows)
-        imFormat = np.copy(name)
-        imHeight = np.zeros(numRows, dtype=int)
-        imWidth = np.zeros(numRows, dtype=int)
-        imRes = np.zeros(numRows, dtype=int)
-
-        for i in range(0, numRows):
-            # add age/birth year
-            matlabBD = dateOfBirth[i]
-            if matlabBD < 366:
-                matlabBD = 400
-            pythonBd = datetime.fromordinal(int(matlabBD)) + timedelta(days=int(matlabBD) % 1) - timedelta(days=366)
-            birthYear[i] = pythonBd.year
-            age[i] = yearTaken[i] - pythonBd.year
-            # fix name
-            nameArr = name[i]
-            if (nameArr.shape[0] > 0):
-                name[i] = nameArr[0].replace(",", "")
-            else:
-                name[i] = ""
-            # fix path
-            pathArr = path[i]
-            fullPath = os.path.join(datasetDir, fileType + "_crop", pathArr[0])
-            path[i] = fullPath
-            #add image data
-            try:
-                img = Image.open(fullPath)
-                imFormat[i] = img.mode
-                w, h = img.size
-                imHeight[i] = w
-                imWidth[i] = h
-                imRes[i] = w * h
-            except IOError:
-                print("error reading file " + fullPath)
-                imHeight[i] = -1
-                imWidth[i] = -1
-                imRes[i] = -1
-            if i % 10000 == 0:
-                print(str(i) + "/" + str(numRows))
+        # add age/birth year
+        birthYear = matlabDatenumToYear(dateOfBirth).astype(float)
+        age = yearTaken - birthYear
+        # fix names and paths
+        name = np.array([nameArr[0].replace(",", "") if nameArr.shape[0] > 0 else "" for nameArr in name], dtype=object)
+        path = np.array([os.path.join(datasetDir, fileType + "_crop", pathArr[0]) for pathArr in path], dtype=object)
+        #add image data
+        imFormat, imWidth, imHeight = probeImages(path, cachePath=probeCachePath, numWorkers=numProbeWorkers)
+        imRes = np.where(imWidth < 0, -1, imWidth * imHeight)
 
         dataTable = {"name": name, "age": age, "birthday": birthYear, "year_taken": yearTaken, "isMale": gender,
                      "face_location": faceLocation, "face_score": faceScore, "second_face": faceScore2, "path": path,
@@ -91,6 +57,28 @@ def createCsv(datasetDir, ageRange=[10, 100], minScore=1, minRes=(60*60), filter
             combinedDf = df
         else:
             combinedDf = pd.concat([combinedDf, df])
+    return combinedDf.reset_index(drop=True)
+
+""""
+creates a csv file containing information on all the faces
+uses the information from the dataset's .mat files, and applies filtering to keep only good quality data
+
+Params
+    datasetDir: the directory of the IMDBWIKI dataset on the computer's hard drive
+    agetRange:  a vector containing the min and max age to keep. Helps trim out outlier errors in the dataset
+    minScore:   the minimum face score to keep. Removes bad quality data
+    minRes:     the minimum resolution image to keep
+    filterGender:   a bool that determines whether to trim out faces with unlabeled geneders
+    filterRGB:  determines whether we should filter out b/w images (or other encodings)
+    filterMult: determines whether images with multiple faces should be filtered out
+    numProbeWorkers:    the number of threads used to read image headers
+    probeCachePath:     the path used to cache image header results, so indexing can resume if interrupted
+
+Returns
+    0: the dataframe the .csv represents
+"""
+def createCsv(datasetDir, ageRange=[10, 100], minScore=1, minRes=(60*60), filterGender=True, filterRGB=True, filterMult=True, numProbeWorkers=16, probeCachePath="./probe_cache.p"):
+    combinedDf = createMasterCsv(datasetDir, numProbeWorkers=numProbeWorkers, probeCachePath=probeCachePath)
     return _filterDataframe(combinedDf, ageRange, minScore, minRes, filterGender, filterRGB, filterMult)
 
 """
@@ -106,199 +94,149 @@ Params
     filterRGB:  determines whether we should filter out b/w images (or other encodings)
     filterMult: determines whether images with multiple faces should be filtered out
     indexPath: if specified, will delete the old index and generate a new one
+    datasetFilter:  a DatasetFilter over csvData with cached masks. If None, masks are computed from scratch
 
 Returns
     0: the filtered dataframe
 """
-def _filterDataframe(csvData, ageRange, minScore, minRes, filterGender, filterRGB, filterMult, indexPath=None):
-    numLeft = len(csvData.index)
-    print(numLeft, " images found")
-    if minScore is not None:
-        csvData = csvData[csvData.face_score > minScore]
-        numLeft = len(csvData.index)
-        print("filtered low quality faces: ", numLeft, " images remaining")
-    if minRes is not None:
-        csvData = csvData[csvData.image_resolution > minRes]
-        numLeft = len(csvData.index)
-        print("filtered low res images: ", numLeft, " images remaining")
-    if ageRange is not None:
-        csvData = csvData[csvData.age > ageRange[0]]
-        csvData = csvData[csvData.age < ageRange[1]]
-        numLeft = len(csvData.index)
-        print("filtered bad ages: ", numLeft, " images remaining")
-    if filterGender:
-        csvData = csvData[csvData.isMale.notnull()]
-        numLeft = len(csvData.index)
-        print("filtered null sex: ", numLeft, " images remaining")
-    if filterRGB:
-        csvData = csvData[csvData.image_format == "RGB"]
-        numLeft = len(csvData.index)
-        print("filtered non-RGB images: ", numLeft, " images remaining")
-    if filterMult:
-        csvData = csvData[csvData.second_face.isnull()]
-        numLeft = len(csvData.index)
-        print("filtered out multiple faces: ", numLeft, " images remaining")
+def _filterDataframe(csvData, ageRange, minScore, minRes, filterGender, filterRGB, filterMult, indexPath=None, datasetFilter=None):
+    if datasetFilter is None:
+        datasetFilter = DatasetFilter(csvData)
+    mask = datasetFilter.combinedMask(ageRange, minScore, minRes, filterGender, filterRGB, filterMult)
+    csvData = csvData[mask]
     if indexPath is not None:
         print ("creating new index file")
-        os.remove(indexPath)
-        indices = createIndices(csvdata)
-        file = open(indexPath, "wb")
-        pickle.dump(indices, file)
-        file.close()
+        if os.path.exists(indexPath):
+            os.remove(indexPath)
+        indices = createIndices(csvData.reset_index(drop=True))
+        indices.save(indexPath)
     return csvData
 
 """
-creates files that contain a list of indices for each category we are training on.
-returns a dictionary with 3 keys: "Men", "Women" and "AgeBunLimits"
-AgeBinLimits contains a list of cut-off points that define each age range
-Men and Women contains a list of lists, where each element represents an age bin,
-and contains a list of indices of images that fall into that bin
+creates the stratified sampler used to draw balanced batches from the data
+by default, the data is split into a bin for every age group/sex combination
 
 Params
-    csvdata:      the dataframe of the .csv file of good quality faces we are working with
+    csvdata:      the ColumnStore (or dataframe) of the .csv file of good quality faces we are working with
     ageRangeLimits: a vector describing all the age ranges we are breaking the data into
                     each item describes the ages < this value that will belong in this bin
+    strata:     optionally, a list of (column name, bin limits) pairs to stratify by instead of age and sex
+    mask:       optionally, a bool array of the rows to use (such as a DatasetFilter mask over the master table)
 
 Returns:
-    0:  a dictionary containing the indices
+    0:  a StratifiedSampler for the data
 """
-def createIndices(csvdata, ageRangeLimits=[20, 30, 40, 50, 60, 70, 80, 101]):
-    numRows = len(csvdata.index)
-    menArr = [[] for x in ageRangeLimits]
-    womenArr = [[] for x in ageRangeLimits]
-    for i in range(numRows):
-        male = csvdata["isMale"][i] > 0.5
-        age = csvdata["age"][i]
-        binNum = 0
-        for binLimit in ageRangeLimits:
-            if age < binLimit:
-                break
-            else:
-                binNum = binNum + 1
-        if male:
-            menArr[binNum] += [i]
-        else:
-            womenArr[binNum] += [i]
-    resultDict = {"Men":menArr, "Women":womenArr, "AgeBinLimits":ageRangeLimits}
-    return  resultDict
+def createIndices(csvdata, ageRangeLimits=[20, 30, 40, 50, 60, 70, 80, 101], strata=None, mask=None):
+    if strata is None:
+        strata = [("age", ageRangeLimits), ("isMale", [0.5, 1.5])]
+    return StratifiedSampler(csvdata, strata=strata, mask=mask)
 
 """
-Helper function to extract the next set of indices from the requested bin
-Always returns numRequested indices, and handles looping back to the
-beginning of the bin if necessary
+Reads a single face image from disk, and resizes it to the requested size
 
 Params
-    binList:    the list of indices in this bin
-    offset:     the offset to start grabbing indices from
-    numRequested:   the number of indices to return
+    path:       the path of the image file
+    imageSize:  the width/height of the returned image
 
 Returns
-    0:  the list of indices extracted from the bin
-    1:  the new offset we ended at
-    2:  whether we passed over the end of the bin
+    0:  a uint8 numpy array of the image ([imageSize, imageSize, 3])
 """
-def _getFromBin(binList, offset, numRequested):
-    startPt = offset
-    endPt = min(startPt + numRequested, len(binList))
-    returnList = binList[startPt:endPt]
-    length = endPt - startPt
-    looped = False
-    while length < numRequested:
-        looped = True
-        startPt = 0
-        endPt = min(numRequested - length, len(binList))
-        returnList += binList[startPt:endPt]
-        length = len(returnList)
-
-    return returnList, endPt, looped
+def loadImage(path, imageSize):
+    image = imread(path)
+    if len(image.shape) == 2:
+        # expand b/w images to 3 channels
+        image = np.dstack([image, image, image])
+    if image.shape[0] != imageSize or image.shape[1] != imageSize:
+        image = imresize(image, [imageSize, imageSize, 3])
+    return image[:, :, :3]
 
 """
-Extracts a batch of images from the data. If the previous state is stored and
-returned, the function can be called again to iterate through the data in batches
+Extracts a batch of images from the data. The sampler keeps track of where the last batch ended,
+so the function can be called again to iterate through the data in batches
 
 Params
-    indices:    the indices dict for the data
-    csvdata:    the pandas dataframe from the .csv of faces we are using
+    indices:    the StratifiedSampler for the data
+    csvdata:    the ColumnStore (or pandas dataframe) of the .csv of faces we are using
     numPerBin:  the number of images per category (age group/sex combination) we want to extract
     imageSize:  the size of the images to extract
-    prevState:  the state containing the last indices we extracted, so we can get the next batch
+    packedData: an optional PackedDataset. If given, images are gathered from the packed shards
+                instead of being decoded from disk
+    out:        an optional batch dictionary of preallocated float32 arrays to fill in place
+    imageCache: an optional ImageCache. If given, each image is only decoded and resized once per size
 
 Returns
     0:  a dictionary containing a vector for all the images (batchSize x imageSize),
         a vector of the ages (batchSize x 1), and a vector of the sexes (batchSize x 1) for the batch
-    1:  the new state, whcih can be passed back in to get the next batch
-    2:  a bool indicating whether we have visited all images at least one (since the start of the state)
+    1:  a bool indicating whether we have visited all images at least once this epoch
 """
-def getBatch(indices, csvdata, numPerBin=100, imageSize=250, prevState=None):
-    ageBins = indices["AgeBinLimits"]
-    numBins = len(ageBins)
-    if prevState is None:
-        prevState = np.zeros([numBins, 2, 2], dtype=int)
-    batchIndices = np.zeros([numPerBin * numBins * 2], dtype=int)
-    menLists = indices["Men"]
-    womenLists = indices["Women"]
-    lastIdx = 0
-    for i in range(numBins):
-        newMen, newOffset, didLoop = _getFromBin(menLists[i], prevState[i, 1, 0], numPerBin)
-        batchIndices[lastIdx:lastIdx+numPerBin] = newMen
-        prevState[i, 1, 0] = newOffset
-        if didLoop:
-            prevState[i, 1, 1] = 1
-        lastIdx = lastIdx+numPerBin
-        newWomen, newOffset, didLoop = _getFromBin(womenLists[i], prevState[i, 0, 0], numPerBin)
-        batchIndices[lastIdx:lastIdx + numPerBin] = newWomen
-        prevState[i, 0, 0] = newOffset
-        if didLoop:
-            prevState[i, 1, 0] = 1
-        lastIdx = lastIdx + numPerBin
-    imageArr = np.zeros([numPerBin * numBins * 2]+[imageSize, imageSize, 3], dtype=np.float32)
-    sexArr = np.zeros([numPerBin * numBins * 2, 1], dtype=np.float32)
-    ageArr = np.zeros([numPerBin * numBins * 2, 1], dtype=np.float32)
-    i = 0
-    for idx in batchIndices:
-        path = csvdata["path"][idx]
-        age = csvdata["age"][idx]
-        sex = csvdata["isMale"][idx]
-        image = imread(path)
-        if image.shape != imageSize:
-            image = imresize(image, [imageSize, imageSize, 3])
-        if len(image.shape) == 2:
-            image = np.resize(image, imageSize)
-        # scale to [-1,1] range of tanh
-        imageArr[i,:,:] = image / 255.0
-        sexArr[i] = sex
-        ageArr[i] = age / 100.0
-        i = i + 1
+def getBatch(indices, csvdata, numPerBin=100, imageSize=250, packedData=None, out=None, imageCache=None):
+    batchSize = numPerBin * indices.numBins
+    batchIndices, didVisitAll = indices.nextBatch(numPerBin)
+    if out is None:
+        out = {"image": np.zeros([batchSize, imageSize, imageSize, 3], dtype=np.float32),
+               "sex": np.zeros([batchSize, 1], dtype=np.float32),
+               "age": np.zeros([batchSize, 1], dtype=np.float32)}
+    imageArr = out["image"]
+    sexArr = out["sex"]
+    ageArr = out["age"]
+    if packedData is not None:
+        # images were decoded and resized ahead of time, so just gather them from the shards
+        imageArr[:] = packedData.gather(batchIndices)
+        sexArr[:] = packedData.isMale[batchIndices].reshape([-1, 1])
+        ageArr[:] = packedData.age[batchIndices].reshape([-1, 1])
+    else:
+        paths = csvdata["path"]
+        i = 0
+        for idx in batchIndices:
+            if imageCache is not None:
+                imageArr[i] = imageCache.get(paths[idx], imageSize, loadImage)
+            else:
+                imageArr[i] = loadImage(paths[idx], imageSize)
+            i = i + 1
+        sexArr[:] = np.asarray(csvdata["isMale"])[batchIndices].reshape([-1, 1])
+        ageArr[:] = np.asarray(csvdata["age"])[batchIndices].reshape([-1, 1])
     # scale to [-1,1] range of tanh
-    imageArr = (imageArr * 2) - 1
-    sexArr = (sexArr* 2) - 1
-    ageArr = np.min((ageArr * 2) - 1, 1).reshape([-1, 1])
-    didVisitAll = np.sum(prevState[:,:,1]) == numBins * 2
-    return {"image":imageArr, "sex":sexArr, "age":ageArr}, prevState, didVisitAll
+    imageArr *= 2 / 255.0
+    imageArr -= 1
+    sexArr *= 2
+    sexArr -= 1
+    ageArr *= 2 / 100.0
+    ageArr -= 1
+    return out, didVisitAll
 
 
 """
-scrables up the order of indices
-this randomization is important, because we want to make sure batches aren't always the same
+Worker process target for the "process" DataLoader backend
+Continuously fills free slots of the shared memory BatchRing with batches. Only the slot numbers
+are passed between processes, never the image data
+
 Params:
-    indices:    the indices dict we want to randomize
+    indices:    this worker's own shuffled copy of the StratifiedSampler
+    csvData:    the ColumnStore (or pandas dataframe) of the .csv of faces we are using
+    numPerBin:  the number of images per category we want to extract
+    imageSize:  the size of the images to extract
+    packedData: an optional PackedDataset to gather images from
+    ring:       the shared BatchRing to fill
+    producerNum:    this worker's number, used for the ring's counters
+    imageCache: an optional ImageCache to load images through
 """
-def _randomizeIndices(indices):
-    menList = indices["Men"]
-    womenList = indices["Women"]
-    ageBins = indices["AgeBinLimits"]
-    numBins = len(ageBins)
-    for i in range(numBins):
-        shuffle(menList[i])
-        shuffle(womenList[i])
-
-
+def _process_runner(indices, csvData, numPerBin, imageSize, packedData, ring, producerNum, imageCache=None):
+    # forked workers inherit the parent's random state, so reseed to keep the epoch shuffles independent
+    seed()
+    np.random.seed()
+    while(True):
+        slotNum, slot = ring.acquireFree(producerNum)
+        _, didFinish = getBatch(indices, csvData, numPerBin=numPerBin, imageSize=imageSize,
+                                packedData=packedData, out=slot, imageCache=imageCache)
+        ring.publish(slotNum, didFinish, producerNum)
+        if didFinish == True:
+            indices.newEpoch()
 
 """
 Class to control data loading. benefits of using this class:
-    -data is loaded on it's own thread,
-    -data is stored in a buffer that can be pulled from
-    -and a cache is supported so the first batch is loaded quickly from disk
+    -data is loaded on it's own thread(s) or worker processes,
+    -batches are written into a fixed ring of preallocated slots, so no arrays are allocated per batch
+    -and a warm-start cache is supported, so training can start before the workers have filled any slots
     -data is randomized after each epoch
 """
 class DataLoader(object):
@@ -308,75 +246,80 @@ class DataLoader(object):
     Initialize a DataLoader instance
 
     Params:
-        indices:    the indices dict for the data
-        csvData:    the pandas dataframe from the .csv of faces we are using
+        indices:    the StratifiedSampler for the data
+        csvData:    the ColumnStore (or pandas dataframe) of the .csv of faces we are using
+        numWorkerThreads:   the number of worker threads (or processes) loading batches
         numPerBin:  the number of images per category (age group/sex combination) we want to extract
-        bufferMax:  the max size of the buffer that holds ready batches
-        useCached:  if true, will try to load the first batch from disk to improve initial load time
+        bufferMax:  the number of batch slots in the ring that holds ready batches
+        useCached:  if true, will serve batches from the warm-start cache while the workers start up,
+                    or record the first cacheBatches batches to create one
+        packedData: an optional PackedDataset. If given, batches are gathered from the packed
+                    image shards rather than decoding each image from disk
+        backend:    "thread" to load batches on threads, or "process" to load them in worker processes
+                    that write into shared memory, so image decoding isn't limited by the GIL
+        imageCache: an optional ImageCache. If given, images are only decoded and resized once,
+                    rather than once per epoch
+        cacheBatches:   the number of batches stored in a new warm-start cache
     """
-    def __init__(self, indices, csvData, numWorkerThreads=1, numPerBin=100, imageSize=100, bufferMax=5, useCached=True, debugLogs=False):
+    def __init__(self, indices, csvData, numWorkerThreads=1, numPerBin=100, imageSize=100, bufferMax=5, useCached=True, debugLogs=False, packedData=None, backend="thread", imageCache=None, cacheBatches=32):
+        if packedData is not None and packedData.imageSize != imageSize:
+            raise ValueError("packed data is " + str(packedData.imageSize) + "px, but loader requested " + str(imageSize) + "px")
+        if backend not in ["thread", "process"]:
+            raise ValueError("unknown DataLoader backend: " + str(backend))
         self.imageSize=imageSize
         self.epochNum=0
         self.csvData = csvData
+        self.packedData = packedData
+        self.imageCache = imageCache
         self.numPerBin = numPerBin
-        self.lock = threading.Condition()
+        self.backend = backend
+        self.bufferMax = bufferMax
+        self.ring = BatchRing(bufferMax, numPerBin * indices.numBins, imageSize, numProducers=numWorkerThreads,
+                              shared=(backend == "process"))
+        self.currentSlot = None
         threadList = []
         for i in range(numWorkerThreads):
-            threadIndex = deepcopy(indices)
-            _randomizeIndices(threadIndex)
-            newThread = threading.Thread(target=self._thread_runner, args=[threadIndex])
+            threadIndex = indices.copy()
+            threadIndex.newEpoch()
+            if backend == "process":
+                newThread = multiprocessing.Process(target=_process_runner,
+                                                    args=[threadIndex, csvData, numPerBin, imageSize, packedData,
+                                                          self.ring, i, imageCache])
+            else:
+                newThread = threading.Thread(target=self._thread_runner, args=[threadIndex, i])
             newThread.daemon = True
             threadList += [newThread]
         self.threadList = threadList
-        self.needsCache=False
-        self.bufferMax = bufferMax
-        self.buffer = []
-        self.cachePath="./batch_cache.p"
         self.debug = debugLogs
-        #if we are using caching, retore the old cache file, or mark that we need to generate one
+        # if we are using caching, serve batches from the warm-start cache while the workers ramp up,
+        # or record the first batches to create one
+        self.warmCache = None
+        self.cacheBatch = None
         if useCached:
-            if os.path.exists(self.cachePath):
-                file = open(self.cachePath, "rb")
-                self.buffer = pickle.load(file)
-                file.close()
-                #check to ensure size is right
-                if self.buffer[0]["image"].shape[1] == imageSize and self.buffer[0]["image"].shape[0] % numPerBin == 0:
-                    print("restored cache [" + str(len(self.buffer)) + " in buffer]")
-                else:
-                    self.needsCache = True
-                    self.buffer = []
-                    print("cached failed; wrong size")
-            else:
-                self.needsCache = True
+            fingerprint = datasetFingerprint(csvData)
+            self.warmCache = WarmStartCache(fingerprint, imageSize, numPerBin, numPerBin * indices.numBins,
+                                            maxBatches=cacheBatches)
+            if self.warmCache.remaining() > 0:
+                print("restored cache [" + str(self.warmCache.remaining()) + " in buffer]")
+                self.cacheBatch = {"image": np.empty([self.ring.batchSize, imageSize, imageSize, 3], dtype=np.float32),
+                                   "sex": np.empty([self.ring.batchSize, 1], dtype=np.float32),
+                                   "age": np.empty([self.ring.batchSize, 1], dtype=np.float32)}
 
     """
     this function is the internal thread that is run by the class
-    continuously loads batches of data from disk, at puts them in the ready buffer
+    continuously loads batches of data from disk, filling free slots of the ring in place
     """
-    def _thread_runner(self, indices):
-        currentState = None
+    def _thread_runner(self, indices, producerNum):
         while(True):
-            batchData, currentState, didFinish = getBatch(indices, self.csvData, numPerBin=self.numPerBin, prevState=currentState, imageSize=self.imageSize)
-            self.lock.acquire()
-            while len(self.buffer) >= self.bufferMax:
-                self.lock.wait()
-            self.buffer.append(batchData)
+            slotNum, slot = self.ring.acquireFree(producerNum)
+            _, didFinish = getBatch(indices, self.csvData, numPerBin=self.numPerBin, imageSize=self.imageSize,
+                                    packedData=self.packedData, out=slot, imageCache=self.imageCache)
+            self.ring.publish(slotNum, didFinish, producerNum)
             if self.debug:
-                print("Added Item [buffer size: " + str(len(self.buffer)) + "]")
-            self.lock.notify()
-            #generate cache file if necessary
-            if self.needsCache:
-                file = open(self.cachePath, "wb")
-                pickle.dump( self.buffer, file)
-                file.close()
-                self.needsCache = False
-            self.lock.release()
+                print("Added Item [buffer size: " + str(self.ring.occupancy()) + "]")
             if didFinish == True:
                 # finished an entire epoch. Shuffle data, reset state
-                self.epochNum = self.epochNum + 1
-                currentState = None
-                _randomizeIndices(indices)
-
+                indices.newEpoch()
 
     """
     start the data loading process
@@ -385,8 +328,22 @@ class DataLoader(object):
         for thread in self.threadList:
             thread.start()
 
+    """
+    stops any worker processes, and waits for the warm-start cache to be written.
+    Worker threads are daemons, and exit with the program
+    """
+    def stop(self):
+        if self.backend == "process":
+            for process in self.threadList:
+                process.terminate()
+                process.join()
+        if self.warmCache is not None:
+            self.warmCache.flush()
+
     """
     Grab the next batch off the DataLoader's buffer
+    The returned arrays are a slot of the ring, not a copy. They stay valid until the next call to
+    getData or releaseData, after which the slot is reused for a new batch
 
     Returns:
         0:  a dictionary containing:
@@ -395,17 +352,76 @@ class DataLoader(object):
                 -a vector of the sexes (batchSize x 1) for the batch
     """
     def getData(self):
-        self.lock.acquire()
-        while len(self.buffer) == 0:
-            print("[Empty Buffer. Waiting on an item]")
-            self.lock.wait()
-        nextBatch = self.buffer.pop(0)
+        self.releaseData()
+        # cached batches are only used while the workers haven't filled any slots yet
+        if self.cacheBatch is not None and self.ring.occupancy() <= 0 and self.warmCache.nextBatch(self.cacheBatch):
+            return self.cacheBatch
+        slotNum, nextBatch, didFinish = self.ring.acquireReady()
+        self.currentSlot = slotNum
+        if didFinish == True:
+            self.epochNum = self.epochNum + 1
         if self.debug:
-            print("Removed Item [buffer size: " + str(len(self.buffer)) + "]")
-        self.lock.notify()
-        self.lock.release()
+            print("Removed Item [buffer size: " + str(self.ring.occupancy()) + "]")
+        #record batches for the warm-start cache if necessary. The file is written on a background thread
+        if self.warmCache is not None:
+            self.warmCache.record(nextBatch)
         return nextBatch
 
+    """
+    Returns the batch from the last call to getData to the ring, so workers can refill it
+    Called automatically by getData
+    """
+    def releaseData(self):
+        if self.currentSlot is not None:
+            self.ring.release(self.currentSlot)
+            self.currentSlot = None
+
+    """
+    Returns:
+        0:  a dictionary of the loader's counters: ring occupancy, producer stall time,
+            consumer wait time, batches produced/consumed, the epoch number, and the image cache hit rates
+    """
+    def getStats(self):
+        stats = self.ring.stats()
+        stats["epoch"] = self.epochNum
+        if self.imageCache is not None:
+            stats["image_cache"] = self.imageCache.stats()
+        return stats
+
+"""
+Builds the filtered dataset from the master csv, creating the master csv first if it doesn't exist
+Filter masks are cached next to the master csv, so trying new thresholds doesn't recompute the old ones
+
+Params
+    datasetDir: the directory of the root of the IMDB-WIKI dataset
+    masterPath: the path of the unfiltered master csv. If None, the master table isn't saved
+    filterArgs: optionally, a dictionary of _filterDataframe thresholds
+    probeCachePath: the path used to cache image header results
+
+Returns
+    0:  the filtered dataframe, with a fresh index
+"""
+def _filterMasterCsv(datasetDir, masterPath, filterArgs=None, probeCachePath="./probe_cache.p"):
+    args = {"ageRange": [10, 100], "minScore": 1, "minRes": (60*60), "filterGender": True, "filterRGB": True,
+            "filterMult": True}
+    if filterArgs is not None:
+        args.update(filterArgs)
+    if masterPath is not None and os.path.exists(masterPath):
+        print("restoring master csv...")
+        master = pd.read_csv(masterPath)
+    else:
+        master = createMasterCsv(datasetDir, probeCachePath=probeCachePath)
+        if masterPath is not None:
+            master.to_csv(masterPath, index=False, encoding='utf-8')
+            print(masterPath + " saved")
+    if masterPath is not None:
+        datasetFilter = DatasetFilter(master, cachePath=masterPath + ".masks.p", sourceMtime=os.path.getmtime(masterPath))
+    else:
+        datasetFilter = DatasetFilter(master)
+    csvdata = _filterDataframe(master, datasetFilter=datasetFilter, **args)
+    datasetFilter.save()
+    return csvdata.reset_index(drop=True)
+
 """
 Function to load the csv data and indices from disk, or create them if needed
 
@@ -415,33 +431,55 @@ Params
                 if no file exists at the path, a new one will be generated
     indicesPath:    the path of the indices from the data
                     if no file exists at the path, a new one will be generated
+    storeDir:   the directory of the memory mapped column store built from the csv
+                if None, the csv is parsed into a pandas dataframe instead
+    masterPath: the path of the unfiltered master csv of every face in the dataset
+                if the filtered csv is missing, it is rebuilt from this (with cached filter masks) instead of
+                re-reading the dataset. If no file exists at the path, a new one will be generated
+    filterArgs: optionally, a dictionary of _filterDataframe thresholds (ageRange, minScore, ...) to use
+                when the filtered csv is rebuilt
+    probeCachePath: the path used to cache image header results when the master csv is created
 
 Returns
-    0:  the csv data represented as a pandas dataframe
-    1:  the index data
+    0:  the csv data, as a ColumnStore (or a pandas dataframe if storeDir is None)
+    1:  the StratifiedSampler for the data
 """
-def LoadFilesData(datasetDir, csvPath="./dataset.csv", indicesPath="./indices.p"):
+def LoadFilesData(datasetDir, csvPath="./dataset.csv", indicesPath="./indices.p", storeDir="./dataset_store",
+                  masterPath="./dataset_master.csv", filterArgs=None, probeCachePath="./probe_cache.p"):
+    csvCreated = False
     if os.path.exists(csvPath):
-        print("restoring csv data...")
-        csvdata = pd.read_csv(csvPath)
+        if storeDir is not None:
+            csvdata = LoadColumnStore(csvPath, storeDir)
+        else:
+            print("restoring csv data...")
+            csvdata = pd.read_csv(csvPath)
     else:
         print("creating " + csvPath + "...")
-        csvdata = createCsv(datasetDir)
+        csvdata = _filterMasterCsv(datasetDir, masterPath, filterArgs, probeCachePath=probeCachePath)
         csvdata.to_csv(csvPath, index=False, encoding='utf-8')
         print(csvPath + " saved")
-
+        if storeDir is not None:
+            csvdata = writeColumnStore(csvdata, storeDir, sourcePath=csvPath)
+        csvCreated = True
+
+    if os.path.exists(indicesPath) and csvCreated:
+        # the old indices point at rows of the old csv
+        print("csv was rebuilt, so " + indicesPath + " is out of date")
+        os.remove(indicesPath)
     if os.path.exists(indicesPath):
         print("restoring indices data...")
-        file = open(indicesPath, "rb")
-        indices = pickle.load(file)
+        indices = StratifiedSampler.load(indicesPath)
+        if not isinstance(indices, StratifiedSampler):
+            # indices saved by older versions are a dict of python lists
+            print("converting old indices format...")
+            indices = createIndices(csvdata, ageRangeLimits=indices["AgeBinLimits"])
+            indices.save(indicesPath)
     else:
         print("creating " + indicesPath + "...")
         indices = createIndices(csvdata)
-        file = open(indicesPath, "wb")
-        pickle.dump(indices, file)
+        indices.save(indicesPath)
         print(indicesPath + " saved")
-    file.close()
-    _randomizeIndices(indices)
+    indices.newEpoch()
     return csvdata, indices
 
 
@@ -0,0 +1,125 @@
+import os
+import pickle
+import numpy as np
+
+"""
+Filters the unfiltered master table of the dataset using cached per-criterion masks
+Each filter criterion (face score, resolution, age range, sex, RGB, second face) is evaluated once per
+threshold as a boolean mask over every row of the master table. Masks are kept in memory, and can be saved
+to disk, so trying a new combination of thresholds only has to AND together masks that already exist
+"""
+class DatasetFilter(object):
+    """"""
+
+    """
+    Initialize a DatasetFilter instance
+
+    Params:
+        master:     the ColumnStore or pandas dataframe of the unfiltered dataset
+        cachePath:  if specified, masks are saved to and restored from this file
+        sourceMtime:    the modification time of the file the master table was read from.
+                        Cached masks saved for a different time are discarded
+    """
+    def __init__(self, master, cachePath=None, sourceMtime=None):
+        self.master = master
+        self.numRows = len(master)
+        self.cachePath = cachePath
+        self.sourceMtime = sourceMtime
+        self._masks = {}
+        if cachePath is not None and os.path.exists(cachePath):
+            file = open(cachePath, "rb")
+            cache = pickle.load(file)
+            file.close()
+            if cache["sourceMtime"] == sourceMtime and cache["numRows"] == self.numRows:
+                self._masks = cache["masks"]
+
+    """
+    Returns the mask for a single filter criterion, computing it if it isn't cached
+
+    Params:
+        criterion:  the name of the filter: "minScore", "minRes", "ageRange", "filterGender", "filterRGB" or "filterMult"
+        value:      the threshold of the filter (or True for the filters without one)
+
+    Returns:
+        0:  a bool numpy array, true for the rows that pass the filter
+    """
+    def mask(self, criterion, value=True):
+        key = (criterion, tuple(value) if isinstance(value, (list, tuple)) else value)
+        if key not in self._masks:
+            # masks are stored bit-packed, so hundreds of them fit in a few MB
+            self._masks[key] = np.packbits(self._computeMask(criterion, value))
+        return np.unpackbits(self._masks[key])[:self.numRows].astype(bool)
+
+    def _column(self, name):
+        column = self.master[name]
+        if hasattr(column, "values"):
+            return np.asarray(column.values)
+        elif isinstance(column, np.ndarray):
+            return np.asarray(column)
+        # string columns of a ColumnStore are decoded row by row
+        return np.asarray(column[np.arange(self.numRows)])
+
+    def _computeMask(self, criterion, value):
+        if criterion == "minScore":
+            return self._column("face_score").astype(np.float64) > value
+        elif criterion == "minRes":
+            return self._column("image_resolution").astype(np.float64) > value
+        elif criterion == "ageRange":
+            age = self._column("age").astype(np.float64)
+            return (age > value[0]) & (age < value[1])
+        elif criterion == "filterGender":
+            return ~np.isnan(self._column("isMale").astype(np.float64))
+        elif criterion == "filterRGB":
+            return self._column("image_format").astype(str) == "RGB"
+        elif criterion == "filterMult":
+            secondFace = self._column("second_face").astype(np.float64)
+            return np.isnan(secondFace)
+        raise ValueError("unknown filter criterion " + str(criterion))
+
+    """
+    Combines the masks for a set of filter thresholds, in the same order _filterDataframe applies them
+
+    Params:
+        ageRange:   a vector containing the min and max age to keep, or None
+        minScore:   the minimum face score to keep, or None
+        minRes:     the minimum resolution image to keep, or None
+        filterGender:   whether to trim out faces with unlabeled genders
+        filterRGB:  whether to filter out b/w images (or other encodings)
+        filterMult: whether images with multiple faces should be filtered out
+        printResults:   if true, prints the number of images remaining after each filter
+
+    Returns:
+        0:  a bool numpy array, true for the rows that pass every filter
+    """
+    def combinedMask(self, ageRange=[10, 100], minScore=1, minRes=(60*60), filterGender=True, filterRGB=True,
+                     filterMult=True, printResults=True):
+        steps = [("minScore", minScore, minScore is not None, "filtered low quality faces: "),
+                 ("minRes", minRes, minRes is not None, "filtered low res images: "),
+                 ("ageRange", ageRange, ageRange is not None, "filtered bad ages: "),
+                 ("filterGender", True, filterGender, "filtered null sex: "),
+                 ("filterRGB", True, filterRGB, "filtered non-RGB images: "),
+                 ("filterMult", True, filterMult, "filtered out multiple faces: ")]
+        combined = np.ones(self.numRows, dtype=bool)
+        if printResults:
+            print(self.numRows, " images found")
+        for criterion, value, enabled, message in steps:
+            if not enabled:
+                continue
+            combined &= self.mask(criterion, value)
+            if printResults:
+                print(message, int(np.count_nonzero(combined)), " images remaining")
+        return combined
+
+    """
+    Saves the cached masks to cachePath, so later runs can reuse them
+    """
+    def save(self):
+        if self.cachePath is None:
+            return
+        cache = {"sourceMtime": self.sourceMtime, "numRows": self.numRows, "masks": self._masks}
+        # write to a temp file first, so a crash mid-write never corrupts the cache
+        tmpPath = self.cachePath + ".tmp"
+        file = open(tmpPath, "wb")
+        pickle.dump(cache, file)
+        file.close()
+        os.rename(tmpPath, self.cachePath)
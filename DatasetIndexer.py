@@ -0,0 +1,156 @@
+import os
+import time
+import pickle
+import numpy as np
+from PIL import Image
+from multiprocessing.pool import ThreadPool
+
+"""
+Converts a vector of MATLAB datenums into calendar years
+MATLAB counts days from the year 0, python's ordinals count from the year 1, hence the 366 day offset
+
+Params
+    datenums:   a numpy array of MATLAB datenums
+    minDatenum: datenums below this are too small to convert, and are clamped to 400
+
+Returns
+    0:  a numpy int array of the years
+"""
+def matlabDatenumToYear(datenums, minDatenum=367):
+    datenums = np.nan_to_num(np.asarray(datenums, dtype=np.float64)).astype(np.int64)
+    datenums[datenums < minDatenum] = 400
+    daysSinceYear1 = (datenums - 366 - 1).astype("timedelta64[D]")
+    dates = np.datetime64("0001-01-01", "D") + daysSinceYear1
+    return dates.astype("datetime64[Y]").astype(np.int64) + 1970
+
+"""
+Prints progress and throughput for a long running job, at most once every interval seconds
+"""
+class ProgressReporter(object):
+    """"""
+
+    """
+    Params:
+        total:      the total number of items the job will process
+        label:      a label to prefix each line with
+        interval:   the minimum number of seconds between printed lines
+    """
+    def __init__(self, total, label="progress", interval=5.0):
+        self.total = total
+        self.label = label
+        self.interval = interval
+        self.count = 0
+        self.startTime = time.time()
+        self.lastPrint = self.startTime
+
+    """
+    Records that more items have been processed, and prints if enough time has passed
+
+    Params:
+        numDone:    the number of items that were just processed
+    """
+    def update(self, numDone=1):
+        self.count = self.count + numDone
+        now = time.time()
+        if now - self.lastPrint >= self.interval:
+            self.lastPrint = now
+            self._print(now)
+
+    """
+    Prints the final totals for the job
+    """
+    def finish(self):
+        self._print(time.time())
+
+    def _print(self, now):
+        elapsed = max(now - self.startTime, 1e-6)
+        rate = self.count / elapsed
+        remaining = (self.total - self.count) / rate if rate > 0 else float("inf")
+        print(self.label + ": " + str(self.count) + "/" + str(self.total) + " (" + "%.0f" % rate + "/sec, " +
+              "%.0f" % elapsed + "s elapsed, " + "%.0f" % remaining + "s remaining)")
+
+"""
+Reads the header of a single image, to find its mode and size without decoding the pixels
+
+Params
+    path:   the path of the image
+    cached: the previous probe result for this path, or None
+
+Returns
+    0:  the path
+    1:  a tuple of (mtime, mode, width, height). width and height are -1 if the image can't be read
+    2:  whether the image had to be opened (False if the cached result was still valid)
+"""
+def _probeImage(path, cached=None):
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        print("error reading file " + path)
+        return path, (-1, None, -1, -1), True
+    if cached is not None and cached[0] == mtime:
+        return path, cached, False
+    try:
+        img = Image.open(path)
+        w, h = img.size
+        result = (mtime, img.mode, w, h)
+        img.close()
+    except IOError:
+        print("error reading file " + path)
+        result = (mtime, None, -1, -1)
+    return path, result, True
+
+"""
+Reads the mode and size of every image, using a pool of threads
+Results are cached on disk keyed by path and modification time, so an interrupted run can resume,
+and a rerun only opens new or changed files
+
+Params
+    paths:      the paths of the images to probe
+    cachePath:  the path of the probe cache file
+    numWorkers: the number of threads opening image headers
+    saveEvery:  the probe cache is saved every time this many new images have been probed
+
+Returns
+    0:  a numpy object array of the image modes
+    1:  a numpy int array of the widths
+    2:  a numpy int array of the heights
+"""
+def probeImages(paths, cachePath="./probe_cache.p", numWorkers=16, saveEvery=20000):
+    probeCache = {}
+    if cachePath is not None and os.path.exists(cachePath):
+        file = open(cachePath, "rb")
+        probeCache = pickle.load(file)
+        file.close()
+        print("restored " + str(len(probeCache)) + " cached image probes")
+    progress = ProgressReporter(len(paths), label="probing images")
+    sinceSave = 0
+    pool = ThreadPool(numWorkers)
+    try:
+        jobs = pool.imap_unordered(lambda p: _probeImage(p, probeCache.get(p)), paths, chunksize=256)
+        for path, result, wasOpened in jobs:
+            probeCache[path] = result
+            progress.update()
+            if wasOpened:
+                sinceSave = sinceSave + 1
+            if cachePath is not None and sinceSave >= saveEvery:
+                _saveProbeCache(probeCache, cachePath)
+                sinceSave = 0
+    finally:
+        pool.close()
+        pool.join()
+        if cachePath is not None and sinceSave > 0:
+            _saveProbeCache(probeCache, cachePath)
+    progress.finish()
+    results = [probeCache[p] for p in paths]
+    imFormat = np.array([r[1] for r in results], dtype=object)
+    imWidth = np.array([r[2] for r in results], dtype=int)
+    imHeight = np.array([r[3] for r in results], dtype=int)
+    return imFormat, imWidth, imHeight
+
+def _saveProbeCache(probeCache, cachePath):
+    # write to a temp file first, so a crash mid-write never corrupts the cache
+    tmpPath = cachePath + ".tmp"
+    file = open(tmpPath, "wb")
+    pickle.dump(probeCache, file)
+    file.close()
+    os.rename(tmpPath, cachePath)
@@ -1,30 +1,40 @@
+import os
+import sys
 import cv2
-from DataLoader import LoadFilesData, DataLoader
+import time
+import threading
+import multiprocessing
 import numpy as np
+from collections import deque
 from Visualization import visualizeImages
 import glob
 from math import ceil
-import NeuralNet
 from Sampler import randomSample
 
+# cascades parsed by this process, keyed by cascade directory. Parsing the larger cascade files takes
+# far longer than running them on a 64x64 image, so each process only parses them once
+_loadedCascades = {}
+
+def _loadCascades(cascadePath):
+    if cascadePath not in _loadedCascades:
+        cascadeFiles = sorted(glob.glob(cascadePath + "/*.xml"))
+        _loadedCascades[cascadePath] = [cv2.CascadeClassifier(f) for f in cascadeFiles]
+    return _loadedCascades[cascadePath]
+
 """
-Attempts to detect a face in an image using the OpenCV Haar Cascade
+Runs cascades over a grayscale image, stopping at the first one that finds a face
 
 Params
-    image:  the image to detect a face in
-    cascadePath:    the directory containing cascade cml files to match against
+    grayImage:  the grayscale image to detect a face in
+    cascades:   the list of parsed cascades
+    order:      the order to try the cascades in
 
 Returns
-    0:  a bool indicating whether a face was found
+    0:  the index of the cascade that found a face, or -1 if none did
 """
-def detectedFace(image, cascadePath="./cascades"):
-    for thisCascade in glob.glob(cascadePath+"/*.xml"):
-        #convert to grayscale
-        grayImage = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-
-        #perform opencv face detection
-        faceCascade = cv2.CascadeClassifier(thisCascade)
-        faces = faceCascade.detectMultiScale(
+def _findFace(grayImage, cascades, order):
+    for cascadeNum in order:
+        faces = cascades[cascadeNum].detectMultiScale(
             grayImage,
             scaleFactor=1.1,
             minNeighbors=0,
@@ -32,35 +42,266 @@ def detectedFace(image, cascadePath="./cascades"):
             maxSize=(64, 64),
         )
         if len(faces) > 0:
-            return True
-    return False
+            return cascadeNum
+    return -1
+
+def _initDetectorWorker(cascadePath):
+    # worker processes each run one cascade at a time, so opencv's own thread pool would only oversubscribe the cores
+    cv2.setNumThreads(1)
+    _loadCascades(cascadePath)
+
+def _detectChunk(args):
+    imageChunk, cascadePath, order = args
+    cascades = _loadCascades(cascadePath)
+    hits = np.empty(imageChunk.shape[0], dtype=np.int64)
+    for i in range(imageChunk.shape[0]):
+        hits[i] = _findFace(cv2.cvtColor(imageChunk[i], cv2.COLOR_BGR2GRAY), cascades, order)
+    return hits
+
+"""
+Attempts to detect a face in an image using the OpenCV Haar Cascade
+
+Params
+    image:  the image to detect a face in
+    cascadePath:    the directory containing cascade cml files to match against
+
+Returns
+    0:  a bool indicating whether a face was found
+"""
+def detectedFace(image, cascadePath="./cascades"):
+    cascades = _loadCascades(cascadePath)
+    grayImage = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return _findFace(grayImage, cascades, range(len(cascades))) >= 0
+
+"""
+Detects faces in batches of images, spread across a pool of worker processes
+Each worker parses the cascades once when it starts. Cascades are tried in order of how often they have
+found faces so far, so images with faces usually stop after the first cascade. An image counts as a face
+if any cascade finds one, so the order never changes the results
+"""
+class FaceDetectorEngine(object):
+    """"""
+
+    """
+    Initialize a FaceDetectorEngine instance
+
+    Params:
+        cascadePath:    the directory containing cascade xml files to match against
+        numWorkers:     the number of worker processes. If 0, images are processed in the calling process
+    """
+    def __init__(self, cascadePath="./cascades", numWorkers=multiprocessing.cpu_count()):
+        self.cascadePath = cascadePath
+        self.cascadeNames = [os.path.basename(f) for f in sorted(glob.glob(cascadePath + "/*.xml"))]
+        self.cascadeHits = np.zeros(len(self.cascadeNames), dtype=np.int64)
+        self.numWorkers = numWorkers
+        self.pool = None
+        if numWorkers > 0:
+            self.pool = multiprocessing.Pool(numWorkers, initializer=_initDetectorWorker, initargs=(cascadePath,))
+
+    """
+    Returns:
+        0:  the cascade indices in the order they will be tried, most hits first
+    """
+    def cascadeOrder(self):
+        return tuple(int(i) for i in np.argsort(-self.cascadeHits, kind="mergesort"))
+
+    """
+    Finds which images contain a detectable face
+
+    Params:
+        imageSet:   a uint8 numpy array of images ([n, rows, cols, 3])
+
+    Returns:
+        0:  a bool numpy array, true for each image where a face was found
+    """
+    def detect(self, imageSet):
+        order = self.cascadeOrder()
+        if self.pool is None:
+            hits = _detectChunk((imageSet, self.cascadePath, order))
+        else:
+            numChunks = min(imageSet.shape[0], self.numWorkers * 4)
+            chunks = np.array_split(imageSet, max(numChunks, 1))
+            hits = np.concatenate(self.pool.map(_detectChunk, [(c, self.cascadePath, order) for c in chunks]))
+        self.cascadeHits += np.bincount(hits[hits >= 0], minlength=len(self.cascadeNames))
+        return hits >= 0
+
+    """
+    Shuts down the worker processes
+    """
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+# engine used by detectErrorRate when none is given, created on first use
+_defaultEngine = None
 
 """
 Detects the percentage of images in which faces can't be indentified
 
 Params
-    imageMat:    a numoy array of images to search for faces in
+    imageMat:    a numoy array of images to search for faces in, scaled to [-1, 1] or already uint8
     printResults:   if true, will print results to the console for display
+    engine:     the FaceDetectorEngine to use. If None, a shared engine using every core is created
 
 Returns
     0:  the percent of images in whoch faces couldn't be found
     1:  a numpy array holding the faces that couldn't be recognized
 """
-def detectErrorRate(imageMat, printResults=True):
-    # convert to 8 bit int
-    imageSet = ((imageMat + 1) * (255 / 2)).astype(np.uint8)
+def detectErrorRate(imageMat, printResults=True, engine=None):
+    global _defaultEngine
+    if engine is None:
+        if _defaultEngine is None:
+            _defaultEngine = FaceDetectorEngine()
+        engine = _defaultEngine
+    if imageMat.dtype == np.uint8:
+        imageSet = imageMat
+    else:
+        # convert to 8 bit int
+        imageSet = ((imageMat + 1) * (255 / 2)).astype(np.uint8)
     numImages = imageSet.shape[0]
-    numFound = 0
-    errMat = np.zeros_like(imageSet)
-    for i in range(numImages):
-        thisImage = imageSet[i, :, :, :]
-        foundFace = detectedFace(thisImage)
-        if not foundFace:
-            errMat[numFound, :, ::] = thisImage
-            numFound = numFound + 1
+    missed = ~engine.detect(imageSet)
+    numFound = int(np.count_nonzero(missed))
+    errMat = imageSet[missed]
     if printResults:
         print ("Error Rate: "  + str(float(numFound*100)/numImages) + "% (" + str(numFound) + "/" + str(numImages) +")")
-    return float(numFound)/numImages, errMat[:numFound, :, :, :]
+    return float(numFound)/numImages, errMat
+
+"""
+Scores generated samples for detectable faces on a background thread, so training doesn't wait on the detector
+Samples are queued with the training round they were generated at, and the score is passed to a callback
+with that round once it's ready. If the detector falls behind, new samples are dropped rather than queued,
+so the training thread never blocks
+"""
+class AsyncFaceEvaluator(object):
+    """"""
+
+    """
+    Initialize an AsyncFaceEvaluator instance
+
+    Params:
+        onResult:   called from the background thread as onResult(num, faceAcc, info) when a score is ready
+        engine:     the FaceDetectorEngine to score with. If None, a new one using every core is created
+        maxPending: the maximum number of sample sets waiting to be scored
+    """
+    def __init__(self, onResult, engine=None, maxPending=2):
+        self.onResult = onResult
+        self.engine = engine if engine is not None else FaceDetectorEngine()
+        self._pending = deque()
+        self._pendingCount = threading.Semaphore(0)
+        self.maxPending = maxPending
+        self.submitted = 0
+        self.skipped = 0
+        self.scored = 0
+        self.submitTime = 0.0
+        self.errors = 0
+        self.lastError = None
+        self._stopped = False
+        self._idle = threading.Condition()
+        self._unfinished = 0
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    """
+    Queues a set of samples to be scored. Only called from the training thread
+
+    Params:
+        num:        the training round the samples were generated at
+        samples:    a numpy array of generated images, scaled to [-1, 1]
+        info:       a value passed back to onResult along with the score
+        startTime:  if the samples were generated just for this call, the time generation started,
+                    so it's included in the reported cost
+
+    Returns:
+        0:  False if the samples were dropped because too many sets are already waiting
+    """
+    def submit(self, num, samples, info=None, startTime=None):
+        if startTime is None:
+            startTime = time.time()
+        accepted = len(self._pending) < self.maxPending
+        if accepted:
+            with self._idle:
+                self._unfinished = self._unfinished + 1
+            self._pending.append((num, samples, info))
+            self._pendingCount.release()
+            self.submitted = self.submitted + 1
+        else:
+            self.skipped = self.skipped + 1
+        self.submitTime = self.submitTime + (time.time() - startTime)
+        return accepted
+
+    def _run(self):
+        while True:
+            self._pendingCount.acquire()
+            if self._stopped:
+                return
+            num, samples, info = self._pending.popleft()
+            try:
+                err, _ = detectErrorRate(samples, printResults=False, engine=self.engine)
+                self.onResult(num, 1 - err, info)
+                self.scored = self.scored + 1
+            except Exception as e:
+                # a failed round is logged and counted, so the thread keeps scoring later rounds
+                self.errors = self.errors + 1
+                self.lastError = e
+                print("face detection for round " + str(num) + " failed: " + repr(e))
+            finally:
+                with self._idle:
+                    self._unfinished = self._unfinished - 1
+                    self._idle.notify_all()
+
+    """
+    Returns:
+        0:  a dictionary with the number of sample sets submitted, skipped, scored and failed, and the
+            average time each submit cost the training thread
+    """
+    def stats(self):
+        calls = self.submitted + self.skipped
+        return {"submitted": self.submitted, "skipped": self.skipped, "scored": self.scored, "errors": self.errors,
+                "pending": len(self._pending), "submit_sec": self.submitTime / calls if calls > 0 else 0.0}
+
+    """
+    Stops the background thread once every queued sample set has been scored
+    Stops waiting early if the background thread has died, so shutdown can't hang
+
+    Params:
+        closeEngine:    if true, also shuts down the detector's worker processes
+    """
+    def close(self, closeEngine=True):
+        with self._idle:
+            while self._unfinished > 0 and self._thread.is_alive():
+                self._idle.wait(0.5)
+        self._stopped = True
+        self._pendingCount.release()
+        self._thread.join()
+        if closeEngine:
+            self.engine.close()
+
+"""
+Measures the detection throughput of the engine, across a range of worker counts
+
+Params
+    imageMat:   a numpy array of images scaled to [-1, 1], as generated by the network
+    workerCounts:   the numbers of worker processes to try. 0 runs in the calling process
+
+Returns
+    0:  a dictionary mapping each worker count to its images/sec
+"""
+def benchmarkDetector(imageMat, workerCounts=[0, 1, 2, 4, 8]):
+    results = {}
+    for numWorkers in workerCounts:
+        engine = FaceDetectorEngine(numWorkers=numWorkers)
+        # one untimed pass, so cascades are parsed and hit counts are learned before timing
+        detectErrorRate(imageMat[:max(1, numWorkers * 4)], printResults=False, engine=engine)
+        startTime = time.time()
+        detectErrorRate(imageMat, printResults=False, engine=engine)
+        elapsed = time.time() - startTime
+        engine.close()
+        results[numWorkers] = imageMat.shape[0] / elapsed
+        print("workers: " + str(numWorkers) + " " + "%.1f" % results[numWorkers] + " images/sec")
+    return results
 
 """
 Detects the percentage of images in the IMDB-WIKI dataset where the faces couldn't be detected
@@ -68,22 +309,30 @@ Detects the percentage of images in the IMDB-WIKI dataset where the faces couldn
 Params
     imageCount: the number of images to use in the sample
     printResults:   if true, will print results to the console for display
+    config:     a training config dictionary from TrainConfig, giving the dataset paths and loader settings.
+                If None, the defaults are used
 
 Returns
     0:  the percent of images in whoch faces couldn't be found
     1:  a numpy array holding the faces that couldn't be recognized
 """
-def errorInDataset(imageCount, printResults=True):
-    datasetDir = "/home/sanche/Datasets/IMDB-WIKI"
-    csvPath = "./dataset.csv"
-    indicesPath = "./indices.p"
-    csvdata, indices = LoadFilesData(datasetDir, csvPath, indicesPath)
-    numPerBin = int(ceil(imageCount/16.0))
-    loader = DataLoader(indices, csvdata, numPerBin=numPerBin, imageSize=64, numWorkerThreads=10, bufferMax=20,
-                        debugLogs=False, useCached=False)
+def errorInDataset(imageCount, printResults=True, config=None):
+    from DataLoader import LoadFilesData, DataLoader
+    from ImageCache import ImageCache
+    from TrainConfig import loadConfig
+    if config is None:
+        config = loadConfig()
+    csvdata, indices = LoadFilesData(config["dataset_dir"], config["csv_path"], config["indices_path"],
+                                     storeDir=config["store_dir"], masterPath=config["master_path"])
+    numPerBin = int(ceil(imageCount/float(indices.numBins)))
+    imageCache = ImageCache(config["image_cache_dir"]) if config["image_cache_dir"] is not None else ImageCache()
+    loader = DataLoader(indices, csvdata, numPerBin=numPerBin, imageSize=config["image_size"],
+                        numWorkerThreads=config["workers"], bufferMax=config["prefetch"], debugLogs=False,
+                        useCached=False, imageCache=imageCache, backend=config["backend"])
     loader.start()
     batchDict = loader.getData()
-    imageSet = batchDict["image"]
+    imageSet = np.array(batchDict["image"])
+    loader.stop()
     #shuffle, so if some are trimmed, we are randomly from all bins
     np.random.shuffle(imageSet)
     return detectErrorRate(imageSet[:imageCount,:,:,:], printResults=printResults)
@@ -94,19 +343,23 @@ Detects the percentage of images generated by the neural net with undetectable f
 Params
     imageCount: the number of images to use in the sample
     printResults:   if true, will print results to the console for display
+    generatorPath:  if specified, samples from a frozen generator exported by GeneratorExport.py,
+                    instead of building the full network
 
 Returns
     0:  the percent of images in whoch faces couldn't be found
     1:  a numpy array holding the faces that couldn't be recognized
 """
-def errorInGenerated(imageCount, printResults=True):
-    # initialize the data loader
-    image_size = 64
-    batch_size = 64
-    noise_size = 100
-
-    # start training
-    network = NeuralNet.NeuralNet(batch_size=batch_size, image_size=image_size, noise_size=noise_size, learningRate=5e-4)
+def errorInGenerated(imageCount, printResults=True, generatorPath=None):
+    if generatorPath is not None:
+        from FrozenGenerator import FrozenGenerator
+        network = FrozenGenerator(generatorPath)
+    else:
+        import NeuralNet
+        image_size = 64
+        batch_size = 64
+        noise_size = 100
+        network = NeuralNet.NeuralNet(batch_size=batch_size, image_size=image_size, noise_size=noise_size, learningRate=5e-4)
 
     sample = randomSample(network, imageCount)
     return detectErrorRate(sample, printResults=printResults)
@@ -114,8 +367,20 @@ def errorInGenerated(imageCount, printResults=True):
 if __name__ == "__main__":
     sampleSize = 10000
 
-    errorInDataset(sampleSize)
-    errorInGenerated(sampleSize)
+    if len(sys.argv) > 1 and sys.argv[1] == "benchmark":
+        # benchmark on generated faces if a frozen generator is given, otherwise on random images
+        if len(sys.argv) > 2:
+            from FrozenGenerator import FrozenGenerator
+            benchImages = randomSample(FrozenGenerator(sys.argv[2]), 2000)
+        else:
+            benchImages = np.random.uniform(-1, 1, [2000, 64, 64, 3])
+        benchmarkDetector(benchImages)
+    else:
+        # the dataset paths and loader settings are the same ones the trainer uses, e.g. --config train.json
+        from TrainConfig import parseArgs
+        config = parseArgs(sys.argv[1:], description="Measures face detection rates in the dataset and generated images")
+        errorInDataset(sampleSize, config=config)
+        errorInGenerated(sampleSize)
 
 
 
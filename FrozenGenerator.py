@@ -0,0 +1,87 @@
+import numpy as np
+import tensorflow as tf
+from Sampler import runGenerator
+
+"""
+A generator loaded from a frozen graph written by GeneratorExport.py
+Only numpy and tensorflow are imported, and no variables have to be initialized or restored, so sampling
+can start as soon as the graph file is read. Has the same sampling interface as NeuralNet (getSample,
+noise_size, image_size), so it can be passed to the functions in Sampler.py in place of a network
+Generators exported with reduced precision weights load the same way, and can output uint8 images directly
+"""
+class FrozenGenerator(object):
+    """"""
+
+    """
+    Load a frozen generator
+
+    Params:
+        graphPath:  the path of the frozen graph file
+    """
+    def __init__(self, graphPath="./generator.pb"):
+        graph_def = tf.GraphDef()
+        file = open(graphPath, "rb")
+        graph_def.ParseFromString(file.read())
+        file.close()
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            tf.import_graph_def(graph_def, name="")
+        self.sample_sex = self.graph.get_tensor_by_name("sample_sex:0")
+        self.sample_age = self.graph.get_tensor_by_name("sample_age:0")
+        self.sample_noise = self.graph.get_tensor_by_name("sample_noise:0")
+        self.sample_output = self.graph.get_tensor_by_name("sample_output:0")
+        self.session = tf.Session(graph=self.graph)
+        self.noise_size = self.sample_noise.get_shape().as_list()[1]
+        self.batch_size = int(self.session.run(self.graph.get_tensor_by_name("sample_chunk_size:0")))
+        self.image_size = self.sample_output.get_shape().as_list()[1]
+        # graphs exported before reduced precision support have neither node
+        names = set(node.name for node in graph_def.node)
+        self.sample_output_uint8 = None
+        if "sample_output_uint8" in names:
+            self.sample_output_uint8 = self.graph.get_tensor_by_name("sample_output_uint8:0")
+        self.precision = "float32"
+        if "sample_precision" in names:
+            self.precision = self.session.run(self.graph.get_tensor_by_name("sample_precision:0")).decode("utf-8")
+
+    """
+    Generates a sample of images from the frozen generator, using Sampler.runGenerator
+
+    Params
+        noiseMat:   a numpy array of noise vectors
+        genderMat:  a numpy array of gender values
+        ageMat:     a numpy array of age values
+        chunkSize:  the number of images to generate per run. Defaults to the batch size the network was trained with
+
+    Returns
+        0:  a nupy array of face images ([n,64,64,3])
+    """
+    def getSample(self, noiseMat, genderMat, ageMat, chunkSize=None):
+        return runGenerator(self.session, self.sample_output, [self.sample_noise, self.sample_sex, self.sample_age],
+                            noiseMat, genderMat, ageMat, self.batch_size, chunkSize=chunkSize)
+
+    """
+    Generates a sample of images as uint8 pixels, ready to be saved
+    The conversion happens in the graph when it was exported with a uint8 output, so no float32 copy of the
+    whole sample is made
+
+    Params
+        noiseMat:   a numpy array of noise vectors
+        genderMat:  a numpy array of gender values
+        ageMat:     a numpy array of age values
+        chunkSize:  the number of images to generate per run. Defaults to the batch size the network was trained with
+
+    Returns
+        0:  a uint8 numpy array of face images ([n,64,64,3])
+    """
+    def getSampleUint8(self, noiseMat, genderMat, ageMat, chunkSize=None):
+        if self.sample_output_uint8 is not None:
+            return runGenerator(self.session, self.sample_output_uint8, [self.sample_noise, self.sample_sex, self.sample_age],
+                                noiseMat, genderMat, ageMat, self.batch_size, chunkSize=chunkSize, dtype=np.uint8)
+        samples = self.getSample(noiseMat, genderMat, ageMat, chunkSize)
+        return np.clip(np.round((samples + 1) * 127.5), 0, 255).astype(np.uint8)
+
+    """
+    Closes the generator's session
+    """
+    def close(self):
+        self.session.close()
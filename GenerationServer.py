@@ -0,0 +1,396 @@
+import io
+import os
+import sys
+import json
+import time
+import struct
+import threading
+import numpy as np
+from collections import deque
+from socketserver import ThreadingMixIn
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from PIL import Image
+from Sampler import randomInputs, ageInputs, sexInputs, sampleUint8
+
+"""
+A single generation request waiting in a BatchScheduler
+Rows are always generated in order, so the finished images are the first "completed" rows of images
+"""
+class _GenerationJob(object):
+    """"""
+
+    def __init__(self, noiseMat, genderMat, ageMat, imageSize):
+        self.noiseMat = noiseMat
+        self.genderMat = genderMat
+        self.ageMat = ageMat
+        self.count = noiseMat.shape[0]
+        self.images = np.empty([self.count, imageSize, imageSize, 3], dtype=np.uint8)
+        self.completed = 0
+        self.error = None
+        self.submitTime = time.time()
+        self.finishTime = None
+        self._done = threading.Condition()
+
+    def _finishRows(self, start, rows):
+        with self._done:
+            self.images[start:start + rows.shape[0]] = rows
+            self.completed = start + rows.shape[0]
+            if self.completed == self.count:
+                self.finishTime = time.time()
+            self._done.notify_all()
+
+    def _fail(self, error):
+        with self._done:
+            self.error = error
+            self.finishTime = time.time()
+            self._done.notify_all()
+
+    """
+    Waits for more images than have already been read
+
+    Params:
+        numRead:    the number of images the caller already has
+
+    Returns:
+        0:  the number of finished images, which is more than numRead unless the job failed
+    """
+    def waitForRows(self, numRead):
+        with self._done:
+            while self.completed <= numRead and self.error is None:
+                self._done.wait()
+            if self.error is not None:
+                raise self.error
+            return self.completed
+
+"""
+Coalesces concurrent generation requests into full batch_size generator runs
+Requests are queued as rows of generator inputs. A single thread owns the generator, and runs a batch as soon
+as batch_size rows are queued, or once the oldest queued row has waited maxWait seconds. Large requests are
+split across batches, and small ones share a batch
+
+The generator normalizes with batch statistics, so partly filled batches are padded with random faces up to
+batch_size, which keeps a small request from being normalized over just a handful of rows. A face still depends on
+the other rows in its batch, so the same noise can come out slightly differently from one request to the next
+"""
+class BatchScheduler(object):
+    """"""
+
+    """
+    Initialize a BatchScheduler instance, and start its generator thread
+
+    Params:
+        network:    the neural network (or FrozenGenerator) to sample from
+        maxWait:    the longest a queued row waits for its batch to fill up, in seconds
+        maxQueued:  the most images that can be queued before submit refuses new requests
+        statsWindow:    the number of recent batches and requests the stats are computed over
+    """
+    def __init__(self, network, maxWait=0.02, maxQueued=16384, statsWindow=1000):
+        self.network = network
+        self.batch_size = network.batch_size
+        self.image_size = network.image_size
+        self.noise_size = network.noise_size
+        self.maxWait = maxWait
+        self.maxQueued = maxQueued
+        self._pending = deque()
+        self._queuedRows = 0
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+        self._stopping = False
+        self._startTime = time.time()
+        self._batches = 0
+        self._images = 0
+        self._requests = 0
+        self._rejected = 0
+        self._generateTime = 0.0
+        self._fillRatios = deque(maxlen=statsWindow)
+        self._latencies = deque(maxlen=statsWindow)
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    """
+    Queues the inputs of a request to be generated
+
+    Params:
+        noiseMat:   a numpy array of noise vectors
+        genderMat:  a numpy array of gender values
+        ageMat:     a numpy array of age values
+
+    Returns:
+        0:  the queued job. Its images are read with waitForRows
+    """
+    def submit(self, noiseMat, genderMat, ageMat):
+        job = _GenerationJob(noiseMat, genderMat, ageMat, self.image_size)
+        with self._lock:
+            if self._stopping:
+                raise RuntimeError("the scheduler has been stopped")
+            if self._queuedRows + job.count > self.maxQueued:
+                self._rejected = self._rejected + 1
+                raise BufferError(str(self._queuedRows) + " images are already queued")
+            # each entry is a job and the next row of it to generate
+            self._pending.append([job, 0])
+            self._queuedRows = self._queuedRows + job.count
+            self._requests = self._requests + 1
+            self._ready.notify()
+        return job
+
+    def _takeBatch(self):
+        with self._lock:
+            while not self._stopping:
+                if self._queuedRows >= self.batch_size:
+                    break
+                if self._queuedRows > 0:
+                    waitLeft = self._pending[0][0].submitTime + self.maxWait - time.time()
+                    if waitLeft <= 0:
+                        break
+                    self._ready.wait(waitLeft)
+                else:
+                    self._ready.wait()
+            if self._stopping:
+                return None
+            slices = []
+            numRows = 0
+            while numRows < self.batch_size and len(self._pending) > 0:
+                entry = self._pending[0]
+                job, start = entry
+                rows = min(job.count - start, self.batch_size - numRows)
+                slices += [(job, start, rows)]
+                numRows = numRows + rows
+                if start + rows == job.count:
+                    self._pending.popleft()
+                else:
+                    entry[1] = start + rows
+            self._queuedRows = self._queuedRows - numRows
+            return slices
+
+    def _run(self):
+        while True:
+            slices = self._takeBatch()
+            if slices is None:
+                return
+            numRows = sum(rows for _, _, rows in slices)
+            noiseMat = [job.noiseMat[start:start + rows] for job, start, rows in slices]
+            genderMat = [job.genderMat[start:start + rows] for job, start, rows in slices]
+            ageMat = [job.ageMat[start:start + rows] for job, start, rows in slices]
+            if numRows < self.batch_size:
+                fillNoise, fillGender, fillAge = randomInputs(self.noise_size, self.batch_size - numRows)
+                noiseMat += [fillNoise]
+                genderMat += [fillGender]
+                ageMat += [fillAge]
+            startTime = time.time()
+            try:
+                images = sampleUint8(self.network, np.concatenate(noiseMat), np.concatenate(genderMat),
+                                     np.concatenate(ageMat), chunkSize=self.batch_size)
+            except Exception as e:
+                for job, _, _ in slices:
+                    job._fail(e)
+                continue
+            generateTime = time.time() - startTime
+            offset = 0
+            for job, start, rows in slices:
+                job._finishRows(start, images[offset:offset + rows])
+                offset = offset + rows
+            with self._lock:
+                self._batches = self._batches + 1
+                self._images = self._images + numRows
+                self._generateTime = self._generateTime + generateTime
+                self._fillRatios.append(numRows / float(self.batch_size))
+                for job, start, rows in slices:
+                    if start + rows == job.count:
+                        self._latencies.append(job.finishTime - job.submitTime)
+
+    """
+    Returns:
+        0:  a dictionary with the queue depth, the batch fill ratio, request latencies, and throughput
+    """
+    def stats(self):
+        with self._lock:
+            latencies = np.array(self._latencies) * 1000
+            fillRatios = np.array(self._fillRatios)
+            uptime = time.time() - self._startTime
+            return {"queued_requests": len(self._pending), "queued_images": self._queuedRows,
+                    "requests": self._requests, "rejected": self._rejected, "batches": self._batches,
+                    "images": self._images, "batch_size": self.batch_size,
+                    "fill_ratio": float(fillRatios.mean()) if len(fillRatios) > 0 else None,
+                    "latency_p50_ms": float(np.percentile(latencies, 50)) if len(latencies) > 0 else None,
+                    "latency_p99_ms": float(np.percentile(latencies, 99)) if len(latencies) > 0 else None,
+                    "generator_busy": self._generateTime / max(uptime, 1e-9),
+                    "images_per_sec": self._images / max(uptime, 1e-9), "uptime_sec": uptime}
+
+    """
+    Stops the generator thread. Requests still queued are failed
+    """
+    def stop(self):
+        with self._lock:
+            self._stopping = True
+            pending = [job for job, _ in self._pending]
+            self._pending.clear()
+            self._queuedRows = 0
+            self._ready.notify_all()
+        for job in pending:
+            job._fail(RuntimeError("the scheduler was stopped"))
+        self._thread.join()
+
+def _intParam(params, name, default):
+    if name not in params:
+        return default
+    return int(params[name][0])
+
+def _encodePng(image):
+    buffer = io.BytesIO()
+    Image.fromarray(image).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+"""
+Handles the server's requests
+    GET /generate   generates faces. Parameters:
+        mode:       random (default), age (one face over an age sweep) or sex (the same faces as female, then male)
+        count:      the number of faces. For sex, the number of individuals, so twice as many images are returned
+        sex:        0 or 1. Random if not given (not used by the sex mode)
+        age:        the age of the faces. Random if not given (not used by the age mode)
+        min_age, max_age:   the range of the age sweep
+        format:     raw (default) for uint8 pixels in [n,size,size,3] order, or png for a stream of png images,
+                    each preceded by its length as a 4 byte big endian integer
+    GET /stats      the BatchScheduler's stats, as json
+Images are written back as soon as their batch finishes, so the first images of a large request arrive early
+"""
+class GenerationRequestHandler(BaseHTTPRequestHandler):
+    """"""
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/stats":
+            self._sendJson(200, self.server.scheduler.stats())
+        elif url.path == "/generate":
+            self._generate(parse_qs(url.query))
+        else:
+            self._sendJson(404, {"error": "unknown path " + url.path})
+
+    def _generate(self, params):
+        scheduler = self.server.scheduler
+        try:
+            inputs = self._inputs(params, scheduler.noise_size)
+            outFormat = params.get("format", ["raw"])[0]
+            if outFormat not in ["raw", "png"]:
+                raise ValueError("unknown format " + outFormat)
+        except ValueError as e:
+            self._sendJson(400, {"error": str(e)})
+            return
+        try:
+            job = scheduler.submit(*inputs)
+        except BufferError as e:
+            self._sendJson(503, {"error": str(e)})
+            return
+        try:
+            numRead = 0
+            numReady = job.waitForRows(numRead)
+        except Exception as e:
+            self._sendJson(500, {"error": str(e)})
+            return
+        self.send_response(200)
+        self.send_header("X-Image-Count", str(job.count))
+        self.send_header("X-Image-Size", str(scheduler.image_size))
+        if outFormat == "raw":
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(job.images.nbytes))
+        else:
+            self.send_header("Content-Type", "application/x-png-stream")
+        self.end_headers()
+        while True:
+            if outFormat == "raw":
+                self.wfile.write(job.images[numRead:numReady].tobytes())
+            else:
+                for image in job.images[numRead:numReady]:
+                    png = _encodePng(image)
+                    self.wfile.write(struct.pack(">I", len(png)) + png)
+            self.wfile.flush()
+            numRead = numReady
+            if numRead == job.count:
+                return
+            # a failure after the headers were sent can only be reported by closing the connection early
+            numReady = job.waitForRows(numRead)
+
+    def _inputs(self, params, noiseSize):
+        mode = params.get("mode", ["random"])[0]
+        count = _intParam(params, "count", 1)
+        if count < 1 or count > self.server.maxCount:
+            raise ValueError("count must be between 1 and " + str(self.server.maxCount))
+        gender = _intParam(params, "sex", None)
+        age = _intParam(params, "age", None)
+        if mode == "random":
+            return randomInputs(noiseSize, count, gender=gender, age=age)
+        if mode == "age":
+            return ageInputs(noiseSize, count, minAge=_intParam(params, "min_age", 25),
+                             maxAge=_intParam(params, "max_age", 75), gender=gender)
+        if mode == "sex":
+            return sexInputs(noiseSize, count, age=age)
+        raise ValueError("unknown mode " + mode)
+
+    def _sendJson(self, status, content):
+        body = json.dumps(content).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.logRequests:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+"""
+A local http server around a generator, with a thread per connection and a BatchScheduler sharing the generator
+"""
+class GenerationServer(ThreadingMixIn, HTTPServer):
+    """"""
+
+    daemon_threads = True
+
+    """
+    Initialize a GenerationServer instance. Call serve_forever to start handling requests
+
+    Params:
+        network:    the neural network (or FrozenGenerator) to sample from
+        host:       the address to listen on. Only local connections are accepted by default
+        port:       the port to listen on. 0 picks a free port
+        maxWait:    the longest a request waits for its batch to fill up, in seconds
+        maxCount:   the most faces a single request can ask for
+        logRequests:    if true, every request is printed
+    """
+    def __init__(self, network, host="127.0.0.1", port=8080, maxWait=0.02, maxCount=4096, logRequests=False):
+        HTTPServer.__init__(self, (host, port), GenerationRequestHandler)
+        self.scheduler = BatchScheduler(network, maxWait=maxWait)
+        self.maxCount = maxCount
+        self.logRequests = logRequests
+
+    """
+    Stops handling requests, and stops the generator thread
+    """
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self.scheduler.stop()
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] != "network":
+        # serve a generator exported by GeneratorExport.py, without building the full network
+        if not os.path.exists(sys.argv[1]):
+            print("frozen generator not found")
+            exit()
+        from FrozenGenerator import FrozenGenerator
+        network = FrozenGenerator(sys.argv[1])
+    else:
+        import NeuralNet
+        network = NeuralNet.NeuralNet(batch_size=64, image_size=64, noise_size=100, learningRate=5e-4)
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 8080
+    server = GenerationServer(network, port=port)
+    print("serving " + str(network.image_size) + "x" + str(network.image_size) + " faces in batches of " +
+          str(network.batch_size) + " on http://127.0.0.1:" + str(server.server_address[1]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.scheduler.stop()
@@ -0,0 +1,199 @@
+import os
+import sys
+import time
+import subprocess
+import numpy as np
+import tensorflow as tf
+from tensorflow.python.framework import graph_util, tensor_util
+from Quantization import PRECISIONS, quantizeInt8, quantizeBfloat16
+
+def _dequantized(name, weights, precision):
+    # builds the ops that turn the stored weights back into float32 when the graph runs
+    with tf.name_scope("dequantize"):
+        if precision == "int8":
+            quantized, scales = quantizeInt8(weights)
+            stored = tf.constant(quantized, name=name + "_int8")
+            return tf.cast(stored, tf.float32) * tf.constant(scales, name=name + "_scale")
+        # sign extending the int16 and shifting it into the top half rebuilds the float32 bit pattern
+        stored = tf.constant(quantizeBfloat16(weights), name=name + "_bfloat16")
+        return tf.bitcast(tf.cast(stored, tf.int32) * 65536, tf.float32)
+
+"""
+Rewrites a frozen generator graph, storing its layer weights at a lower precision and adding a uint8 output
+The weights are converted back to float32 as the graph runs, so the file (and the memory it takes) shrinks,
+while the ops themselves are unchanged. Biases and batchnorm parameters are small, so they stay float32.
+The sample_output_uint8 node gives images ready to save, so bulk jobs never hold float32 copies
+
+Params
+    frozen:     the frozen GraphDef
+    precision:  "float32", "bfloat16" or "int8"
+
+Returns
+    0:  the rewritten GraphDef
+"""
+def _rewriteFrozenGraph(frozen, precision):
+    if precision not in PRECISIONS:
+        raise ValueError("unknown precision " + str(precision) + ", expected one of " + str(PRECISIONS))
+    with tf.Graph().as_default() as graph:
+        replacements = {}
+        if precision != "float32":
+            for node in frozen.node:
+                # layer weights are the variables named like gen_fc1-W
+                if node.op == "Const" and node.name.endswith("-W"):
+                    weights = tensor_util.MakeNdarray(node.attr["value"].tensor)
+                    replacements[node.name + ":0"] = _dequantized(node.name, weights, precision)
+        tf.import_graph_def(frozen, input_map=replacements, name="")
+        sample_output = graph.get_tensor_by_name("sample_output:0")
+        tf.cast(tf.clip_by_value(tf.round((sample_output + 1) * 127.5), 0, 255), tf.uint8, name="sample_output_uint8")
+        tf.constant(precision, name="sample_precision")
+    # the float32 weight nodes that were replaced are no longer used, so they are dropped here
+    return graph_util.extract_sub_graph(graph.as_graph_def(), ["sample_output", "sample_output_uint8",
+                                                               "sample_chunk_size", "sample_precision"])
+
+"""
+Writes a network's generator to a single frozen graph file
+Only the nodes needed to compute sample_output are kept, with the checkpointed weights stored as constants,
+so the file can be sampled with FrozenGenerator without building the discriminator or optimizers,
+initializing variables, or restoring a checkpoint
+
+Params
+    network:    the NeuralNet to export, with its newest checkpoint restored
+    exportPath: the path to write the frozen graph to
+    precision:  the precision to store the layer weights in: "float32", "bfloat16" or "int8"
+
+Returns
+    0:  the size of the written file in bytes
+"""
+def exportGenerator(network, exportPath="./generator.pb", precision="float32"):
+    graph_def = network.session.graph.as_graph_def()
+    frozen = graph_util.convert_variables_to_constants(network.session, graph_def,
+                                                       ["sample_output", "sample_chunk_size"])
+    frozen = _rewriteFrozenGraph(frozen, precision)
+    # write to a temp file first, so a crash mid-write never leaves a truncated graph behind
+    tmpPath = exportPath + ".tmp"
+    file = open(tmpPath, "wb")
+    file.write(frozen.SerializeToString())
+    file.close()
+    os.rename(tmpPath, exportPath)
+    return os.path.getsize(exportPath)
+
+"""
+Compares a reduced precision generator against the float32 one, on the same noise, sex and age inputs
+The candidate is measured through its uint8 output, which is what bulk generation saves
+
+Params
+    referencePath:  the path of the float32 frozen generator
+    candidatePath:  the path of the reduced precision frozen generator
+    numSamples:     the number of faces to compare
+    seed:           the random seed of the inputs
+
+Returns
+    0:  a dictionary with the mean/max pixel error (in 0-255 steps), the PSNR, each generator's face
+        detection rate and images/sec, and the file sizes
+"""
+def compareGenerators(referencePath, candidatePath, numSamples=2000, seed=0):
+    from FrozenGenerator import FrozenGenerator
+    import FaceDetector
+    reference = FrozenGenerator(referencePath)
+    candidate = FrozenGenerator(candidatePath)
+    rand = np.random.RandomState(seed)
+    noise = rand.uniform(-1, 1, [numSamples, reference.noise_size]).astype(np.float32)
+    sex = (rand.randint(2, size=[numSamples, 1]) * 2 - 1).astype(np.float32)
+    age = (((rand.randint(15, 75, size=[numSamples, 1]) / 100.0) * 2) - 1).astype(np.float32)
+    results = {}
+    outputs = {}
+    for name, generator in [("float32", reference), ("candidate", candidate)]:
+        # one warm up run, so the first run's graph setup isn't timed
+        generator.getSampleUint8(noise[:generator.batch_size], sex[:generator.batch_size], age[:generator.batch_size])
+        startTime = time.time()
+        outputs[name] = generator.getSampleUint8(noise, sex, age)
+        results[name + "_images_per_sec"] = numSamples / (time.time() - startTime)
+        err, _ = FaceDetector.detectErrorRate(outputs[name], printResults=False)
+        results[name + "_face_acc"] = 1 - err
+        generator.close()
+    diff = np.abs(outputs["float32"].astype(np.int16) - outputs["candidate"].astype(np.int16))
+    mse = np.mean(diff.astype(np.float64) ** 2)
+    results["mean_pixel_error"] = float(diff.mean())
+    results["max_pixel_error"] = int(diff.max())
+    results["psnr"] = float(10 * np.log10(255.0 ** 2 / mse)) if mse > 0 else float("inf")
+    results["float32_bytes"] = os.path.getsize(referencePath)
+    results["candidate_bytes"] = os.path.getsize(candidatePath)
+    results["face_acc_change"] = results["candidate_face_acc"] - results["float32_face_acc"]
+    for key in sorted(results):
+        print(key + ": " + str(results[key]))
+    return results
+
+# each startup script runs in a fresh interpreter, so imports and model loading are included in the time
+_fullStartup = """
+import NeuralNet, Sampler
+network = NeuralNet.NeuralNet(batch_size=%d, image_size=64, noise_size=%d, chkptDir=%r)
+Sampler.randomSample(network, 1)
+"""
+
+_frozenStartup = """
+import Sampler
+from FrozenGenerator import FrozenGenerator
+Sampler.randomSample(FrozenGenerator(%r), 1)
+"""
+
+"""
+Measures the time from starting a new python process to having the first generated image,
+for both the full NeuralNet and the frozen generator
+
+Params
+    exportPath: the path of the frozen generator
+    chkptDir:   the checkpoint directory the full network restores from
+    numRuns:    the number of times to start each version. The fastest run is reported
+    batch_size: the batch size the network was trained with
+    noise_size: the noise size the network was trained with
+
+Returns
+    0:  a dictionary with the best startup time in seconds of each version
+"""
+def benchmarkStartup(exportPath="./generator.pb", chkptDir="./checkpoints", numRuns=3, batch_size=64, noise_size=100):
+    scripts = {"full": _fullStartup % (batch_size, noise_size, chkptDir), "frozen": _frozenStartup % exportPath}
+    results = {}
+    for name in ["full", "frozen"]:
+        times = []
+        for _ in range(numRuns):
+            startTime = time.time()
+            subprocess.check_call([sys.executable, "-c", scripts[name]], stdout=open(os.devnull, "w"))
+            times += [time.time() - startTime]
+        results[name + "_sec"] = min(times)
+        print(name + " startup to first image: " + "%.2f" % min(times) + "s")
+    print("speedup: " + "%.1f" % (results["full_sec"] / results["frozen_sec"]) + "x")
+    return results
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ["export", "benchmark", "compare"]:
+        print("requires 1 parameter (export, benchmark or compare)")
+        print("  export [export_path] [checkpoint_dir] [float32|bfloat16|int8]")
+        print("  benchmark [export_path] [checkpoint_dir]")
+        print("  compare float32_path candidate_path [num_samples]")
+        exit()
+
+    if sys.argv[1] == "compare":
+        if len(sys.argv) < 4 or not os.path.exists(sys.argv[2]) or not os.path.exists(sys.argv[3]):
+            print("requires the paths of two frozen generators")
+            exit()
+        compareGenerators(sys.argv[2], sys.argv[3], numSamples=int(sys.argv[4]) if len(sys.argv) > 4 else 2000)
+        exit()
+
+    exportPath = sys.argv[2] if len(sys.argv) > 2 else "./generator.pb"
+    chkptDir = sys.argv[3] if len(sys.argv) > 3 else "./checkpoints"
+
+    if sys.argv[1] == "export":
+        precision = sys.argv[4] if len(sys.argv) > 4 else "float32"
+        import NeuralNet
+        network = NeuralNet.NeuralNet(batch_size=64, image_size=64, noise_size=100, chkptDir=chkptDir)
+        if network.checkpoint_num == 0:
+            print("no checkpoint to export")
+            exit()
+        numBytes = exportGenerator(network, exportPath, precision)
+        print("exported checkpoint " + str(network.checkpoint_num) + " to " + exportPath + " as " + precision +
+              " (" + "%.1f" % (numBytes / 1e6) + " MB)")
+    else:
+        if not os.path.exists(exportPath):
+            print("frozen generator not found")
+            exit()
+        benchmarkStartup(exportPath, chkptDir)
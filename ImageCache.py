@@ -0,0 +1,169 @@
+import os
+import ctypes
+import hashlib
+import threading
+import multiprocessing
+import numpy as np
+from collections import OrderedDict
+
+"""
+An on-disk cache of decoded, resized face images, with an in-memory tier for the most recently used ones
+Entries are content addressed by a hash of (path, modification time, image size), so an image that changes
+on disk gets a new entry, and each size an image is used at is cached separately. Each entry is a raw uint8
+file, so a hit costs one small read instead of a jpeg decode and resize
+
+The disk tier is kept under maxBytes by evicting the least recently used entries. Hit counters are kept in
+shared memory, so they include hits in DataLoader worker processes. The disk tier's index is per process,
+so with several worker processes the budget is only enforced approximately
+"""
+class ImageCache(object):
+    """"""
+
+    """
+    Initialize an ImageCache instance
+
+    Params:
+        cacheDir:   the directory to store cached images in
+        maxBytes:   the size budget of the disk tier
+        memoryItems:    the number of images kept in memory. 0 disables the memory tier
+    """
+    def __init__(self, cacheDir="./image_cache", maxBytes=2 * 1024 ** 3, memoryItems=2048):
+        self.cacheDir = cacheDir
+        self.maxBytes = maxBytes
+        self.memoryItems = memoryItems
+        if not os.path.exists(cacheDir):
+            os.makedirs(cacheDir)
+        # memory hits, disk hits, misses. Shared by every worker thread and process, so updates take its lock
+        self._counters = multiprocessing.Array(ctypes.c_longlong, 3)
+        self._initLocal()
+        self._scanDisk()
+
+    def _initLocal(self):
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+
+    def _scanDisk(self):
+        entries = []
+        for subdir, _, files in os.walk(self.cacheDir):
+            for file in files:
+                if file.endswith(".u8"):
+                    filePath = os.path.join(subdir, file)
+                    stat = os.stat(filePath)
+                    entries += [(stat.st_mtime, file[:-3], stat.st_size)]
+        # oldest first, so the front of the dict is the next to be evicted
+        self._disk = OrderedDict((key, size) for _, key, size in sorted(entries))
+        self._diskBytes = sum(self._disk.values())
+
+    def __getstate__(self):
+        # locks can't be sent to a worker process, and each process keeps its own memory tier
+        state = self.__dict__.copy()
+        del state["_lock"]
+        del state["_memory"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._initLocal()
+
+    def _entryPath(self, key):
+        return os.path.join(self.cacheDir, key[:2], key + ".u8")
+
+    """
+    Returns a decoded image resized to imageSize, from the cache if possible
+
+    Params:
+        path:       the path of the source image
+        imageSize:  the width/height of the returned image
+        loadFn:     called as loadFn(path, imageSize) to decode and resize the image on a miss
+
+    Returns:
+        0:  a uint8 numpy array of the image ([imageSize, imageSize, 3]). Must not be modified
+    """
+    def get(self, path, imageSize, loadFn):
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            mtime = -1
+        key = hashlib.sha1((path + "|" + repr(mtime) + "|" + str(imageSize)).encode("utf-8")).hexdigest()
+        numBytes = imageSize * imageSize * 3
+        with self._lock:
+            image = self._memory.get(key)
+            if image is not None:
+                self._memory.move_to_end(key)
+                self._count(0)
+                return image
+        entryPath = self._entryPath(key)
+        image = None
+        if os.path.exists(entryPath):
+            try:
+                data = np.fromfile(entryPath, dtype=np.uint8)
+                if data.shape[0] == numBytes:
+                    image = data.reshape([imageSize, imageSize, 3])
+                    # bump the modification time, so the entry's age reflects its last use after a restart
+                    os.utime(entryPath, None)
+            except (IOError, OSError):
+                # evicted by another worker process since the check
+                image = None
+        if image is not None:
+            self._count(1)
+            with self._lock:
+                if key in self._disk:
+                    self._disk.move_to_end(key)
+        else:
+            self._count(2)
+            image = np.ascontiguousarray(loadFn(path, imageSize), dtype=np.uint8)
+            self._writeEntry(key, entryPath, image)
+        self._remember(key, image)
+        return image
+
+    def _count(self, counter):
+        with self._counters.get_lock():
+            self._counters[counter] += 1
+
+    def _remember(self, key, image):
+        if self.memoryItems <= 0:
+            return
+        with self._lock:
+            self._memory[key] = image
+            while len(self._memory) > self.memoryItems:
+                self._memory.popitem(last=False)
+
+    def _writeEntry(self, key, entryPath, image):
+        entryDir = os.path.dirname(entryPath)
+        if not os.path.exists(entryDir):
+            try:
+                os.makedirs(entryDir)
+            except OSError:
+                # created by another worker at the same time
+                pass
+        # write to a temp file first, so other workers never read a partly written entry
+        tmpPath = entryPath + "." + str(os.getpid()) + "." + str(threading.current_thread().ident) + ".tmp"
+        image.tofile(tmpPath)
+        os.rename(tmpPath, entryPath)
+        with self._lock:
+            if key not in self._disk:
+                self._diskBytes = self._diskBytes + image.nbytes
+            self._disk[key] = image.nbytes
+            evicted = []
+            while self._diskBytes > self.maxBytes and len(self._disk) > 1:
+                oldKey, oldSize = self._disk.popitem(last=False)
+                self._diskBytes = self._diskBytes - oldSize
+                evicted += [oldKey]
+        for oldKey in evicted:
+            try:
+                os.remove(self._entryPath(oldKey))
+            except OSError:
+                pass
+
+    """
+    Returns:
+        0:  a dictionary with the hit/miss counts, the hit rates of each tier, and the disk tier's size
+    """
+    def stats(self):
+        with self._counters.get_lock():
+            memoryHits, diskHits, misses = [int(c) for c in self._counters]
+        total = max(memoryHits + diskHits + misses, 1)
+        return {"memory_hits": memoryHits, "disk_hits": diskHits, "misses": misses,
+                "memory_hit_rate": memoryHits / float(total), "disk_hit_rate": diskHits / float(total),
+                "hit_rate": (memoryHits + diskHits) / float(total), "disk_bytes": self._diskBytes,
+                "disk_entries": len(self._disk)}
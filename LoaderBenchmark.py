@@ -0,0 +1,320 @@
+import os
+import sys
+import json
+import time
+import shutil
+import resource
+import subprocess
+import multiprocessing
+import numpy as np
+import pandas as pd
+from datetime import date
+from DataLoader import DataLoader, LoadFilesData, getBatch
+
+"""
+Measures how quickly a DataLoader can produce batches, and how long each call to getData waits
+
+Params
+    indices:    the StratifiedSampler for the data
+    csvdata:    the ColumnStore (or pandas dataframe) of the .csv of faces we are using
+    backend:    the DataLoader backend to measure ("thread" or "process")
+    numWorkers: the number of worker threads/processes to use
+    numBatches: the number of batches to time
+    numPerBin:  the number of images per category in each batch
+    imageSize:  the size of the images to load
+    warmup:     the number of batches to pull before timing starts, so workers are running
+
+Returns
+    0:  a dictionary containing the batches/sec and images/sec of the loader, and the p50/p99 getData wait
+"""
+def benchmarkLoader(indices, csvdata, backend="thread", numWorkers=1, numBatches=50, numPerBin=4, imageSize=64, warmup=2):
+    loader = DataLoader(indices, csvdata, numWorkerThreads=numWorkers, numPerBin=numPerBin, imageSize=imageSize,
+                        bufferMax=max(2, numWorkers * 2), useCached=False, backend=backend)
+    loader.start()
+    for _ in range(warmup):
+        loader.getData()
+    numImages = 0
+    waits = np.zeros(numBatches)
+    startTime = time.time()
+    for i in range(numBatches):
+        waitStart = time.time()
+        numImages = numImages + loader.getData()["image"].shape[0]
+        waits[i] = time.time() - waitStart
+    elapsed = time.time() - startTime
+    loader.stop()
+    return {"backend": backend, "workers": numWorkers, "image_size": imageSize,
+            "batches_per_sec": numBatches / elapsed, "images_per_sec": numImages / elapsed,
+            "wait_p50_ms": float(np.percentile(waits, 50)) * 1000, "wait_p99_ms": float(np.percentile(waits, 99)) * 1000}
+
+"""
+Measures how quickly getBatch produces batches on the calling thread, with no loader around it
+
+Params
+    indices:    the StratifiedSampler for the data
+    csvdata:    the ColumnStore (or pandas dataframe) of the .csv of faces we are using
+    numBatches: the number of batches to time
+    numPerBin:  the number of images per category in each batch
+    imageSize:  the size of the images to load
+
+Returns
+    0:  a dictionary containing the batches/sec and images/sec of getBatch
+"""
+def benchmarkGetBatch(indices, csvdata, numBatches=20, numPerBin=4, imageSize=64):
+    out = None
+    numImages = 0
+    startTime = time.time()
+    for _ in range(numBatches):
+        out, didFinish = getBatch(indices, csvdata, numPerBin=numPerBin, imageSize=imageSize, out=out)
+        numImages = numImages + out["image"].shape[0]
+        if didFinish:
+            indices.newEpoch()
+    elapsed = time.time() - startTime
+    return {"image_size": imageSize, "batches_per_sec": numBatches / elapsed, "images_per_sec": numImages / elapsed}
+
+"""
+Compares the thread and process DataLoader backends across a range of worker counts
+
+Params
+    indices:    the StratifiedSampler for the data
+    csvdata:    the ColumnStore (or pandas dataframe) of the .csv of faces we are using
+    workerCounts:   the worker counts to try for each backend
+    numBatches: the number of batches to time for each configuration
+    imageSize:  the size of the images to load
+
+Returns
+    0:  a pandas dataframe with one row per configuration
+"""
+def compareBackends(indices, csvdata, workerCounts=[1, 2, 4, 8], numBatches=50, imageSize=64):
+    results = []
+    for backend in ["thread", "process"]:
+        for numWorkers in workerCounts:
+            result = benchmarkLoader(indices, csvdata, backend=backend, numWorkers=numWorkers,
+                                     numBatches=numBatches, imageSize=imageSize)
+            print(backend + " x" + str(numWorkers) + ": " + "%.1f" % result["images_per_sec"] + " images/sec")
+            results += [result]
+    return pd.DataFrame(results, columns=["backend", "workers", "image_size", "batches_per_sec", "images_per_sec",
+                                          "wait_p50_ms", "wait_p99_ms"])
+
+def _datenum(year, month, day):
+    # matlab datenums count days from year 0, python ordinals from year 1
+    return date(year, month, day).toordinal() + 366
+
+def _cellArray(values):
+    cells = np.empty([1, len(values)], dtype=object)
+    for i, value in enumerate(values):
+        cells[0, i] = value
+    return cells
+
+"""
+Generates a small dataset with the same layout as IMDB-WIKI, so the loader can be benchmarked without the real one
+Each of wiki_crop and imdb_crop gets a .mat file with the same struct fields as the real dataset, and jpeg
+crops of varied sizes in numbered subdirectories. Like the real dataset, a few rows have missing genders,
+missing faces, second faces, unreadable sizes, or grayscale images, so every filter has something to remove
+
+Params
+    datasetDir: the directory to create the dataset in
+    numImages:  the total number of images to create, split between wiki and imdb
+    seed:       the random seed, so the same dataset is generated every time
+    sizeRange:  the min and max width/height of the jpeg crops
+
+Returns
+    0:  the number of bytes of jpegs written
+"""
+def createSyntheticDataset(datasetDir, numImages=2000, seed=0, sizeRange=[40, 500]):
+    from PIL import Image
+    from scipy.io import savemat
+    rand = np.random.RandomState(seed)
+    numBytes = 0
+    for fileType, count in [("wiki", numImages // 2), ("imdb", numImages - numImages // 2)]:
+        cropDir = os.path.join(datasetDir, fileType + "_crop")
+        birthYear = rand.randint(1930, 2000, count)
+        dob = np.array([_datenum(int(year), int(rand.randint(1, 13)), int(rand.randint(1, 29))) for year in birthYear],
+                       dtype=np.float64)
+        yearTaken = np.minimum(birthYear + rand.randint(8, 80, count), 2015).astype(np.uint16)
+        gender = rand.randint(0, 2, count).astype(np.float64)
+        gender[rand.rand(count) < 0.03] = np.nan
+        faceScore = rand.uniform(0, 6, count)
+        faceScore[rand.rand(count) < 0.05] = -np.inf
+        secondFace = np.full(count, np.nan)
+        hasSecond = rand.rand(count) < 0.1
+        secondFace[hasSecond] = rand.uniform(0, 4, np.count_nonzero(hasSecond))
+        paths = []
+        names = []
+        locations = []
+        for i in range(count):
+            subdir = "%02d" % (i % 100)
+            relPath = subdir + "/nm" + "%07d" % i + "_rm" + str(rand.randint(1, 10 ** 9)) + "_" + str(birthYear[i]) + ".jpg"
+            paths += [relPath]
+            names += ["" if rand.rand() < 0.01 else "Person, " + str(i)]
+            width, height = rand.randint(sizeRange[0], sizeRange[1] + 1, 2)
+            locations += [np.array([[width * 0.2, height * 0.2, width * 0.8, height * 0.8]])]
+            # smooth gradients plus noise, so the jpegs decode at a realistic speed
+            gradient = np.linspace(0, 255, width)[None, :, None] * rand.uniform(0, 1, 3)[None, None, :]
+            pixels = gradient + rand.randint(0, 64, [height, width, 3])
+            image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+            if rand.rand() < 0.05:
+                image = image.convert("L")
+            imagePath = os.path.join(cropDir, relPath)
+            if not os.path.exists(os.path.dirname(imagePath)):
+                os.makedirs(os.path.dirname(imagePath))
+            image.save(imagePath, quality=90)
+            numBytes = numBytes + os.path.getsize(imagePath)
+        struct = {"dob": dob.reshape([1, -1]), "photo_taken": yearTaken.reshape([1, -1]),
+                  "full_path": _cellArray(paths), "gender": gender.reshape([1, -1]), "name": _cellArray(names),
+                  "face_location": _cellArray(locations), "face_score": faceScore.reshape([1, -1]),
+                  "second_face_score": secondFace.reshape([1, -1])}
+        savemat(os.path.join(cropDir, fileType + ".mat"), {fileType: struct})
+    return numBytes
+
+def _peakRss():
+    # ru_maxrss is in kilobytes on linux. Children are the loader's worker processes, after they are joined
+    return {"peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+            "peak_worker_rss_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024.0}
+
+def _isolatedWorker(queue, target, args):
+    try:
+        result = target(*args)
+        result.update(_peakRss())
+        queue.put(result)
+    except Exception as e:
+        queue.put({"error": repr(e)})
+
+"""
+Runs a benchmark function in a new process, so its peak memory use isn't mixed with other configurations
+
+Params
+    target: the benchmark function, returning a dictionary of results
+    args:   the arguments to call target with
+
+Returns
+    0:  the results dictionary, with the peak RSS of the process and its workers added
+"""
+def _runIsolated(target, args):
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_isolatedWorker, args=[queue, target, args])
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+def _indexDataset(datasetDir, workDir):
+    startTime = time.time()
+    csvdata, indices = LoadFilesData(datasetDir, csvPath=os.path.join(workDir, "dataset.csv"),
+                                     indicesPath=os.path.join(workDir, "indices.p"),
+                                     storeDir=os.path.join(workDir, "dataset_store"),
+                                     masterPath=os.path.join(workDir, "dataset_master.csv"),
+                                     probeCachePath=os.path.join(workDir, "probe_cache.p"))
+    return csvdata, indices, time.time() - startTime
+
+def _gitCommit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=open(os.devnull, "w"),
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode("utf-8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+"""
+Runs the full loader benchmark suite on a synthetic dataset, and writes the results as json
+Measures the time to index the dataset from scratch and from the saved files, getBatch on its own,
+and the DataLoader for every combination of backend, worker count and image size. Each loader
+configuration runs in its own process, so its peak RSS can be reported
+
+Params
+    outPath:    the path of the json results file
+    workDir:    the directory the synthetic dataset and index files are created in
+    numImages:  the number of images in the synthetic dataset
+    workerCounts:   the worker counts to try for each backend
+    imageSizes: the image sizes to try
+    backends:   the DataLoader backends to try
+    numBatches: the number of batches to time for each configuration
+    numPerBin:  the number of images per category in each batch
+    keepDataset:    if true, an existing synthetic dataset in workDir is reused
+
+Returns
+    0:  the results dictionary that was written
+"""
+def runSuite(outPath="loader_benchmark.json", workDir="./loader_benchmark", numImages=2000, workerCounts=[1, 2, 4],
+             imageSizes=[64, 128], backends=["thread", "process"], numBatches=30, numPerBin=4, keepDataset=True):
+    datasetDir = os.path.join(workDir, "dataset")
+    indexDir = os.path.join(workDir, "index")
+    results = {"commit": _gitCommit(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "cpus": multiprocessing.cpu_count(),
+               "config": {"num_images": numImages, "worker_counts": workerCounts, "image_sizes": imageSizes,
+                          "backends": backends, "num_batches": numBatches, "num_per_bin": numPerBin}}
+
+    if not keepDataset or not os.path.exists(os.path.join(datasetDir, "imdb_crop", "imdb.mat")):
+        if os.path.exists(datasetDir):
+            shutil.rmtree(datasetDir)
+        print("creating synthetic dataset...")
+        startTime = time.time()
+        numBytes = createSyntheticDataset(datasetDir, numImages)
+        print("created " + str(numImages) + " images (" + "%.1f" % (numBytes / 1e6) + " MB) in " +
+              "%.1f" % (time.time() - startTime) + "s")
+
+    # indexing from scratch reads the .mat files and every image header; the second run restores the saved files
+    if os.path.exists(indexDir):
+        shutil.rmtree(indexDir)
+    os.makedirs(indexDir)
+    _, _, coldTime = _indexDataset(datasetDir, indexDir)
+    csvdata, indices, warmTime = _indexDataset(datasetDir, indexDir)
+    results["indexing"] = {"cold_sec": coldTime, "warm_sec": warmTime, "rows": len(csvdata)}
+    print("indexing: " + "%.2f" % coldTime + "s cold, " + "%.2f" % warmTime + "s warm, " + str(len(csvdata)) + " rows")
+
+    results["get_batch"] = []
+    for imageSize in imageSizes:
+        result = benchmarkGetBatch(indices.copy(), csvdata, numBatches=max(1, numBatches // 3), numPerBin=numPerBin,
+                                   imageSize=imageSize)
+        print("getBatch " + str(imageSize) + "px: " + "%.1f" % result["images_per_sec"] + " images/sec")
+        results["get_batch"] += [result]
+
+    results["loader"] = []
+    for imageSize in imageSizes:
+        for backend in backends:
+            for numWorkers in workerCounts:
+                result = _runIsolated(benchmarkLoader, [indices, csvdata, backend, numWorkers, numBatches, numPerBin,
+                                                        imageSize])
+                if "error" in result:
+                    print(backend + " x" + str(numWorkers) + " " + str(imageSize) + "px failed: " + result["error"])
+                    result.update({"backend": backend, "workers": numWorkers, "image_size": imageSize})
+                else:
+                    print(backend + " x" + str(numWorkers) + " " + str(imageSize) + "px: " +
+                          "%.1f" % result["images_per_sec"] + " images/sec, wait p50 " + "%.1f" % result["wait_p50_ms"] +
+                          "ms p99 " + "%.1f" % result["wait_p99_ms"] + "ms, peak rss " +
+                          "%.0f" % result["peak_rss_mb"] + "MB")
+                results["loader"] += [result]
+
+    # write to a temp file first, so a crash mid-write never leaves a truncated results file behind
+    tmpPath = outPath + ".tmp"
+    file = open(tmpPath, "w")
+    json.dump(results, file, indent=2)
+    file.close()
+    os.rename(tmpPath, outPath)
+    print("results saved to " + outPath)
+    return results
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "suite":
+        outPath = sys.argv[2] if len(sys.argv) > 2 else "loader_benchmark.json"
+        workDir = sys.argv[3] if len(sys.argv) > 3 else "./loader_benchmark"
+        runSuite(outPath, workDir)
+        exit()
+
+    if len(sys.argv) != 3:
+        print("requires 2 parameters (csv_path, indices_path), or suite and optionally out_json and work_dir")
+        exit()
+
+    csvPath = sys.argv[1]
+    indicesPath = sys.argv[2]
+
+    if not os.path.exists(csvPath) or not os.path.exists(indicesPath):
+        print("one or both files not found")
+        exit()
+
+    from ColumnStore import LoadColumnStore
+    from StratifiedSampler import StratifiedSampler
+    csvdata = LoadColumnStore(csvPath)
+
+    print("restoring indices data...")
+    indices = StratifiedSampler.load(indicesPath)
+    indices.newEpoch()
+
+    print(compareBackends(indices, csvdata))
@@ -1,13 +1,17 @@
 from DataLoader import DataLoader, LoadFilesData
 import tensorflow as tf
-from math import ceil
 import numpy as np
 from Visualization import visualizeImages
-from os import walk, path, mkdir, remove
+from os import path, mkdir, remove, rename
 import pandas as pd
 import pickle
 import FaceDetector
 import Sampler
+import threading
+import time
+from StepProfiler import NullProfiler
+from CheckpointWriter import AsyncCheckpointWriter, writeCheckpointState
+from CheckpointManifest import CheckpointManifest
 
 class NeuralNet(object):
     """"""
@@ -36,6 +40,9 @@ class NeuralNet(object):
         input_shape = prev_layer.get_shape().as_list()
         new_shape = input_shape
         new_shape[-1] = new_depth
+        if new_shape[0] is None:
+            # the batch size is only known at run time, so the output shape has to be computed in-graph
+            new_shape = tf.pack([tf.shape(prev_layer)[0]] + new_shape[1:])
         W, b = self.create_variables([patch_size, patch_size, new_depth, prev_depth], [new_depth],
                                           name_prefix=name_prefix)
         new_layer = tf.nn.conv2d_transpose(prev_layer, W, new_shape, strides=[1, 1, 1, 1], padding='SAME')
@@ -47,18 +54,24 @@ class NeuralNet(object):
     def create_variables(self, w_size, b_size, name_prefix="untitled", w_stddev=0.02, b_val=0.1):
         W_name = name_prefix + "-W"
         b_name = name_prefix + "-b"
-        W = tf.Variable(tf.truncated_normal(w_size, stddev=w_stddev), name=W_name)
-        b = tf.Variable(tf.constant(b_val, shape=b_size), name=b_name)
+        W = self._get_variable(W_name, lambda: tf.truncated_normal(w_size, stddev=w_stddev))
+        b = self._get_variable(b_name, lambda: tf.constant(b_val, shape=b_size))
         return W, b
 
     def create_batchnorm_layer(self, prev_layer, layer_shape, name_prefix="bnorm"):
         scale_name = name_prefix + "-S"
         offset_name = name_prefix + "-O"
         mean, variance = tf.nn.moments(prev_layer, axes=[0])
-        scale = tf.Variable(tf.ones(layer_shape), name=scale_name)
-        offset = tf.Variable(tf.zeros(layer_shape), name=offset_name)
+        scale = self._get_variable(scale_name, lambda: tf.ones(layer_shape))
+        offset = self._get_variable(offset_name, lambda: tf.zeros(layer_shape))
         return tf.nn.batch_normalization(prev_layer, mean, variance, offset, scale, 1e-8)
 
+    def _get_variable(self, name, initial_value):
+        # layers built a second time (like the sampling generator) reuse the variables of the first build
+        if name not in self.layer_variables:
+            self.layer_variables[name] = tf.Variable(initial_value(), name=name)
+        return self.layer_variables[name]
+
     def create_upsample_layer(self, prev_layer, new_size):
         resized = tf.image.resize_images(prev_layer, new_size, new_size, method=tf.image.ResizeMethod.NEAREST_NEIGHBOR)
         return resized
@@ -66,15 +79,34 @@ class NeuralNet(object):
     """
     Initialization Helpers
     """
-    def __init__(self, batch_size=1000, chkptDir="./checkpoints", chkptName="FaceGen.ckpt",image_size=64, noise_size=1000, age_range=[10, 100], learningRate=2e-4):
+    def __init__(self, batch_size=1000, chkptDir="./checkpoints", chkptName="FaceGen.ckpt",image_size=64, noise_size=1000, age_range=[10, 100], learningRate=2e-4, inputPipeline=False, queueCapacity=4, fusedTrainStep=False, intraOpThreads=0, interOpThreads=0, asyncCheckpoint=False, restore="newest", numTowers=1):
         self.age_range = age_range
         self.batch_size = batch_size
         self.image_size = image_size
         self.noise_size=noise_size
-
+        self.input_pipeline = inputPipeline
+        self.fused_train_step = fusedTrainStep
+        if batch_size % numTowers != 0:
+            raise ValueError("batch size " + str(batch_size) + " can't be split evenly across " + str(numTowers) + " towers")
+        self.num_towers = numTowers
+        self.layer_variables = {}
+        self.face_evaluator = None
+        self.log_lock = threading.Lock()
+        self.face_sample_size = 300
+        self.last_losses = {"d_loss": None, "g_loss": None}
+        self.last_face_acc = (None, None)
+
+        self._buildInputs(inputPipeline, queueCapacity)
         self._buildGenerator()
+        self._buildSampleGenerator()
         self._buildDiscriminator()
         self._buildCostFunctions(startLearningRate=learningRate)
+        # the manifest indexes the saved checkpoints, and decides which ones are kept
+        self.checkpoint_manifest = CheckpointManifest(chkptDir, chkptName, maxToKeep=3)
+        # the async writer's snapshot variables are part of the graph, so they are built before the session
+        self.checkpoint_writer = None
+        if asyncCheckpoint:
+            self.checkpoint_writer = AsyncCheckpointWriter(tf.all_variables(), chkptDir, chkptName, self.checkpoint_manifest)
 
         #create a constant noise vector for printing, so we can watch images improve over time
         print_noise_path = "print_noise.p"
@@ -88,23 +120,100 @@ class NeuralNet(object):
             file = open(print_noise_path, "wb")
             pickle.dump(self.print_noise, file)
 
-        sess = tf.Session()
+        # 0 lets tensorflow pick the thread counts from the number of cores
+        sessionConfig = tf.ConfigProto(intra_op_parallelism_threads=intraOpThreads,
+                                       inter_op_parallelism_threads=interOpThreads)
+        sess = tf.Session(config=sessionConfig)
         sess.run(tf.initialize_all_variables())
+        sess.run(tf.initialize_local_variables())
         self.session = sess
-        self.saver = tf.train.Saver(max_to_keep=3)
+        # old checkpoints are removed by the manifest, so the best one can be kept along with the newest
+        self.saver = tf.train.Saver(max_to_keep=0)
         self.checkpoint_name = chkptName
         self.checkpoint_dir = chkptDir
         self.checkpoint_num = 0
-        self.restoreNewestCheckpoint()
+        if restore == "best":
+            self.restoreBestCheckpoint()
+        else:
+            self.restoreNewestCheckpoint()
         pd.set_option('display.float_format', lambda x: '%.4f' % x)
         pd.set_option('expand_frame_repr', False)
 
+    def _buildInputs(self, use_pipeline, queue_capacity):
+        image_shape = [self.batch_size, self.image_size, self.image_size, 3]
+        label_shape = [self.batch_size, 1]
+        noise_shape = [self.batch_size, self.noise_size]
+        if not use_pipeline:
+            self.input_sex = tf.placeholder(tf.float32, shape=label_shape)
+            self.input_age = tf.placeholder(tf.float32, shape=label_shape)
+            self.input_noise = tf.placeholder(tf.float32, shape=noise_shape)
+            self.dis_input_image = tf.placeholder(tf.float32, shape=image_shape)
+            return
+        # batches are enqueued by a background thread, so the training loop never copies them in through feed_dict
+        self.queue_image = tf.placeholder(tf.float32, shape=image_shape)
+        self.queue_sex = tf.placeholder(tf.float32, shape=label_shape)
+        self.queue_age = tf.placeholder(tf.float32, shape=label_shape)
+        self.input_queue = tf.FIFOQueue(queue_capacity, [tf.float32, tf.float32, tf.float32],
+                                        shapes=[image_shape, label_shape, label_shape])
+        self.enqueue_batch = self.input_queue.enqueue([self.queue_image, self.queue_sex, self.queue_age])
+        self.close_queue = self.input_queue.close(cancel_pending_enqueues=True)
+        # the dequeued batch is staged in local variables (which aren't checkpointed), so every session.run
+        # in a training step sees the same batch and noise
+        staged_image = self._create_staging_variable(image_shape, "staged_image")
+        staged_sex = self._create_staging_variable(label_shape, "staged_sex")
+        staged_age = self._create_staging_variable(label_shape, "staged_age")
+        staged_noise = self._create_staging_variable(noise_shape, "staged_noise")
+        self.staged_batch = (staged_image, staged_sex, staged_age)
+        self.staged_noise = staged_noise
+        self.stage_batch = self._buildStageOp()
+        # still placeholders, so printing and sampling can feed their own values over the staged ones
+        self.input_sex = tf.placeholder_with_default(staged_sex, label_shape)
+        self.input_age = tf.placeholder_with_default(staged_age, label_shape)
+        self.input_noise = tf.placeholder_with_default(staged_noise, noise_shape)
+        self.dis_input_image = tf.placeholder_with_default(staged_image, image_shape)
+
+    def _create_staging_variable(self, shape, name):
+        return tf.Variable(tf.zeros(shape), trainable=False, collections=[tf.GraphKeys.LOCAL_VARIABLES], name=name)
+
+    def _buildStageOp(self):
+        # dequeues the next batch into the staging variables, along with fresh noise
+        staged_image, staged_sex, staged_age = self.staged_batch
+        queued_image, queued_sex, queued_age = self.input_queue.dequeue()
+        new_noise = tf.random_uniform([self.batch_size, self.noise_size], -1, 1)
+        return tf.group(staged_image.assign(queued_image), staged_sex.assign(queued_sex),
+                        staged_age.assign(queued_age), self.staged_noise.assign(new_noise))
+
     def _buildGenerator(self):
+        # with several towers, each one generates and discriminates an equal slice of the batch, sharing the
+        # same variables. Independent towers let tensorflow spread a step over more cores
+        if self.num_towers == 1:
+            self.tower_inputs = [(self.input_sex, self.input_age, self.input_noise, self.dis_input_image)]
+        else:
+            self.tower_inputs = list(zip(tf.split(0, self.num_towers, self.input_sex),
+                                         tf.split(0, self.num_towers, self.input_age),
+                                         tf.split(0, self.num_towers, self.input_noise),
+                                         tf.split(0, self.num_towers, self.dis_input_image)))
+        self.tower_gen_outputs = [self._buildGeneratorNetwork(sex, age, noise) for sex, age, noise, _ in self.tower_inputs]
+        if self.num_towers == 1:
+            self.gen_output = self.tower_gen_outputs[0]
+        else:
+            self.gen_output = tf.concat(0, self.tower_gen_outputs)
+
+    def _buildSampleGenerator(self):
+        # inference-only copy of the generator, sharing the training weights
+        # the batch dimension is left open, so samples of any size can be generated without padding,
+        # and nothing here depends on the discriminator inputs
+        # nodes are named, so the graph can be frozen and reloaded without this class (see GeneratorExport.py)
+        self.sample_sex = tf.placeholder(tf.float32, shape=[None, 1], name="sample_sex")
+        self.sample_age = tf.placeholder(tf.float32, shape=[None, 1], name="sample_age")
+        self.sample_noise = tf.placeholder(tf.float32, shape=[None, self.noise_size], name="sample_noise")
+        self.sample_chunk_size = tf.constant(self.batch_size, name="sample_chunk_size")
+        sample_output = self._buildGeneratorNetwork(self.sample_sex, self.sample_age, self.sample_noise)
+        self.sample_output = tf.identity(sample_output, name="sample_output")
+
+    def _buildGeneratorNetwork(self, input_sex, input_age, input_noise):
         # build the generator network
-        self.input_sex = tf.placeholder(tf.float32, shape=[self.batch_size, 1])
-        self.input_age = tf.placeholder(tf.float32, shape=[self.batch_size, 1])
-        self.input_noise = tf.placeholder(tf.float32, shape=[self.batch_size, self.noise_size])
-        combined_inputs = tf.concat(1, [self.input_sex, self.input_age, self.input_noise])
+        combined_inputs = tf.concat(1, [input_sex, input_age, input_noise])
         # [1000, 102]
         gen_fully_connected1 = self.create_fully_connected_layer(combined_inputs, 5000,
                                                                  self.noise_size+2,
@@ -115,7 +224,7 @@ class NeuralNet(object):
                                                                  5000,
                                                                  name_prefix="gen_fc2")
         # [1000, 4096]
-        gen_squared_fc2 = tf.reshape(gen_fully_connected2, [self.batch_size, 8, 8, 64])
+        gen_squared_fc2 = tf.reshape(gen_fully_connected2, [-1, 8, 8, 64])
         # [1000, 8, 8, 64]
         gen_squared_fc2_norm = self.create_batchnorm_layer(gen_squared_fc2, [8,8,64], name_prefix="gen_fc2")
         gen_unpool1 = self.create_upsample_layer(gen_squared_fc2_norm, 16)
@@ -133,20 +242,27 @@ class NeuralNet(object):
         gen_unconv3 = self.create_deconv_layer(gen_unpool3, 3, 16, name_prefix="gen_unconv3")
         # [1000,64,64,3]
         gen_unconv3_norm = self.create_batchnorm_layer(gen_unconv3, [64,64,3],name_prefix="gen_unconv3")
-        self.gen_output = tf.nn.tanh(gen_unconv3_norm)
+        return tf.nn.tanh(gen_unconv3_norm)
 
     def _buildDiscriminator(self):
-        self.dis_input_image = tf.placeholder(tf.float32, shape=[self.batch_size, 64, 64, 3])
-        dis_combined_inputs = tf.concat(0, [self.gen_output, self.dis_input_image])
+        self.tower_dis_outputs = []
+        for gen_output, (input_sex, input_age, _, input_image) in zip(self.tower_gen_outputs, self.tower_inputs):
+            self.tower_dis_outputs += [self._buildDiscriminatorNetwork(gen_output, input_image, input_sex, input_age)]
+        if self.num_towers == 1:
+            self.dis_output = self.tower_dis_outputs[0]
+
+    def _buildDiscriminatorNetwork(self, gen_output, input_image, input_sex, input_age):
+        tower_size = self.batch_size // self.num_towers
+        dis_combined_inputs = tf.concat(0, [gen_output, input_image])
         #[2000, 64, 64, 3]
 
         #combine sex and age as new channels on the image
-        sex_channel = tf.ones([self.batch_size, self.image_size*self.image_size]) * self.input_sex
+        sex_channel = tf.ones([tower_size, self.image_size*self.image_size]) * input_sex
         sex_channel = tf.concat(0, [sex_channel, sex_channel])
-        sex_channel = tf.reshape(sex_channel, [self.batch_size*2, 64, 64, 1])
-        age_channel = tf.ones([self.batch_size, self.image_size * self.image_size]) * self.input_age
+        sex_channel = tf.reshape(sex_channel, [tower_size*2, 64, 64, 1])
+        age_channel = tf.ones([tower_size, self.image_size * self.image_size]) * input_age
         age_channel =  tf.concat(0, [age_channel, age_channel])
-        age_channel = tf.reshape(age_channel, [self.batch_size * 2, 64, 64, 1])
+        age_channel = tf.reshape(age_channel, [tower_size * 2, 64, 64, 1])
         combined_channels = tf.concat(3, [dis_combined_inputs, sex_channel, age_channel])
 
         # [2000, 64, 64, 5]
@@ -162,16 +278,16 @@ class NeuralNet(object):
         # [2000, 16, 16, 64]
         dis_pool3 = self.create_max_pool_layer(dis_conv3)
         # [2000, 8, 8, 64]
-        dis_flattened = tf.reshape(dis_pool3, [self.batch_size*2, -1])
+        dis_flattened = tf.reshape(dis_pool3, [tower_size*2, -1])
         # [2000, 4096]
         dis_combined_vec = tf.concat(1, [dis_flattened,
-                                         tf.concat(0, [self.input_sex, self.input_sex]),
-                                         tf.concat(0, [self.input_age, self.input_age])])
+                                         tf.concat(0, [input_sex, input_sex]),
+                                         tf.concat(0, [input_age, input_age])])
         dis_fully_connected1 = self.create_fully_connected_layer(dis_combined_vec, 5000,
                                                                       (8*8*64)+2,
                                                                       name_prefix="dis_fc")
         # [2000, 5000]
-        self.dis_output = self.create_output_layer(dis_fully_connected1,5000,1,name_prefix="dis_out")
+        return self.create_output_layer(dis_fully_connected1,5000,1,name_prefix="dis_out")
         # [2000, 1]
 
 
@@ -183,20 +299,80 @@ class NeuralNet(object):
         current_rate = tf.train.exponential_decay(startLearningRate, curr_step, 100, rateDecay, staircase=True)
         self.current_rate = tf.maximum(current_rate, minLearningRate)
 
-        generated_logits, true_logits = tf.split(0, 2, self.dis_output);
-
-        self.dis_loss_real = tf.reduce_mean(tf.nn.sigmoid_cross_entropy_with_logits(true_logits, tf.ones([self.batch_size, 1])))
-        self.dis_loss_fake = tf.reduce_mean(tf.nn.sigmoid_cross_entropy_with_logits(generated_logits, tf.zeros([self.batch_size, 1])))
+        tower_size = self.batch_size // self.num_towers
+        self.tower_dis_losses = []
+        self.tower_gen_losses = []
+        tower_losses_real = []
+        tower_losses_fake = []
+        for dis_output in self.tower_dis_outputs:
+            generated_logits, true_logits = tf.split(0, 2, dis_output);
+
+            loss_real = tf.reduce_mean(tf.nn.sigmoid_cross_entropy_with_logits(true_logits, tf.ones([tower_size, 1])))
+            loss_fake = tf.reduce_mean(tf.nn.sigmoid_cross_entropy_with_logits(generated_logits, tf.zeros([tower_size, 1])))
+            tower_losses_real += [loss_real]
+            tower_losses_fake += [loss_fake]
+            self.tower_dis_losses += [loss_real + loss_fake]
+            self.tower_gen_losses += [tf.reduce_mean(tf.nn.sigmoid_cross_entropy_with_logits(generated_logits, tf.ones([tower_size, 1])))]
+
+        # the towers' losses are averaged, so every tower sees the same balance rule decision
+        self.dis_loss_real = self._towerMean(tower_losses_real)
+        self.dis_loss_fake = self._towerMean(tower_losses_fake)
         self.dis_loss = self.dis_loss_real + self.dis_loss_fake
 
-        self.gen_loss = tf.reduce_mean(tf.nn.sigmoid_cross_entropy_with_logits(generated_logits, tf.ones([self.batch_size, 1])))
+        self.gen_loss = self._towerMean(self.tower_gen_losses)
 
         t_vars = tf.trainable_variables()
         dis_vars = [var for var in t_vars if 'dis_' in var.name]
         gen_vars = [var for var in t_vars if 'gen_' in var.name]
 
-        self.dis_train = tf.train.AdamOptimizer(self.current_rate, beta1=beta1).minimize(self.dis_loss, var_list=dis_vars, global_step=dis_step)
-        self.gen_train = tf.train.AdamOptimizer(self.current_rate, beta1=beta1).minimize(self.gen_loss, var_list=gen_vars, global_step=gen_step)
+        dis_optimizer = tf.train.AdamOptimizer(self.current_rate, beta1=beta1)
+        gen_optimizer = tf.train.AdamOptimizer(self.current_rate, beta1=beta1)
+        self.dis_train = self._buildUpdate(dis_optimizer, self.tower_dis_losses, dis_vars, dis_step)
+        self.gen_train = self._buildUpdate(gen_optimizer, self.tower_gen_losses, gen_vars, gen_step)
+
+        if self.fused_train_step:
+            self._buildFusedTrainStep(dis_optimizer, gen_optimizer, dis_vars, gen_vars, dis_step, gen_step)
+
+    def _buildFusedTrainStep(self, dis_optimizer, gen_optimizer, dis_vars, gen_vars, dis_step, gen_step):
+        # fused train step: the balance rule is evaluated in-graph, so a step is a single session.run
+        # the optimizers are shared with dis_train/gen_train, so no new variables (or checkpoint entries) are made
+        self.should_train_dis = tf.less(self.gen_loss / self.dis_loss, 2.0)
+        self.should_train_gen = tf.less(self.dis_loss / self.gen_loss, 3.0)
+        self.did_train_gen = self._buildConditionalUpdate(self.should_train_gen, gen_optimizer, self.tower_gen_losses, gen_vars, gen_step)
+        # both updates use gradients from the same forward pass. The generator's gradients flow back through
+        # the discriminator, so the discriminator is only updated once they have been computed
+        with tf.control_dependencies([self.did_train_gen]):
+            self.did_train_dis = self._buildConditionalUpdate(self.should_train_dis, dis_optimizer, self.tower_dis_losses, dis_vars, dis_step)
+        self.fused_train = tf.group(self.did_train_gen, self.did_train_dis)
+        if self.input_pipeline:
+            # stage the next batch once this step's updates are done, so the next step needs no extra run
+            with tf.control_dependencies([self.did_train_gen, self.did_train_dis]):
+                self.fused_train = tf.group(self.fused_train, self._buildStageOp())
+
+    def _towerMean(self, tower_values):
+        if len(tower_values) == 1:
+            return tower_values[0]
+        return tf.add_n(tower_values) / float(len(tower_values))
+
+    def _buildUpdate(self, optimizer, tower_losses, var_list, global_step):
+        if len(tower_losses) == 1:
+            return optimizer.minimize(tower_losses[0], var_list=var_list, global_step=global_step)
+        # each tower's gradients only depend on its own slice, so they can be computed in parallel before
+        # being averaged into a single update of the shared variables
+        tower_grads = [optimizer.compute_gradients(loss, var_list=var_list) for loss in tower_losses]
+        averaged = []
+        for grads_and_vars in zip(*tower_grads):
+            grads = [grad for grad, _ in grads_and_vars if grad is not None]
+            if len(grads) > 0:
+                averaged += [(self._towerMean(grads), grads_and_vars[0][1])]
+        return optimizer.apply_gradients(averaged, global_step=global_step)
+
+    def _buildConditionalUpdate(self, should_train, optimizer, tower_losses, var_list, global_step):
+        def update():
+            train_op = self._buildUpdate(optimizer, tower_losses, var_list, global_step)
+            with tf.control_dependencies([train_op]):
+                return tf.constant(True)
+        return tf.cond(should_train, update, lambda: tf.constant(False))
 
 
     """
@@ -205,38 +381,150 @@ class NeuralNet(object):
 
     """
     saves the state of the network in self.checkpoint_dir
+    with asyncCheckpoint, training is only blocked while the variables are snapshotted, and the files are
+    written on a background thread
 
     Params
         runsSinceLast:  the number of training rounds that have been completed since the last checkpoint
+
+    Returns
+        0:  the number of seconds training was blocked by the save
     """
     def saveCheckpoint(self, runsSinceLast):
-        if runsSinceLast > 0:
-            self.checkpoint_num = self.checkpoint_num + runsSinceLast
+        if runsSinceLast <= 0:
+            return 0.0
+        self.checkpoint_num = self.checkpoint_num + runsSinceLast
+        info = {"dLoss": self.last_losses["d_loss"], "gLoss": self.last_losses["g_loss"],
+                "faceAcc": self.last_face_acc[1], "faceAccStep": self.last_face_acc[0]}
+        if self.checkpoint_writer is not None:
+            blocked = self.checkpoint_writer.save(self.session, self.checkpoint_num, info)
+        else:
+            startTime = time.time()
             self.saver.save(self.session, self.checkpoint_dir + "/" + self.checkpoint_name, self.checkpoint_num)
-            print(self.checkpoint_name + " " + str(self.checkpoint_num) + " saved")
+            self.checkpoint_manifest.add(self.checkpoint_num, **info)
+            writeCheckpointState(self.checkpoint_dir, self.checkpoint_manifest)
+            blocked = time.time() - startTime
+        print(self.checkpoint_name + " " + str(self.checkpoint_num) + " saved (blocked training " + "%.2f" % blocked + "s)")
+        return blocked
 
     """
-    Restores the latest checkpoint saved in self.checkpoint_dir
+    waits for any checkpoint being written in the background to finish
+    """
+    def flushCheckpoints(self):
+        if self.checkpoint_writer is not None:
+            self.checkpoint_writer.wait()
+
+    """
+    Restores the latest checkpoint saved in self.checkpoint_dir, found from the checkpoint manifest
     """
     def restoreNewestCheckpoint(self):
+        self._restoreCheckpoint(self.checkpoint_manifest.newest())
+
+    """
+    Restores the checkpoint in self.checkpoint_dir with the highest face detection rate,
+    or the newest one if no checkpoint has been scored
+    """
+    def restoreBestCheckpoint(self):
+        self._restoreCheckpoint(self.checkpoint_manifest.best())
+
+    def _restoreCheckpoint(self, entry):
         if not path.exists(self.checkpoint_dir):
             mkdir(self.checkpoint_dir)
-        highest_found = 0
-        path_found = None
-        for subdir, dirs, files in walk(self.checkpoint_dir):
-            for file in files:
-                if self.checkpoint_name in file and ".meta" not in file and ".txt" not in file:
-                    iteration_num = int(file.split("-")[-1])
-                    if iteration_num >= highest_found:
-                        highest_found = iteration_num
-                        path_found = path.join(subdir, file)
-        if path_found is not None:
+        if entry is not None:
             #if existing one was found, restore previous checkpoint
-            print ("restoring checkpoint ", path_found)
+            path_found = self.checkpoint_manifest.path(entry)
+            print ("restoring checkpoint ", path_found, " face_acc: ", entry["face_acc"])
             self.saver.restore(self.session, path_found)
+            self.checkpoint_num = entry["step"]
         else:
             print("no checkpoint found named " + self.checkpoint_name + " in " + self.checkpoint_dir)
-        self.checkpoint_num = highest_found
+            self.checkpoint_num = 0
+
+    """
+    starts feeding the input pipeline from a DataLoader on a background thread
+    only used when the network was created with inputPipeline=True
+
+    Params
+        loader:     the DataLoader to pull batches from
+    """
+    def startInputPipeline(self, loader):
+        self.input_loader = loader
+        self.input_stopped = False
+        feedThread = threading.Thread(target=self._feedInputQueue)
+        feedThread.daemon = True
+        feedThread.start()
+        # stage the first batch, so printStatus has something to show before the first training step
+        self.session.run(self.stage_batch)
+
+    def _feedInputQueue(self):
+        while not self.input_stopped:
+            batch = self.input_loader.getData()
+            feed_dict = {self.queue_image: batch["image"], self.queue_sex: batch["sex"], self.queue_age: batch["age"]}
+            try:
+                self.session.run(self.enqueue_batch, feed_dict=feed_dict)
+            except tf.errors.OpError:
+                if self.input_stopped:
+                    return
+                raise
+
+    """
+    stops the thread feeding the input pipeline, and closes the queue
+    """
+    def stopInputPipeline(self):
+        self.input_stopped = True
+        self.session.run(self.close_queue)
+
+    """
+    starts scoring face detection on a background thread, so printStatus(detectFaces=True) doesn't stall training
+    the samples are still generated on the training thread, so they match the round they are logged against
+
+    Params
+        engine:     the FaceDetector.FaceDetectorEngine to score with. Its worker processes are best started
+                    before the network is built. If None, a new engine is created
+        numSamples: the number of images to generate and score each time
+        maxPending: the maximum number of sample sets waiting to be scored. Extra sets are skipped
+    """
+    def startFaceEvaluator(self, engine=None, numSamples=300, maxPending=2):
+        self.face_sample_size = numSamples
+        self.face_evaluator = FaceDetector.AsyncFaceEvaluator(self._recordFaceAcc, engine=engine, maxPending=maxPending)
+
+    def _recordFaceAcc(self, num, faceAcc, logFilePath):
+        print("round: " + str(num) + " faces_detected: " + str(faceAcc))
+        self._noteFaceAcc(num, faceAcc)
+        if logFilePath is None:
+            return
+        with self.log_lock:
+            if not path.exists(logFilePath):
+                return
+            file = open(logFilePath, "r")
+            lines = file.readlines()
+            file.close()
+            # the row for this round is usually one of the last, so search from the end
+            for lineNum in range(len(lines) - 1, 0, -1):
+                fields = lines[lineNum].rstrip("\n").split("\t")
+                if fields[0] == str(num):
+                    fields[-1] = str(faceAcc)
+                    lines[lineNum] = "\t".join(fields) + "\n"
+                    tmpPath = logFilePath + ".tmp"
+                    file = open(tmpPath, "w")
+                    file.writelines(lines)
+                    file.close()
+                    rename(tmpPath, logFilePath)
+                    return
+
+    def _noteFaceAcc(self, num, faceAcc):
+        # kept for the manifest entry of the next checkpoint, and stored on the nearest saved one
+        if self.last_face_acc[0] is None or num >= self.last_face_acc[0]:
+            self.last_face_acc = (num, faceAcc)
+        self.checkpoint_manifest.recordFaceAcc(num, faceAcc)
+
+    """
+    stops the background face evaluator, once any queued samples have been scored
+    """
+    def stopFaceEvaluator(self):
+        if self.face_evaluator is not None:
+            self.face_evaluator.close()
+            self.face_evaluator = None
 
     """
     trains the network. Both generator and discriminator have a chance to be trained
@@ -244,19 +532,56 @@ class NeuralNet(object):
 
     Params
         truthImages:    an batch of images from the dataset
+                        if None, the next batch is taken from the input pipeline, and noise is generated in-graph
         truthGenders:   the corresponding sex values of the truthImages
         truthAges:      the corresponding age values of the truthImages
+        profiler:       an optional StepProfiler. Each session.run is timed as a section: "loss_eval",
+                        "d_update" and "g_update", or "fused_step" with fusedTrainStep
+
+    Returns
+        0:  a dictionary with the step's discriminator and generator losses (measured before the updates),
+            and whether each network was trained
     """
-    def train(self, truthImages, truthGenders, truthAges):
-        noise_batch = np.random.uniform(-1, 1, [self.batch_size, self.noise_size]).astype(np.float32)
-        feed_dict = {self.input_noise: noise_batch, self.input_age: truthAges, self.input_sex: truthGenders,
-                     self.dis_input_image: truthImages}
-        errFake, errReal, gen_cost = self.session.run((self.dis_loss_fake, self.dis_loss_real, self.gen_loss), feed_dict=feed_dict)
-        dis_cost = errFake + errReal
-        if gen_cost/dis_cost < 2:
-            self.session.run((self.dis_train), feed_dict=feed_dict)
-        if dis_cost/gen_cost < 3:
-            self.session.run((self.gen_train), feed_dict=feed_dict)
+    def train(self, truthImages=None, truthGenders=None, truthAges=None, profiler=None):
+        if profiler is None:
+            profiler = NullProfiler()
+        if truthImages is None:
+            if not self.fused_train_step:
+                self._profiledRun(profiler, "stage_batch", self.stage_batch)
+            feed_dict = None
+        else:
+            noise_batch = np.random.uniform(-1, 1, [self.batch_size, self.noise_size]).astype(np.float32)
+            feed_dict = {self.input_noise: noise_batch, self.input_age: truthAges, self.input_sex: truthGenders,
+                         self.dis_input_image: truthImages}
+        if self.fused_train_step:
+            runList = (self.fused_train, self.dis_loss, self.gen_loss, self.did_train_dis, self.did_train_gen)
+            _, dis_cost, gen_cost, trainedDis, trainedGen = self._profiledRun(profiler, "fused_step", runList, feed_dict)
+        else:
+            errFake, errReal, gen_cost = self._profiledRun(profiler, "loss_eval", (self.dis_loss_fake, self.dis_loss_real, self.gen_loss), feed_dict)
+            dis_cost = errFake + errReal
+            trainedDis = gen_cost/dis_cost < 2
+            trainedGen = dis_cost/gen_cost < 3
+            if trainedDis:
+                self._profiledRun(profiler, "d_update", self.dis_train, feed_dict)
+            if trainedGen:
+                self._profiledRun(profiler, "g_update", self.gen_train, feed_dict)
+        self.last_losses = {"d_loss": dis_cost, "g_loss": gen_cost}
+        if not trainedDis:
+            profiler.count("d_skipped")
+        if not trainedGen:
+            profiler.count("g_skipped")
+        return {"d_loss": dis_cost, "g_loss": gen_cost, "trained_dis": bool(trainedDis), "trained_gen": bool(trainedGen)}
+
+    def _profiledRun(self, profiler, name, fetches, feed_dict=None):
+        # op-level tracing is only requested for the profiler's sampled window of steps
+        options, metadata = profiler.runOptions()
+        with profiler.section(name):
+            if options is None:
+                result = self.session.run(fetches, feed_dict=feed_dict)
+            else:
+                result = self.session.run(fetches, feed_dict=feed_dict, options=options, run_metadata=metadata)
+        profiler.recordRunMetadata(name, metadata)
+        return result
 
     """
     prints the current state of the neural network, primarily cost values
@@ -264,79 +589,80 @@ class NeuralNet(object):
     Params
         num:            the number of training rounds the network has gone through
         truthImages:    an batch of images from the dataset
+                        if None, the batch last staged by the input pipeline is used
         truthGenders:   the corresponding sex values of the truthImages
         truthAges:      the corresponding age values of the truthImages
         detectFaces:    if true, will sample the network and find how many images have detectable faces
         logFilePath:    a path to a file to log results in. If false, results will be printed to the
                         console, but not saved
+        profiler:       an optional StepProfiler. The losses, log and face samples are timed as "logging",
+                        and rendering the image grids as "image_writes"
     """
-    def printStatus(self,num, truthImages, truthGenders, truthAges, detectFaces=False, logFilePath=None):
-        feed_dict = {self.input_noise: self.print_noise, self.input_age: truthAges, self.input_sex: truthGenders,
-                     self.dis_input_image: truthImages}
-
-        runList = (self.dis_loss_fake, self.dis_loss_real, self.gen_loss, self.current_rate)
-        errFake, errReal, errGen, rate = self.session.run(runList, feed_dict=feed_dict)
-        printStr = "round: "  + str(num) + " d_loss: " + str(errFake+errReal) + ", g_loss: " + str(errGen) + " learning_rate: " + str(rate)
-        if detectFaces:
-            samples = Sampler.randomSample(self, 300)
-            err, _ = FaceDetector.detectErrorRate(samples, False)
-            faceAcc = str((1-err))
-            printStr = printStr + " faces_detected: " + faceAcc
-        else:
+    def printStatus(self,num, truthImages=None, truthGenders=None, truthAges=None, detectFaces=False, logFilePath=None, profiler=None):
+        if profiler is None:
+            profiler = NullProfiler()
+        with profiler.section("logging"):
+            if truthImages is None:
+                truthImages, truthGenders, truthAges = self.session.run(self.staged_batch)
+            feed_dict = {self.input_noise: self.print_noise, self.input_age: truthAges, self.input_sex: truthGenders,
+                         self.dis_input_image: truthImages}
+
+            runList = (self.dis_loss_fake, self.dis_loss_real, self.gen_loss, self.current_rate)
+            errFake, errReal, errGen, rate = self.session.run(runList, feed_dict=feed_dict)
+            printStr = "round: "  + str(num) + " d_loss: " + str(errFake+errReal) + ", g_loss: " + str(errGen) + " learning_rate: " + str(rate)
             faceAcc = "-"
-        print(printStr)
-        if logFilePath is not None:
-            if path.exists(logFilePath) and num==0:
-                #overwrite old file
-                remove(logFilePath)
-            firstWrite = not path.exists(logFilePath)
-            file = open(logFilePath, "a")
-            if firstWrite:
-                file.write("round\td_loss\tg_loss\tlearning_rate\tface_acc\n")
-            file.write(str(num)+"\t"+str(errFake+errReal)+"\t"+str(errGen)+"\t"+str(rate)+"\t"+faceAcc+'\n')
-            file.close()
-        #render images to files
-        printSexLabels = np.repeat([-1,1],self.batch_size/2).reshape([self.batch_size, 1])
-        ageRange = np.linspace(-0.7, 0.7, self.batch_size/2)
-        printAgeLabels = np.concatenate([ageRange, ageRange]).reshape([self.batch_size, 1])
-
-        feed_dict = {self.input_noise: self.print_noise, self.input_age: printAgeLabels, self.input_sex: printSexLabels,
-                     self.dis_input_image: truthImages}
-        outImages = self.session.run(self.gen_output, feed_dict=feed_dict)
-        outImages = (outImages + 1.0) / 2.0
-        visualizeImages(outImages, numRows=8, fileName="./images/run_" + str(num) + ".png" )
-        visualizeImages(outImages, numRows=8, fileName="output.png" )
-        truthImages = (truthImages + 1.0) / 2.0
-        visualizeImages(truthImages, numRows=8, fileName="last_batch.png")
+            if detectFaces and self.face_evaluator is not None:
+                # scored in the background; the log's face_acc is filled in for this round once it's ready
+                printStr = printStr + " faces_detected: pending"
+            elif detectFaces:
+                samples = Sampler.randomSample(self, self.face_sample_size)
+                err, _ = FaceDetector.detectErrorRate(samples, False)
+                faceAcc = str((1-err))
+                self._noteFaceAcc(num, 1-err)
+                printStr = printStr + " faces_detected: " + faceAcc
+            print(printStr)
+            if logFilePath is not None:
+                with self.log_lock:
+                    if path.exists(logFilePath) and num==0:
+                        #overwrite old file
+                        remove(logFilePath)
+                    firstWrite = not path.exists(logFilePath)
+                    file = open(logFilePath, "a")
+                    if firstWrite:
+                        file.write("round\td_loss\tg_loss\tlearning_rate\tface_acc\n")
+                    file.write(str(num)+"\t"+str(errFake+errReal)+"\t"+str(errGen)+"\t"+str(rate)+"\t"+faceAcc+'\n')
+                    file.close()
+            if detectFaces and self.face_evaluator is not None:
+                startTime = time.time()
+                samples = Sampler.randomSample(self, self.face_sample_size)
+                self.face_evaluator.submit(num, samples, info=logFilePath, startTime=startTime)
+        with profiler.section("image_writes"):
+            #render images to files
+            printSexLabels = np.repeat([-1,1],self.batch_size/2).reshape([self.batch_size, 1])
+            ageRange = np.linspace(-0.7, 0.7, self.batch_size/2)
+            printAgeLabels = np.concatenate([ageRange, ageRange]).reshape([self.batch_size, 1])
+
+            feed_dict = {self.input_noise: self.print_noise, self.input_age: printAgeLabels, self.input_sex: printSexLabels,
+                         self.dis_input_image: truthImages}
+            outImages = self.session.run(self.gen_output, feed_dict=feed_dict)
+            outImages = (outImages + 1.0) / 2.0
+            # pngs are written on a background thread, and the same grid is rendered once for both files
+            visualizeImages(outImages, numRows=8, fileName=["./images/run_" + str(num) + ".png", "output.png"])
+            truthImages = (truthImages + 1.0) / 2.0
+            visualizeImages(truthImages, numRows=8, fileName="last_batch.png")
 
     """
-    Generates a sample of images from the neural net
+    Generates a sample of images from the neural net, using Sampler.runGenerator
 
     Params
         noiseMat:   a numpy array of noise vectors
         genderMat:  a numpy array of gender values
         ageMat:     a numpy array of age values
+        chunkSize:  the number of images to generate per run. Defaults to the training batch size
 
     Returns
         0:  a nupy array of face images ([n,64,64,3])
     """
-    def getSample(self, noiseMat, genderMat, ageMat):
-        sampleSize = noiseMat.shape[0]
-        numRuns = int(ceil(sampleSize / float(self.batch_size)))
-        #add zeros to end of vectors
-        noiseMat = np.concatenate([noiseMat, np.zeros([self.batch_size, self.noise_size])])
-        genderMat = np.concatenate([genderMat, np.zeros([self.batch_size, 1])])
-        ageMat = np.concatenate([ageMat, np.zeros([self.batch_size, 1])])
-
-        returnMat = np.zeros([numRuns * self.batch_size, self.image_size, self.image_size, 3])
-        placeholderImages = np.zeros([self.batch_size, self.image_size, self.image_size, 3])
-        currIdx = 0
-        for _ in range(numRuns):
-            feed_dict = {self.input_noise: noiseMat[currIdx:currIdx+self.batch_size],
-                         self.input_age: ageMat[currIdx:currIdx+self.batch_size],
-                         self.input_sex: genderMat[currIdx:currIdx+self.batch_size],
-                         self.dis_input_image: placeholderImages}
-            resultMat = self.session.run(self.gen_output, feed_dict=feed_dict)
-            returnMat[currIdx:currIdx + self.batch_size, :, :, :] = resultMat
-            currIdx = currIdx + self.batch_size
-        return returnMat[:sampleSize, :, :, :]
+    def getSample(self, noiseMat, genderMat, ageMat, chunkSize=None):
+        return Sampler.runGenerator(self.session, self.sample_output, [self.sample_noise, self.sample_sex, self.sample_age],
+                                    noiseMat, genderMat, ageMat, self.batch_size, chunkSize=chunkSize)
@@ -0,0 +1,169 @@
+import os
+import sys
+import numpy as np
+from DataLoader import loadImage
+from ColumnStore import LoadColumnStore
+from BatchCache import datasetFingerprint
+
+"""
+Decodes every face in the dataset once, and packs them at a fixed size into contiguous
+uint8 shard files. An index sidecar is saved alongside the shards, holding the age, sex and
+csv row for every packed image, so training never needs to touch the original jpegs.
+The index also records the dataset's fingerprint, so packed data is never reused for a different csv, and a
+marker holding it is written before packing, so shards left by an interrupted run are only resumed for the same csv
+
+Shard i holds the images for csv rows [i*shardSize, (i+1)*shardSize), so a csv row is
+also its position in the packed data
+
+Params
+    csvdata:    the ColumnStore (or dataframe) of the .csv file of good quality faces we are working with
+    packDir:    the directory to write the shards and index to
+    imageSize:  the width/height every image is resized to
+    shardSize:  the number of images stored in each shard file
+
+Returns
+    0:  a PackedDataset for the packed data
+"""
+def packDataset(csvdata, packDir="./packed", imageSize=64, shardSize=8192):
+    if not os.path.exists(packDir):
+        os.makedirs(packDir)
+    numImages = len(csvdata)
+    numShards = int(np.ceil(numImages / float(shardSize)))
+    imageBytes = imageSize * imageSize * 3
+    fingerprint = datasetFingerprint(csvdata)
+    # shards left by an interrupted run are only reused if they were packed from the same csv
+    # at the same sizes, so the marker is written before any shard
+    marker = fingerprint + " " + str(imageSize) + " " + str(shardSize)
+    markerPath = os.path.join(packDir, "packing.txt")
+    previous = None
+    if os.path.exists(markerPath):
+        with open(markerPath) as markerFile:
+            previous = markerFile.read()
+    if previous != marker:
+        for fileName in os.listdir(packDir):
+            if fileName.startswith("shard_"):
+                os.remove(os.path.join(packDir, fileName))
+        with open(markerPath + ".tmp", "w") as markerFile:
+            markerFile.write(marker)
+        os.rename(markerPath + ".tmp", markerPath)
+    paths = csvdata["path"]
+    for shardNum in range(numShards):
+        shardPath = _shardPath(packDir, shardNum)
+        start = shardNum * shardSize
+        end = min(start + shardSize, numImages)
+        if os.path.exists(shardPath) and os.path.getsize(shardPath) == (end - start) * imageBytes:
+            # already packed by a previous (possibly interrupted) run of the same dataset
+            continue
+        tmpPath = shardPath + ".tmp"
+        shard = np.memmap(tmpPath, dtype=np.uint8, mode="w+", shape=(end - start, imageSize, imageSize, 3))
+        for i in range(start, end):
+            shard[i - start] = loadImage(paths[i], imageSize)
+        shard.flush()
+        del shard
+        os.rename(tmpPath, shardPath)
+        print("packed shard " + str(shardNum + 1) + "/" + str(numShards))
+    np.savez(os.path.join(packDir, "index.npz"),
+             age=np.asarray(csvdata["age"], dtype=np.float32),
+             isMale=np.asarray(csvdata["isMale"], dtype=np.float32),
+             csvRow=np.asarray(csvdata.index, dtype=np.int64),
+             imageSize=imageSize, shardSize=shardSize, numImages=numImages, fingerprint=fingerprint)
+    return PackedDataset(packDir)
+
+def _shardPath(packDir, shardNum):
+    return os.path.join(packDir, "shard_%05d.u8" % shardNum)
+
+"""
+Read-only view of a packed dataset. Shards are memory mapped, so opening is cheap and
+the OS page cache holds the hot images
+"""
+class PackedDataset(object):
+    """"""
+
+    """
+    Open a packed dataset
+
+    Params:
+        packDir:    the directory holding the shards and index written by packDataset
+    """
+    def __init__(self, packDir):
+        index = np.load(os.path.join(packDir, "index.npz"))
+        self.packDir = packDir
+        self.age = index["age"]
+        self.isMale = index["isMale"]
+        self.csvRow = index["csvRow"]
+        self.imageSize = int(index["imageSize"])
+        self.shardSize = int(index["shardSize"])
+        self.numImages = int(index["numImages"])
+        # packed data written before fingerprints were recorded never matches, so it's repacked once
+        self.fingerprint = str(index["fingerprint"]) if "fingerprint" in index else None
+        numShards = int(np.ceil(self.numImages / float(self.shardSize)))
+        self.shards = []
+        for shardNum in range(numShards):
+            shardLen = min(self.shardSize, self.numImages - shardNum * self.shardSize)
+            self.shards += [np.memmap(_shardPath(packDir, shardNum), dtype=np.uint8, mode="r",
+                                      shape=(shardLen, self.imageSize, self.imageSize, 3))]
+
+    """
+    Gathers a set of images out of the shards
+
+    Params:
+        idxArr: the csv rows of the images to gather
+        out:    an optional uint8 array to write the images into
+
+    Returns:
+        0:  a uint8 numpy array of the images ([len(idxArr), imageSize, imageSize, 3])
+    """
+    def gather(self, idxArr, out=None):
+        idxArr = np.asarray(idxArr, dtype=np.int64)
+        if out is None:
+            out = np.empty([idxArr.shape[0], self.imageSize, self.imageSize, 3], dtype=np.uint8)
+        shardNums = idxArr // self.shardSize
+        offsets = idxArr % self.shardSize
+        for shardNum in np.unique(shardNums):
+            mask = shardNums == shardNum
+            out[mask] = self.shards[shardNum][offsets[mask]]
+        return out
+
+"""
+Function to open the packed dataset, or pack it first if needed
+The packed data is reused only if its image size and dataset fingerprint match, so a changed csv
+(even one with the same number of rows) is always repacked
+
+Params
+    csvdata:    the ColumnStore (or dataframe) of the .csv file of good quality faces we are working with
+    packDir:    the directory of the packed data
+    imageSize:  the width/height of the packed images
+
+Returns
+    0:  a PackedDataset for the data
+"""
+def LoadPackedData(csvdata, packDir="./packed", imageSize=64):
+    indexPath = os.path.join(packDir, "index.npz")
+    if os.path.exists(indexPath):
+        packed = PackedDataset(packDir)
+        if (packed.imageSize == imageSize and packed.numImages == len(csvdata) and
+                packed.fingerprint == datasetFingerprint(csvdata)):
+            print("restoring packed data...")
+            return packed
+        print("packed data doesn't match dataset; repacking...")
+        del packed
+        for fileName in os.listdir(packDir):
+            os.remove(os.path.join(packDir, fileName))
+    print("packing images into " + packDir + "...")
+    return packDataset(csvdata, packDir=packDir, imageSize=imageSize)
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("requires 2 parameters (csv_path, image_size) and optionally pack_dir")
+        exit()
+
+    csvPath = sys.argv[1]
+    imageSize = int(sys.argv[2])
+    packDir = sys.argv[3] if len(sys.argv) > 3 else "./packed"
+
+    if not os.path.exists(csvPath):
+        print("csv file not found")
+        exit()
+
+    csvdata = LoadColumnStore(csvPath)
+    LoadPackedData(csvdata, packDir=packDir, imageSize=imageSize)
@@ -0,0 +1,48 @@
+import numpy as np
+
+# the precisions the generator's layer weights can be stored in
+PRECISIONS = ["float32", "bfloat16", "int8"]
+
+"""
+Quantizes a weight matrix to int8, with a float32 scale for each slice along the last axis
+
+Params
+    weights:    a float32 numpy array
+
+Returns
+    0:  the int8 numpy array
+    1:  the float32 scales, so weights ~= quantized * scales
+"""
+def quantizeInt8(weights):
+    maxAbs = np.abs(weights).reshape([-1, weights.shape[-1]]).max(axis=0)
+    scales = (np.maximum(maxAbs, 1e-12) / 127.0).astype(np.float32)
+    quantized = np.clip(np.round(weights / scales), -127, 127).astype(np.int8)
+    return quantized, scales
+
+"""
+Rounds a weight matrix to bfloat16 (the top 16 bits of a float32), stored as int16
+
+Params
+    weights:    a float32 numpy array
+
+Returns
+    0:  an int16 numpy array holding the bfloat16 bit patterns
+"""
+def quantizeBfloat16(weights):
+    bits = np.ascontiguousarray(weights, dtype=np.float32).view(np.uint32).astype(np.uint64)
+    # round to nearest even on the bits that are dropped
+    bits = bits + 0x7FFF + ((bits >> 16) & 1)
+    return (bits >> 16).astype(np.uint16).view(np.int16)
+
+"""
+Converts bfloat16 bit patterns from quantizeBfloat16 back to float32, the same way the exported graph does
+
+Params
+    stored:     an int16 numpy array of bfloat16 bit patterns
+
+Returns
+    0:  the float32 numpy array
+"""
+def dequantizeBfloat16(stored):
+    # sign extending the int16 and shifting it into the top half rebuilds the float32 bit pattern
+    return (np.asarray(stored, dtype=np.int32) * 65536).view(np.float32)
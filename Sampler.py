@@ -1,23 +1,24 @@
-import  NeuralNet
-from DataLoader import  LoadFilesData, DataLoader
-from Visualization import visualizeImages
+import os
+import sys
+import time
 from math import ceil, sqrt
 import numpy as np
 
 """
-Generate a sample from the network
+Builds the generator inputs used by randomSample: random faces, optionally all of one sex and/or age
 
 Params
-    network:    the neural network to sample from
-    sampleSize: the number of images to create
-    gender:     optionally specify the gender(s) to generate. int, array, or None
-    age:        optionally specify the age(s) to generate. int, array, or None
-    saveName:   if specified, will save a visualization image grid using this name
+    noiseSize:  the size of the network's noise vector
+    sampleSize: the number of faces
+    gender:     optionally specify the gender to generate. int, or None for random
+    age:        optionally specify the age to generate. int, or None for random ages between 15 and 75
 
 Returns
-    0:  a nupy array of the results generated
+    0:  the noise matrix ([n,noiseSize])
+    1:  the gender matrix ([n,1]), scaled to [-1,1]
+    2:  the age matrix ([n,1]), scaled to [-1,1]
 """
-def randomSample(network, sampleSize, gender=None, age=None, saveName=None):
+def randomInputs(noiseSize, sampleSize, gender=None, age=None):
     if gender is not None:
         genderVec = np.ones([sampleSize, 1]) * (gender != 0)
     else:
@@ -28,11 +29,133 @@ def randomSample(network, sampleSize, gender=None, age=None, saveName=None):
         ageVec = np.random.randint(15, 75, size=sampleSize)
     genderVec = ((genderVec * 2) - 1).astype(np.float32).reshape([-1, 1])
     ageVec = (((ageVec / 100.0) * 2) - 1).astype(np.float32).reshape([-1, 1])
-    noiseVec = np.random.uniform(-1, 1, [sampleSize, network.noise_size]).astype(np.float32)
-    samples =  network.getSample(noiseVec, genderVec, ageVec)
+    noiseVec = np.random.uniform(-1, 1, [sampleSize, noiseSize]).astype(np.float32)
+    return noiseVec, genderVec, ageVec
+
+"""
+Builds the generator inputs used by ageSample: one face, with the age increasing from minAge to maxAge
+
+Params
+    noiseSize:  the size of the network's noise vector
+    numAges:    the number of faces
+    minAge:     the lowest age value to use
+    maxAge:     the largest age value to use
+    gender:     optionally specify the gender to generate. int, or None for random
+    noiseArr:   the noise values to use, if a specific face is desired
+
+Returns
+    0:  the noise matrix ([numAges,noiseSize])
+    1:  the gender matrix ([numAges,1]), scaled to [-1,1]
+    2:  the age matrix ([numAges,1]), scaled to [-1,1]
+"""
+def ageInputs(noiseSize, numAges, minAge=25, maxAge=75, gender=None, noiseArr=None):
+    if gender is None:
+        gender = np.random.randint(2, size=1)
+    if noiseArr is None:
+        noiseArr = np.random.uniform(-1, 1, [1, noiseSize]).astype(np.float32)
+    ageMat = (((np.linspace(minAge, maxAge, numAges, dtype=int) / 100.0) * 2) - 1).astype(np.float32).reshape([numAges, 1])
+    genderMat = (((np.ones([numAges, 1]) * gender) * 2) - 1).astype(np.float32)
+    noiseMat = np.repeat(np.reshape(noiseArr, [1, -1]).astype(np.float32), numAges, axis=0)
+    return noiseMat, genderMat, ageMat
+
+"""
+Builds the generator inputs used by sexSample: numSamples females, followed by the same faces as males
+
+Params
+    noiseSize:  the size of the network's noise vector
+    numSamples: the number of individuals
+    age:        optionally specify the age to generate. int, or None for random ages between 15 and 75
+
+Returns
+    0:  the noise matrix ([numSamples*2,noiseSize])
+    1:  the gender matrix ([numSamples*2,1]), scaled to [-1,1]
+    2:  the age matrix ([numSamples*2,1]), scaled to [-1,1]
+"""
+def sexInputs(noiseSize, numSamples, age=None):
+    if age is not None:
+        ageVec = np.ones([numSamples, 1]) * age
+    else:
+        ageVec = np.random.randint(15, 75, size=numSamples)
+    ageVec = (((ageVec / 100.0) * 2) - 1).astype(np.float32).reshape([-1, 1])
+    noiseArr = np.random.uniform(-1, 1, [numSamples, noiseSize]).astype(np.float32)
+    genderArr = np.array([0,1])
+
+    noiseArr = np.concatenate([noiseArr, noiseArr])
+    ageVec = np.concatenate([ageVec, ageVec])
+    genderArr = ((genderArr.repeat(numSamples).reshape(numSamples*2, 1) * 2) - 1).astype(np.float32)
+    return noiseArr, genderArr, ageVec
+
+def _saveGrid(samples, numRows, saveName):
+    # imported here, so generating samples doesn't need PIL
+    from Visualization import visualizeImages
+    visualizeImages(samples, numRows=numRows, fileName=saveName)
+
+"""
+Runs a generator over a set of inputs, in chunks
+The generator normalizes with batch statistics, so images are generated in chunks of close to chunkSize,
+with any leftover images spread over the other chunks rather than run as a tiny final chunk. Chunks
+smaller than batchSize (a sample smaller than a batch, or a small chunkSize) are padded up to batchSize
+with random faces, which are dropped from the result. Otherwise a single image would have no variance to
+normalize, and rows sharing a noise vector (like an age sweep) would normalize away everything but age
+
+Params
+    session:    the session to run the generator in
+    output:     the generator's output tensor
+    inputs:     the generator's noise, sex and age input tensors
+    noiseMat:   a numpy array of noise vectors
+    genderMat:  a numpy array of gender values
+    ageMat:     a numpy array of age values
+    batchSize:  the batch size the network was trained with
+    chunkSize:  the number of images to generate per run. Defaults to batchSize
+    dtype:      the dtype of the returned array
+
+Returns
+    0:  a numpy array of the generated images
+"""
+def runGenerator(session, output, inputs, noiseMat, genderMat, ageMat, batchSize, chunkSize=None, dtype=np.float32):
+    if chunkSize is None:
+        chunkSize = batchSize
+    noiseInput, sexInput, ageInput = inputs
+    sampleSize = noiseMat.shape[0]
+    numChunks = max(1, sampleSize // chunkSize)
+    returnMat = None
+    bounds = np.linspace(0, sampleSize, numChunks + 1).astype(int)
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        noiseChunk = noiseMat[start:end]
+        genderChunk = np.reshape(genderMat[start:end], [-1, 1])
+        ageChunk = np.reshape(ageMat[start:end], [-1, 1])
+        if end - start < batchSize:
+            fillNoise, fillGender, fillAge = randomInputs(noiseMat.shape[1], batchSize - (end - start))
+            noiseChunk = np.concatenate([noiseChunk, fillNoise])
+            genderChunk = np.concatenate([genderChunk, fillGender])
+            ageChunk = np.concatenate([ageChunk, fillAge])
+        feed_dict = {noiseInput: noiseChunk, sexInput: genderChunk, ageInput: ageChunk}
+        result = session.run(output, feed_dict=feed_dict)
+        if returnMat is None:
+            returnMat = np.empty([sampleSize] + list(result.shape[1:]), dtype=dtype)
+        returnMat[start:end] = result[:end - start]
+    return returnMat
+
+"""
+Generate a sample from the network
+
+Params
+    network:    the neural network to sample from
+    sampleSize: the number of images to create
+    gender:     optionally specify the gender(s) to generate. int, array, or None
+    age:        optionally specify the age(s) to generate. int, array, or None
+    saveName:   if specified, will save a visualization image grid using this name
+    chunkSize:  the number of images to generate per network run. Defaults to the network's batch size
+
+Returns
+    0:  a nupy array of the results generated
+"""
+def randomSample(network, sampleSize, gender=None, age=None, saveName=None, chunkSize=None):
+    noiseVec, genderVec, ageVec = randomInputs(network.noise_size, sampleSize, gender=gender, age=age)
+    samples = network.getSample(noiseVec, genderVec, ageVec, chunkSize=chunkSize)
     if saveName is not None:
         numRows = int(ceil(sqrt(sampleSize)))
-        visualizeImages(samples, numRows=numRows, fileName=saveName)
+        _saveGrid(samples, numRows, saveName)
     return samples
 
 """
@@ -47,21 +170,17 @@ Params
     gender:     optionally specify the gender(s) to generate. int, or None
     noiseArr:    the noise values to use, if a specific face is desired
     saveName:   if specified, will save a visualization image grid using this name
+    chunkSize:  the number of images to generate per network run. Defaults to the network's batch size
 
 Returns
     0:  a nupy array of the results generated
 """
-def ageSample(network, numAges, minAge=25, maxAge=75, gender=None, noiseArr=None, saveName=None):
-    if gender is None:
-        gender = np.random.randint(2, size=1)
-    if noiseArr is None:
-        noiseArr = np.random.uniform(-1, 1, [1, network.noise_size]).astype(np.float32)
-    ageMat = (((np.linspace(minAge, maxAge, numAges, dtype=int) / 100.0) * 2) - 1).reshape([numAges, 1])
-    genderMat = ((np.ones([numAges, 1]) * gender) * 2) - 1
-    noiseMat = np.ones([numAges, network.noise_size]) * noiseArr
-    samples = network.getSample(noiseMat, genderMat, ageMat)
+def ageSample(network, numAges, minAge=25, maxAge=75, gender=None, noiseArr=None, saveName=None, chunkSize=None):
+    noiseMat, genderMat, ageMat = ageInputs(network.noise_size, numAges, minAge=minAge, maxAge=maxAge,
+                                            gender=gender, noiseArr=noiseArr)
+    samples = network.getSample(noiseMat, genderMat, ageMat, chunkSize=chunkSize)
     if saveName is not None:
-        visualizeImages(samples, numRows=1, fileName=saveName)
+        _saveGrid(samples, 1, saveName)
     return samples
 
 """
@@ -83,12 +202,12 @@ Returns
     0:  a nupy array of the results generated
 """
 def ageSampleMultiple(network, numAges, numSamples, minAge=25, maxAge=75, saveName=None):
-    combinedMat = np.zeros([numSamples*numAges, 64, 64, 3])
+    combinedMat = np.zeros([numSamples*numAges, network.image_size, network.image_size, 3], dtype=np.float32)
     for i in range(numSamples):
         result = ageSample(network, numAges, minAge=minAge, maxAge=maxAge, saveName=None)
         combinedMat[numAges*i:numAges*(i+1),:,:,:] = result
     if saveName is not None:
-        visualizeImages(combinedMat, numRows=numSamples, fileName=saveName)
+        _saveGrid(combinedMat, numSamples, saveName)
     return combinedMat
 
 """
@@ -101,37 +220,99 @@ Params
     numSamples: the number of individuals to generate
     age:        optionally specify the age(s) to generate. int or None
     saveName:   if specified, will save a visualization image grid using this name
+    chunkSize:  the number of images to generate per network run. Defaults to the network's batch size
 
 Returns
     0:  a nupy array of the results generated
 """
-def sexSample(network, numSamples, age=None, saveName=None):
-    if age is not None:
-        ageVec = np.ones([numSamples, 1]) * age
-    else:
-        ageVec = np.random.randint(15, 75, size=numSamples)
-    ageVec = (((ageVec / 100.0) * 2) - 1).astype(np.float32).reshape([-1, 1])
-    noiseArr = np.random.uniform(-1, 1, [numSamples, network.noise_size]).astype(np.float32)
-    genderArr = np.array([0,1])
+def sexSample(network, numSamples, age=None, saveName=None, chunkSize=None):
+    noiseArr, genderArr, ageVec = sexInputs(network.noise_size, numSamples, age=age)
+    samples = network.getSample(noiseArr, genderArr, ageVec, chunkSize=chunkSize)
+    if saveName is not None:
+        _saveGrid(samples, 2, saveName)
+    return samples
 
+"""
+Generates images as uint8 pixels, using the generator's own uint8 output if it has one
 
-    noiseArr = np.concatenate([noiseArr, noiseArr])
-    ageVec = np.concatenate([ageVec, ageVec])
-    genderArr = genderArr.repeat(numSamples).reshape(numSamples*2, 1)
+Params
+    network:    the neural network (or FrozenGenerator) to sample from
+    noiseMat:   a numpy array of noise vectors
+    genderMat:  a numpy array of gender values
+    ageMat:     a numpy array of age values
+    chunkSize:  the number of images to generate per network run. Defaults to the network's batch size
 
-    samples = network.getSample(noiseArr, genderArr, ageVec)
-    if saveName is not None:
-        visualizeImages(samples, numRows=2, fileName=saveName)
-    return samples
+Returns
+    0:  a uint8 numpy array of face images ([n,64,64,3])
+"""
+def sampleUint8(network, noiseMat, genderMat, ageMat, chunkSize=None):
+    if hasattr(network, "getSampleUint8"):
+        return network.getSampleUint8(noiseMat, genderMat, ageMat, chunkSize=chunkSize)
+    samples = network.getSample(noiseMat, genderMat, ageMat, chunkSize=chunkSize)
+    return np.clip(np.round((samples + 1) * 127.5), 0, 255).astype(np.uint8)
+
+"""
+Generates a large number of random faces straight into a uint8 .npy file, a chunk at a time
+Only one chunk is ever held in memory, so hundreds of thousands of faces can be generated.
+The sex and age of each face are written next to it, in the same order
+
+Params
+    network:    the neural network (or FrozenGenerator) to sample from
+    sampleSize: the number of faces to generate
+    outPath:    the path of the .npy file of images. Labels are saved to the same path with _labels added
+    chunkImages:    the number of faces generated between writes
+
+Returns
+    0:  the images/sec generated
+"""
+def bulkSample(network, sampleSize, outPath="faces.npy", chunkImages=10000):
+    base, ext = os.path.splitext(outPath)
+    tmpPath = base + ".tmp" + ext
+    images = np.lib.format.open_memmap(tmpPath, mode="w+", dtype=np.uint8,
+                                       shape=(sampleSize, network.image_size, network.image_size, 3))
+    labels = np.empty([sampleSize, 2], dtype=np.float32)
+    startTime = time.time()
+    for start in range(0, sampleSize, chunkImages):
+        end = min(start + chunkImages, sampleSize)
+        genderVec = ((np.random.randint(2, size=[end - start, 1]) * 2) - 1).astype(np.float32)
+        ageVec = (((np.random.randint(15, 75, size=[end - start, 1]) / 100.0) * 2) - 1).astype(np.float32)
+        noiseVec = np.random.uniform(-1, 1, [end - start, network.noise_size]).astype(np.float32)
+        images[start:end] = sampleUint8(network, noiseVec, genderVec, ageVec)
+        labels[start:end, 0] = genderVec[:, 0]
+        labels[start:end, 1] = ageVec[:, 0]
+        print(str(end) + "/" + str(sampleSize) + " faces generated")
+    elapsed = time.time() - startTime
+    images.flush()
+    del images
+    os.rename(tmpPath, outPath)
+    np.save(base + "_labels" + ext, labels)
+    return sampleSize / elapsed
 
 if __name__ == "__main__":
-    # initialize the data loader
-    image_size = 64
-    batch_size = 64
-    noise_size = 100
+    if len(sys.argv) > 1 and sys.argv[1] == "bulk":
+        if len(sys.argv) < 4 or not os.path.exists(sys.argv[2]):
+            print("requires a frozen generator path and a face count, and optionally out_path")
+            exit()
+        from FrozenGenerator import FrozenGenerator
+        network = FrozenGenerator(sys.argv[2])
+        outPath = sys.argv[4] if len(sys.argv) > 4 else "faces.npy"
+        rate = bulkSample(network, int(sys.argv[3]), outPath)
+        print("generated with " + network.precision + " weights at " + "%.0f" % rate + " images/sec")
+        exit()
 
-    # start training
-    network = NeuralNet.NeuralNet(batch_size=batch_size, image_size=image_size, noise_size=noise_size, learningRate=5e-4)
+    if len(sys.argv) > 1:
+        # sample from a generator exported by GeneratorExport.py, without building the full network
+        if not os.path.exists(sys.argv[1]):
+            print("frozen generator not found")
+            exit()
+        from FrozenGenerator import FrozenGenerator
+        network = FrozenGenerator(sys.argv[1])
+    else:
+        import NeuralNet
+        image_size = 64
+        batch_size = 64
+        noise_size = 100
+        network = NeuralNet.NeuralNet(batch_size=batch_size, image_size=image_size, noise_size=noise_size, learningRate=5e-4)
 
     randomSample(network, 36, saveName="sample.png")
     ageSampleMultiple(network, 10, 3, saveName="age_sample.png")
@@ -0,0 +1,189 @@
+import io
+import sys
+import json
+import time
+import struct
+import threading
+import numpy as np
+from http.client import HTTPConnection
+from urllib.parse import urlencode
+from PIL import Image
+
+"""
+A client for a local GenerationServer
+"""
+class GenerationClient(object):
+    """"""
+
+    """
+    Initialize a GenerationClient instance
+
+    Params:
+        host:   the address of the server
+        port:   the port of the server
+    """
+    def __init__(self, host="127.0.0.1", port=8080):
+        self.host = host
+        self.port = port
+
+    """
+    Requests faces from the server. The parameters match the server's /generate parameters
+
+    Params:
+        count:      the number of faces (for the sex mode, the number of individuals)
+        mode:       random, age or sex
+        sex:        optionally, 0 or 1
+        age:        optionally, the age of the faces
+        minAge, maxAge: the range of an age sweep
+        outFormat:  raw or png. Both are decoded into the same array
+
+    Returns:
+        0:  a uint8 numpy array of face images ([n,64,64,3])
+        1:  the seconds from sending the request until the first image arrived
+    """
+    def generate(self, count, mode="random", sex=None, age=None, minAge=None, maxAge=None, outFormat="raw"):
+        params = {"mode": mode, "count": count, "format": outFormat}
+        for name, value in [("sex", sex), ("age", age), ("min_age", minAge), ("max_age", maxAge)]:
+            if value is not None:
+                params[name] = value
+        startTime = time.time()
+        connection = HTTPConnection(self.host, self.port)
+        try:
+            connection.request("GET", "/generate?" + urlencode(params))
+            response = connection.getresponse()
+            if response.status != 200:
+                raise IOError("server returned " + str(response.status) + ": " + response.read().decode("utf-8"))
+            numImages = int(response.getheader("X-Image-Count"))
+            imageSize = int(response.getheader("X-Image-Size"))
+            images = np.empty([numImages, imageSize, imageSize, 3], dtype=np.uint8)
+            imageBytes = imageSize * imageSize * 3
+            firstImage = None
+            for i in range(numImages):
+                if outFormat == "raw":
+                    data = _readExactly(response, imageBytes)
+                    images[i] = np.frombuffer(data, dtype=np.uint8).reshape([imageSize, imageSize, 3])
+                else:
+                    length = struct.unpack(">I", _readExactly(response, 4))[0]
+                    images[i] = np.asarray(Image.open(io.BytesIO(_readExactly(response, length))))
+                if firstImage is None:
+                    firstImage = time.time() - startTime
+            return images, firstImage
+        finally:
+            connection.close()
+
+    """
+    Returns:
+        0:  the server's stats dictionary
+    """
+    def stats(self):
+        connection = HTTPConnection(self.host, self.port)
+        try:
+            connection.request("GET", "/stats")
+            return json.loads(connection.getresponse().read().decode("utf-8"))
+        finally:
+            connection.close()
+
+def _readExactly(response, numBytes):
+    data = response.read(numBytes)
+    if len(data) != numBytes:
+        raise IOError("the server closed the connection early")
+    return data
+
+"""
+Load tests a GenerationServer with concurrent clients sending requests of random sizes and modes
+Measures the latency each client sees, and the server's own batching stats over the test
+
+Params
+    client:     a GenerationClient for the server
+    numClients: the number of clients sending requests at once
+    numRequests:    the number of requests each client sends
+    maxCount:   requests ask for between 1 and maxCount faces
+    outFormat:  raw or png
+    seed:       the seed for the request sizes and modes
+
+Returns
+    0:  a dictionary with the request and image throughput, client latencies, and the server's stats
+"""
+def loadTest(client, numClients=8, numRequests=50, maxCount=16, outFormat="raw", seed=0):
+    random = np.random.RandomState(seed)
+    modes = ["random", "age", "sex"]
+    plans = [[(modes[random.randint(len(modes))], random.randint(1, maxCount + 1)) for _ in range(numRequests)]
+             for _ in range(numClients)]
+    latencies = []
+    firstImages = []
+    errors = []
+    images = [0]
+    lock = threading.Lock()
+
+    def runClient(plan):
+        for mode, count in plan:
+            startTime = time.time()
+            try:
+                result, firstImage = client.generate(count, mode=mode, outFormat=outFormat)
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+                continue
+            with lock:
+                latencies.append(time.time() - startTime)
+                firstImages.append(firstImage)
+                images[0] = images[0] + result.shape[0]
+
+    before = client.stats()
+    startTime = time.time()
+    threads = [threading.Thread(target=runClient, args=[plan]) for plan in plans]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - startTime
+    after = client.stats()
+
+    latencies = np.array(latencies) * 1000
+    firstImages = np.array(firstImages) * 1000
+    batches = after["batches"] - before["batches"]
+    results = {"clients": numClients, "requests": len(latencies), "errors": len(errors), "max_count": maxCount,
+               "format": outFormat, "elapsed_sec": elapsed, "requests_per_sec": len(latencies) / elapsed,
+               "images_per_sec": images[0] / elapsed,
+               # the fill ratio over just this test, from the number of batches the server ran during it
+               "fill_ratio": (after["images"] - before["images"]) / float(max(batches, 1) * after["batch_size"]),
+               "batches": batches, "server": after}
+    if len(latencies) > 0:
+        results["latency_p50_ms"] = float(np.percentile(latencies, 50))
+        results["latency_p99_ms"] = float(np.percentile(latencies, 99))
+        results["first_image_p50_ms"] = float(np.percentile(firstImages, 50))
+    if len(errors) > 0:
+        results["first_error"] = errors[0]
+    return results
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("requires host:port, or a frozen generator path to serve locally for the test, and optionally " +
+              "num_clients, num_requests, max_count and format")
+        exit()
+
+    server = None
+    if ":" in sys.argv[1]:
+        host, port = sys.argv[1].split(":")
+        client = GenerationClient(host, int(port))
+    else:
+        # start a server in this process, on a free port
+        from FrozenGenerator import FrozenGenerator
+        from GenerationServer import GenerationServer
+        server = GenerationServer(FrozenGenerator(sys.argv[1]), port=0)
+        serverThread = threading.Thread(target=server.serve_forever)
+        serverThread.daemon = True
+        serverThread.start()
+        client = GenerationClient("127.0.0.1", server.server_address[1])
+
+    numClients = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    numRequests = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+    maxCount = int(sys.argv[4]) if len(sys.argv) > 4 else 16
+    outFormat = sys.argv[5] if len(sys.argv) > 5 else "raw"
+    try:
+        results = loadTest(client, numClients=numClients, numRequests=numRequests, maxCount=maxCount,
+                           outFormat=outFormat)
+    finally:
+        if server is not None:
+            server.stop()
+    print(json.dumps(results, indent=2, sort_keys=True))
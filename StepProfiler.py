@@ -0,0 +1,257 @@
+import os
+import json
+import time
+import threading
+import numpy as np
+from contextlib import contextmanager
+
+"""
+Records where the wall time of each training step goes
+The training loop marks named sections of a step (data wait, loss eval, D/G updates, logging, image writes,
+checkpointing...), and counts events like skipped updates. Every logInterval steps, a summary of the section
+times is appended to a json lines log. A window of steps can also be written as a Chrome trace
+(open in chrome://tracing), and tensorflow's own op-level trace can be captured for a window of steps
+
+Sections are timed on the training thread only, and shouldn't be nested, so the time of each step splits
+cleanly into its sections, plus "other" for anything outside of them
+"""
+class StepProfiler(object):
+    """"""
+
+    """
+    Initialize a StepProfiler instance
+
+    Params:
+        logPath:    the path of the json lines log of interval summaries. If None, summaries are only kept in memory
+        logInterval:    the number of steps summarized in each log entry
+        tracePath:  if specified, a Chrome trace of the steps in traceWindow is written here
+        traceWindow:    the first step to trace and the number of steps to trace, counted from the first profiled step
+        tfTraceWindow:  if specified, the first step and number of steps to capture tensorflow op timelines for,
+                        counted from the first profiled step
+        tfTraceDir: the directory tensorflow timelines are written to, one Chrome trace file per session.run
+    """
+    def __init__(self, logPath="./profile.jsonl", logInterval=100, tracePath=None, traceWindow=[0, 200],
+                 tfTraceWindow=None, tfTraceDir="./tf_traces"):
+        self.logPath = logPath
+        self.logInterval = logInterval
+        self.tracePath = tracePath
+        self.traceWindow = traceWindow
+        self.tfTraceWindow = tfTraceWindow
+        self.tfTraceDir = tfTraceDir
+        self.stepsProfiled = 0
+        self.lastSummary = None
+        self._step = None
+        self._stepStart = None
+        self._sections = {}
+        self._counts = {}
+        self._resetInterval()
+        self._traceEvents = []
+        self._tid = threading.current_thread().ident
+        self._startTime = time.time()
+
+    def _resetInterval(self):
+        self._intervalStart = time.time()
+        self._intervalSteps = []
+        self._intervalSections = {}
+        self._intervalCounts = {}
+        self._intervalWall = []
+
+    def _inWindow(self, window):
+        return window is not None and window[0] <= self.stepsProfiled < window[0] + window[1]
+
+    def _traceEvent(self, name, startTime, endTime, args=None):
+        if self.tracePath is None or not self._inWindow(self.traceWindow):
+            return
+        event = {"name": name, "cat": "train", "ph": "X", "pid": os.getpid(), "tid": self._tid,
+                 "ts": (startTime - self._startTime) * 1e6, "dur": (endTime - startTime) * 1e6}
+        if args is not None:
+            event["args"] = args
+        self._traceEvents += [event]
+
+    """
+    Marks the start of a training step
+
+    Params:
+        step:   the training round number, used to label the log and traces
+    """
+    def beginStep(self, step):
+        self._step = step
+        self._stepStart = time.time()
+        self._sections = {}
+        self._counts = {}
+
+    """
+    Times a named section of the current step. Used as "with profiler.section(name):"
+    A section entered more than once in a step is added up
+
+    Params:
+        name:   the name of the section
+    """
+    @contextmanager
+    def section(self, name):
+        startTime = time.time()
+        try:
+            yield
+        finally:
+            endTime = time.time()
+            self._sections[name] = self._sections.get(name, 0.0) + (endTime - startTime)
+            self._traceEvent(name, startTime, endTime)
+
+    """
+    Counts an event in the current step, like the balance rule skipping an update
+
+    Params:
+        name:   the name of the counter
+        amount: the amount to add
+    """
+    def count(self, name, amount=1):
+        self._counts[name] = self._counts.get(name, 0) + int(amount)
+
+    """
+    Marks the end of the current step, writing a summary to the log once logInterval steps have been recorded
+
+    Params:
+        extra:  an optional dictionary added to the summary if one is written this step (loader stats, for example),
+                or a function returning one, so it's only computed when needed
+
+    Returns:
+        0:  the summary dictionary if one was written this step, otherwise None
+    """
+    def endStep(self, extra=None):
+        endTime = time.time()
+        wall = endTime - self._stepStart
+        self._traceEvent("step", self._stepStart, endTime, args=dict([("step", self._step)] + list(self._counts.items())))
+        self._intervalSteps += [self._step]
+        self._intervalWall += [wall]
+        numSteps = len(self._intervalSteps)
+        for name, seconds in self._sections.items():
+            if name not in self._intervalSections:
+                # steps without the section count as 0, so every list lines up with the steps
+                self._intervalSections[name] = [0.0] * (numSteps - 1)
+            self._intervalSections[name] += [seconds]
+        for name in self._intervalSections:
+            if len(self._intervalSections[name]) < numSteps:
+                self._intervalSections[name] += [0.0]
+        for name, amount in self._counts.items():
+            self._intervalCounts[name] = self._intervalCounts.get(name, 0) + amount
+        self.stepsProfiled = self.stepsProfiled + 1
+        if numSteps >= self.logInterval:
+            return self.writeSummary(extra)
+        return None
+
+    """
+    Summarizes the steps recorded since the last summary, and appends it to the log
+
+    Params:
+        extra:  an optional dictionary added to the summary, or a function returning one
+
+    Returns:
+        0:  the summary dictionary, or None if no steps were recorded
+    """
+    def writeSummary(self, extra=None):
+        if len(self._intervalSteps) == 0:
+            return None
+        wall = np.array(self._intervalWall)
+        totalWall = max(wall.sum(), 1e-9)
+        sections = {}
+        accounted = np.zeros(len(wall))
+        for name, seconds in self._intervalSections.items():
+            seconds = np.array(seconds)
+            accounted += seconds
+            sections[name] = self._describe(seconds, totalWall)
+        sections["other"] = self._describe(np.maximum(wall - accounted, 0), totalWall)
+        summary = {"first_step": self._intervalSteps[0], "last_step": self._intervalSteps[-1],
+                   "steps": len(wall), "elapsed_sec": time.time() - self._intervalStart,
+                   "steps_per_sec": len(wall) / totalWall, "step_ms": self._describe(wall, totalWall),
+                   "sections": sections, "counts": dict(self._intervalCounts)}
+        if callable(extra):
+            extra = extra()
+        if extra is not None:
+            summary.update(extra)
+        if self.logPath is not None:
+            file = open(self.logPath, "a")
+            file.write(json.dumps(summary) + "\n")
+            file.close()
+        self.lastSummary = summary
+        self._resetInterval()
+        return summary
+
+    def _describe(self, seconds, totalWall):
+        return {"total_sec": float(seconds.sum()), "mean_ms": float(seconds.mean()) * 1000,
+                "p50_ms": float(np.percentile(seconds, 50)) * 1000, "p99_ms": float(np.percentile(seconds, 99)) * 1000,
+                "fraction": float(seconds.sum() / totalWall)}
+
+    """
+    Returns:
+        0:  the RunOptions and RunMetadata to pass to session.run for the current step,
+            or (None, None) if the step is outside of tfTraceWindow
+    """
+    def runOptions(self):
+        if not self._inWindow(self.tfTraceWindow):
+            return None, None
+        import tensorflow as tf
+        return tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE), tf.RunMetadata()
+
+    """
+    Writes the op-level timeline tensorflow recorded for a session.run as a Chrome trace
+
+    Params:
+        name:       the name of the section the run belonged to, used in the file name
+        metadata:   the RunMetadata returned by runOptions, after it was passed to session.run
+    """
+    def recordRunMetadata(self, name, metadata):
+        if metadata is None:
+            return
+        from tensorflow.python.client import timeline
+        if not os.path.exists(self.tfTraceDir):
+            os.makedirs(self.tfTraceDir)
+        tracePath = os.path.join(self.tfTraceDir, "step_" + str(self._step) + "_" + name + ".json")
+        file = open(tracePath, "w")
+        file.write(timeline.Timeline(metadata.step_stats).generate_chrome_trace_format())
+        file.close()
+
+    """
+    Writes a summary of any remaining steps, and the Chrome trace if one was requested
+    """
+    def close(self):
+        self.writeSummary()
+        if self.tracePath is not None and len(self._traceEvents) > 0:
+            # write to a temp file first, so a crash mid-write never leaves a truncated trace behind
+            tmpPath = self.tracePath + ".tmp"
+            file = open(tmpPath, "w")
+            json.dump({"traceEvents": self._traceEvents, "displayTimeUnit": "ms"}, file)
+            file.close()
+            os.rename(tmpPath, self.tracePath)
+            numSteps = len([event for event in self._traceEvents if event["name"] == "step"])
+            print("trace of " + str(numSteps) + " steps saved to " + self.tracePath)
+
+"""
+A StepProfiler that records nothing, used when profiling is turned off, so callers don't need to check for one
+"""
+class NullProfiler(object):
+    """"""
+
+    def beginStep(self, step):
+        pass
+
+    @contextmanager
+    def section(self, name):
+        yield
+
+    def count(self, name, amount=1):
+        pass
+
+    def endStep(self, extra=None):
+        return None
+
+    def writeSummary(self, extra=None):
+        return None
+
+    def runOptions(self):
+        return None, None
+
+    def recordRunMetadata(self, name, metadata):
+        pass
+
+    def close(self):
+        pass
@@ -0,0 +1,169 @@
+import pickle
+import numpy as np
+from copy import deepcopy
+
+"""
+Finds the stratification bin of every row
+
+Params
+    csvdata:    the ColumnStore, dataframe, or dictionary of column arrays to bin
+    strata:     a list of (column name, bin limits) pairs to stratify the data by
+
+Returns
+    0:  an int numpy array with the bin number of every row
+    1:  a bool numpy array, false for rows that don't fall in any bin
+"""
+def assignBins(csvdata, strata):
+    numRows = len(np.asarray(csvdata[strata[0][0]]))
+    binIds = np.zeros(numRows, dtype=np.int64)
+    valid = np.ones(numRows, dtype=bool)
+    for name, limits in strata:
+        keyBins = np.digitize(np.asarray(csvdata[name], dtype=np.float64), limits)
+        # NaN and values past the last limit digitize to len(limits)
+        valid &= keyBins < len(limits)
+        binIds = binIds * len(limits) + keyBins
+    return binIds, valid
+
+"""
+Samples batches containing an equal number of rows from every stratification bin (by default, every
+age group/sex combination). All bins are stored in one permutation array, so gathering a batch and
+shuffling for a new epoch work in place without allocating new lists
+
+Bins are the cartesian product of the stratification keys. Each key is a (column name, bin limits) pair,
+where each limit describes the values < this value that belong in that bin. Rows that fall outside the
+last limit of any key (or are NaN) are left out
+"""
+class StratifiedSampler(object):
+    """"""
+
+    """
+    Initialize a StratifiedSampler instance
+
+    Params:
+        csvdata:    the ColumnStore (or pandas dataframe) of the .csv of faces we are using
+        strata:     a list of (column name, bin limits) pairs to stratify the data by
+        seed:       an optional seed for the sampler's random number generator
+        mask:       an optional bool array. Only rows where it is true are sampled
+    """
+    def __init__(self, csvdata, strata=[("age", [20, 30, 40, 50, 60, 70, 80, 101]), ("isMale", [0.5, 1.5])], seed=None, mask=None):
+        binIds, valid = assignBins(csvdata, strata)
+        if mask is not None:
+            valid &= mask
+        self.strata = [(name, list(limits)) for name, limits in strata]
+        self.numBins = int(np.prod([len(limits) for _, limits in strata]))
+        rows = np.nonzero(valid)[0]
+        self.order = rows[np.argsort(binIds[rows], kind="mergesort")]
+        self.binSizes = np.bincount(binIds[rows], minlength=self.numBins)
+        self.binStarts = np.cumsum(self.binSizes) - self.binSizes
+        if np.any(self.binSizes == 0):
+            raise ValueError("no rows fall into bins " + str(list(np.nonzero(self.binSizes == 0)[0])))
+        self.offsets = np.zeros(self.numBins, dtype=np.int64)
+        self.looped = np.zeros(self.numBins, dtype=bool)
+        self.epoch = 0
+        self.rng = np.random.RandomState(seed)
+        self._positions = None
+
+    """
+    Gets the row indices for the next batch, taking numPerBin rows from every bin in order
+    Bins that run out of rows wrap back around to their beginning
+
+    Params:
+        numPerBin:  the number of rows to take from each bin
+        out:        an optional int64 array of size numBins * numPerBin to write the indices into
+
+    Returns:
+        0:  the row indices for the batch, grouped by bin
+        1:  a bool indicating whether every bin has been fully visited this epoch
+    """
+    def nextBatch(self, numPerBin, out=None):
+        if out is None:
+            out = np.empty(self.numBins * numPerBin, dtype=np.int64)
+        if self._positions is None or self._positions.shape[1] != numPerBin:
+            self._steps = np.arange(numPerBin, dtype=np.int64)
+            self._positions = np.empty([self.numBins, numPerBin], dtype=np.int64)
+        positions = self._positions
+        np.add(self.offsets[:, None], self._steps, out=positions)
+        self.looped |= positions[:, -1] >= self.binSizes - 1
+        np.remainder(positions, self.binSizes[:, None], out=positions)
+        positions += self.binStarts[:, None]
+        np.take(self.order, positions.ravel(), out=out)
+        self.offsets += numPerBin
+        np.remainder(self.offsets, self.binSizes, out=self.offsets)
+        return out, bool(np.all(self.looped))
+
+    """
+    Starts a new epoch: shuffles the rows within every bin in place, and resets the bin offsets
+    """
+    def newEpoch(self):
+        for binNum in range(self.numBins):
+            start = self.binStarts[binNum]
+            self.rng.shuffle(self.order[start:start + self.binSizes[binNum]])
+        self.offsets[:] = 0
+        self.looped[:] = False
+        self.epoch = self.epoch + 1
+
+    """
+    Creates an independent copy of the sampler with its own random number generator,
+    so several workers can sample the same data in different orders
+
+    Params:
+        seed:   an optional seed for the copy's random number generator
+
+    Returns:
+        0:  the new sampler
+    """
+    def copy(self, seed=None):
+        clone = deepcopy(self)
+        clone.rng = np.random.RandomState(seed)
+        return clone
+
+    """
+    Returns:
+        0:  a dictionary holding everything needed to resume sampling at the exact same batch
+    """
+    def getState(self):
+        return {"strata": self.strata, "binSizes": self.binSizes.copy(), "order": self.order.copy(),
+                "offsets": self.offsets.copy(), "looped": self.looped.copy(), "epoch": self.epoch,
+                "rngState": self.rng.get_state()}
+
+    """
+    Restores a state previously returned by getState
+
+    Params:
+        state:  the state dictionary to restore
+    """
+    def setState(self, state):
+        if state["strata"] != self.strata or not np.array_equal(state["binSizes"], self.binSizes):
+            raise ValueError("sampler state was saved for different data")
+        self.order[:] = state["order"]
+        self.offsets[:] = state["offsets"]
+        self.looped[:] = state["looped"]
+        self.epoch = state["epoch"]
+        self.rng.set_state(state["rngState"])
+
+    """
+    Saves the sampler to disk
+
+    Params:
+        path:   the path of the file to save to
+    """
+    def save(self, path):
+        file = open(path, "wb")
+        pickle.dump(self, file)
+        file.close()
+
+    """
+    Loads a sampler saved with save
+
+    Params:
+        path:   the path of the saved sampler
+
+    Returns:
+        0:  the loaded sampler
+    """
+    @staticmethod
+    def load(path):
+        file = open(path, "rb")
+        sampler = pickle.load(file)
+        file.close()
+        return sampler
@@ -0,0 +1,141 @@
+import os
+import sys
+import json
+import argparse
+
+def _bool(value):
+    if isinstance(value, bool):
+        return value
+    if value.lower() in ["true", "yes", "1"]:
+        return True
+    if value.lower() in ["false", "no", "0"]:
+        return False
+    raise argparse.ArgumentTypeError("expected true or false, got " + str(value))
+
+def _intPair(value):
+    if isinstance(value, (list, tuple)):
+        pair = [int(v) for v in value]
+    else:
+        pair = [int(v) for v in value.split(",")]
+    if len(pair) != 2:
+        raise argparse.ArgumentTypeError("expected start,count, got " + str(value))
+    return pair
+
+# every training setting, with its default, type and description. Settings can be given in a json config file,
+# and any of them can be overridden on the command line as --name-with-dashes
+_options = [
+    # dataset
+    ("dataset_dir", None, str, "the root directory of the IMDB-WIKI dataset. Only needed to build the csv"),
+    ("csv_path", "./dataset.csv", str, "the filtered dataset csv"),
+    ("indices_path", "./indices.p", str, "the saved StratifiedSampler"),
+    ("store_dir", "./dataset_store", str, "the column store directory of the csv"),
+    ("master_path", "./dataset_master.csv", str, "the unfiltered master csv"),
+    ("packed_dir", "./packed", str, "the packed image shard directory. Set to none to decode images while training"),
+    ("image_cache_dir", None, str, "if set (and packed_dir is none), decoded images are cached here"),
+    # model
+    ("image_size", 64, int, "the width/height of the generated images"),
+    ("num_per_bin", 4, int, "the number of images from each age/sex bin in a batch"),
+    ("noise_size", 100, int, "the size of the generator's noise vector"),
+    ("learning_rate", 5e-4, float, "the starting learning rate"),
+    ("checkpoint_dir", "./checkpoints", str, "the directory checkpoints are saved in and restored from"),
+    ("restore", "newest", str, "the checkpoint to resume from: newest, or best by face detection rate"),
+    ("async_checkpoint", True, _bool, "write checkpoints on a background thread, only blocking to snapshot the variables"),
+    # throughput
+    ("backend", "thread", str, "the DataLoader backend: thread or process"),
+    ("workers", 10, int, "the number of DataLoader workers"),
+    ("prefetch", 20, int, "the number of batches the DataLoader buffers ahead"),
+    ("input_pipeline", True, _bool, "feed batches through the in-graph queue instead of feed_dict"),
+    ("queue_capacity", 4, int, "the number of batches held by the in-graph queue"),
+    ("fused_train_step", True, _bool, "run each training step as a single session.run"),
+    ("towers", 1, int, "the number of data-parallel towers each batch is split across. Must divide the batch size"),
+    ("intra_op_threads", 0, int, "tensorflow's intra-op thread count. 0 lets tensorflow choose"),
+    ("inter_op_threads", 0, int, "tensorflow's inter-op thread count. 0 lets tensorflow choose"),
+    # run length
+    ("max_steps", None, int, "stop after this many steps in this run"),
+    ("max_time", None, float, "stop after this many seconds in this run"),
+    # logging
+    ("print_interval", 100, int, "the number of steps between status prints"),
+    ("save_interval", 1000, int, "the number of steps between checkpoints"),
+    ("log_path", "./logs.tsv", str, "the tsv log of losses and face detection rates"),
+    ("detect_faces", True, _bool, "score generated faces with the face detector at each status print"),
+    ("face_workers", 4, int, "the number of face detector worker processes"),
+    ("profile_log", "./profile.jsonl", str, "the json lines log of step timings. Set to none to disable profiling"),
+    ("profile_trace", None, str, "if set, a Chrome trace of the first profiled steps is written here"),
+    ("tf_trace_window", None, _intPair, "start,count of the steps to capture tensorflow op timelines for"),
+]
+
+DEFAULT_CONFIG = dict((name, default) for name, default, _, _ in _options)
+
+def _convert(name, value):
+    if value is None or (isinstance(value, str) and value.lower() == "none"):
+        return None
+    for optionName, _, optionType, _ in _options:
+        if optionName == name:
+            return optionType(value)
+    raise ValueError("unknown setting " + str(name))
+
+"""
+Builds a training config from the defaults, a json config file, and overrides, in that order of precedence
+
+Params
+    configPath: an optional path to a json file of settings
+    overrides:  an optional dictionary of settings that take priority over the file
+
+Returns
+    0:  a dictionary with every setting
+"""
+def loadConfig(configPath=None, overrides=None):
+    config = dict(DEFAULT_CONFIG)
+    if configPath is not None:
+        file = open(configPath, "r")
+        fileConfig = json.load(file)
+        file.close()
+        for name, value in fileConfig.items():
+            config[name] = _convert(name, value)
+    if overrides is not None:
+        for name, value in overrides.items():
+            config[name] = _convert(name, value)
+    if config["backend"] not in ["thread", "process"]:
+        raise ValueError("unknown DataLoader backend: " + str(config["backend"]))
+    if config["restore"] not in ["newest", "best"]:
+        raise ValueError("unknown checkpoint to restore: " + str(config["restore"]))
+    return config
+
+"""
+Parses command line arguments into a training config
+Accepts --config path.json, plus --name-with-dashes value for any setting
+
+Params
+    argv:   the command line arguments, without the script name
+    description:    the description shown by --help
+
+Returns
+    0:  a dictionary with every setting
+"""
+def parseArgs(argv=None, description="Trains the face generator"):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--config", default=None, help="a json file of settings. Command line settings override it")
+    for name, default, optionType, helpText in _options:
+        # settings that weren't given are left out, so they don't override the config file
+        parser.add_argument("--" + name.replace("_", "-"), dest=name, default=argparse.SUPPRESS,
+                            help=helpText + " (default: " + str(default) + ")")
+    args = vars(parser.parse_args(sys.argv[1:] if argv is None else argv))
+    configPath = args.pop("config")
+    return loadConfig(configPath, args)
+
+"""
+Writes a config to a json file, so a run's settings can be repeated with --config
+
+Params
+    config:     the config dictionary
+    outPath:    the path of the json file
+"""
+def saveConfig(config, outPath):
+    outDir = os.path.dirname(outPath)
+    if outDir != "" and not os.path.exists(outDir):
+        os.makedirs(outDir)
+    tmpPath = outPath + ".tmp"
+    file = open(tmpPath, "w")
+    json.dump(config, file, indent=2, sort_keys=True)
+    file.close()
+    os.rename(tmpPath, outPath)
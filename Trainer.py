@@ -1,43 +1,169 @@
+import os
+import time
+import signal
 from NeuralNet import  NeuralNet
 from DataLoader import  LoadFilesData, DataLoader
+from PackedData import LoadPackedData
+from FaceDetector import FaceDetectorEngine
+from StepProfiler import StepProfiler, NullProfiler
+from TrainConfig import parseArgs, saveConfig
 
-if __name__ == "__main__":
+"""
+Stops training cleanly on SIGINT or SIGTERM
+The first signal asks the training loop to stop after its current step, so a final checkpoint can be saved.
+A second signal stops immediately
+"""
+class StopRequest(object):
+    """"""
+
+    def __init__(self):
+        self.signalNum = None
+        self._previous = {}
+        for signalNum in [signal.SIGINT, signal.SIGTERM]:
+            self._previous[signalNum] = signal.signal(signalNum, self._onSignal)
+
+    def _onSignal(self, signalNum, frame):
+        if self.signalNum is not None:
+            raise KeyboardInterrupt()
+        self.signalNum = signalNum
+        print("received signal " + str(signalNum) + ", stopping after this step (signal again to stop now)")
+
+    """
+    Returns:
+        0:  true if a stop signal has been received
+    """
+    def requested(self):
+        return self.signalNum is not None
+
+    """
+    Puts back the signal handlers that were installed before this one
+    """
+    def restore(self):
+        for signalNum, handler in self._previous.items():
+            signal.signal(signalNum, handler)
+
+"""
+Trains the network with the given settings, until the step or time budget runs out or a stop signal is received
+A checkpoint is saved every save_interval steps, and once more when training stops
+
+Params
+    config: a training config dictionary, from TrainConfig.parseArgs or TrainConfig.loadConfig
+
+Returns
+    0:  the number of steps trained in this run
+"""
+def runTraining(config):
     # initialize the data loader
-    datasetDir = "/home/sanche/Datasets/IMDB-WIKI"
-    csvPath = "./dataset.csv"
-    indicesPath = "./indices.p"
-    csvdata, indices = LoadFilesData(datasetDir, csvPath, indicesPath)
-
-    saveSteps = 10
-    image_size = 64
-    numPerBin = 4
-    batch_size = numPerBin * 8 * 2
-    noise_size = 100
-    loader = DataLoader(indices, csvdata, numPerBin=numPerBin, imageSize=image_size, numWorkerThreads=10, bufferMax=20, debugLogs=False)
+    if not os.path.exists(config["csv_path"]) and config["dataset_dir"] is None:
+        raise ValueError(config["csv_path"] + " doesn't exist, so dataset_dir is needed to build it")
+    csvdata, indices = LoadFilesData(config["dataset_dir"], config["csv_path"], config["indices_path"],
+                                     storeDir=config["store_dir"], masterPath=config["master_path"])
+
+    image_size = config["image_size"]
+    numPerBin = config["num_per_bin"]
+    batch_size = numPerBin * indices.numBins
+    packedData = None
+    imageCache = None
+    if config["packed_dir"] is not None:
+        packedData = LoadPackedData(csvdata, packDir=config["packed_dir"], imageSize=image_size)
+    elif config["image_cache_dir"] is not None:
+        from ImageCache import ImageCache
+        imageCache = ImageCache(config["image_cache_dir"])
+    loader = DataLoader(indices, csvdata, numPerBin=numPerBin, imageSize=image_size, numWorkerThreads=config["workers"],
+                        bufferMax=config["prefetch"], debugLogs=False, packedData=packedData, backend=config["backend"],
+                        imageCache=imageCache)
     loader.start()
 
+    # start the face detector's worker processes before tensorflow creates its threads
+    faceEngine = FaceDetectorEngine(numWorkers=config["face_workers"]) if config["detect_faces"] else None
+
     # start training
-    network = NeuralNet(batch_size=batch_size, image_size=image_size, noise_size=noise_size, learningRate=5e-4)
+    # with the input pipeline, batches are queued into the graph on a background thread instead of fed each step
+    useInputPipeline = config["input_pipeline"]
+    network = NeuralNet(batch_size=batch_size, image_size=image_size, noise_size=config["noise_size"],
+                        chkptDir=config["checkpoint_dir"], learningRate=config["learning_rate"],
+                        inputPipeline=useInputPipeline, queueCapacity=config["queue_capacity"],
+                        fusedTrainStep=config["fused_train_step"], intraOpThreads=config["intra_op_threads"],
+                        interOpThreads=config["inter_op_threads"], asyncCheckpoint=config["async_checkpoint"],
+                        restore=config["restore"], numTowers=config["towers"])
+    saveConfig(config, os.path.join(config["checkpoint_dir"], "config.json"))
+    if useInputPipeline:
+        network.startInputPipeline(loader)
+    if faceEngine is not None:
+        network.startFaceEvaluator(engine=faceEngine)
 
-    printInterval = 100
-    saveInterval = 1000
+    printInterval = config["print_interval"]
+    saveInterval = config["save_interval"]
     loadedCheckpoint = network.checkpoint_num
-    i=0
-    while True:
-        batchDict = loader.getData()
-        batchImage = batchDict["image"]
-        batchAge = batchDict["age"]
-        batchSex = batchDict["sex"]
-        if i % printInterval == 0:
-            if (i != 0 or loadedCheckpoint == 0):
-                #if we are repeating a previous one, skip logging to csv
-                saveFile = "./logs.tsv"
+    if config["profile_log"] is not None:
+        # per-step timings are summarized every printInterval steps
+        profiler = StepProfiler(logPath=config["profile_log"], logInterval=printInterval,
+                                tracePath=config["profile_trace"], tfTraceWindow=config["tf_trace_window"])
+    else:
+        profiler = NullProfiler()
+    stopRequest = StopRequest()
+    startTime = time.time()
+    lastSaved = 0
+    i = 0
+    try:
+        while not stopRequest.requested():
+            if config["max_steps"] is not None and i >= config["max_steps"]:
+                print("reached the step budget of " + str(config["max_steps"]))
+                break
+            if config["max_time"] is not None and time.time() - startTime >= config["max_time"]:
+                print("reached the time budget of " + str(config["max_time"]) + "s")
+                break
+            profiler.beginStep(i+loadedCheckpoint)
+            if useInputPipeline:
+                batchImage = batchAge = batchSex = None
             else:
-                saveFile = None
-            network.printStatus(i+loadedCheckpoint, batchImage, batchSex, batchAge, logFilePath=saveFile)
-        network.train(batchImage, batchSex, batchAge)
-        if i % saveInterval == 0 and i != 0:
-            network.saveCheckpoint(saveInterval)
-        i = i + 1
-
+                with profiler.section("data_wait"):
+                    batchDict = loader.getData()
+                batchImage = batchDict["image"]
+                batchAge = batchDict["age"]
+                batchSex = batchDict["sex"]
+            if i % printInterval == 0:
+                if (i != 0 or loadedCheckpoint == 0):
+                    #if we are repeating a previous one, skip logging to csv
+                    saveFile = config["log_path"]
+                else:
+                    saveFile = None
+                network.printStatus(i+loadedCheckpoint, batchImage, batchSex, batchAge,
+                                    detectFaces=config["detect_faces"], logFilePath=saveFile, profiler=profiler)
+                loaderStats = loader.getStats()
+                print("loader: buffered " + str(loaderStats["occupancy"]) + "/" + str(loaderStats["slots"]) +
+                      " waited " + "%.1f" % loaderStats["consumer_wait_sec"] + "s on data, workers stalled " +
+                      "%.1f" % loaderStats["producer_stall_sec"] + "s on a full buffer")
+                if network.face_evaluator is not None:
+                    faceStats = network.face_evaluator.stats()
+                    print("face detection: " + "%.3f" % faceStats["submit_sec"] + "s per round on the training thread, " +
+                          str(faceStats["scored"]) + " scored, " + str(faceStats["skipped"]) + " skipped, " +
+                          str(faceStats["errors"]) + " failed")
+                if profiler.lastSummary is not None:
+                    sections = profiler.lastSummary["sections"]
+                    print("step time: " + "%.1f" % profiler.lastSummary["step_ms"]["mean_ms"] + "ms (" +
+                          ", ".join(name + " " + "%.0f" % (sections[name]["fraction"] * 100) + "%" for name in sorted(sections)) + ")")
+            network.train(batchImage, batchSex, batchAge, profiler=profiler)
+            i = i + 1
+            if i % saveInterval == 0:
+                with profiler.section("checkpoint"):
+                    network.saveCheckpoint(i - lastSaved)
+                lastSaved = i
+            # with the input pipeline, data waits happen inside the training step's session.run, so the
+            # loader's own consumer wait counter is logged alongside the step timings
+            profiler.endStep(extra=lambda: {"loader": loader.getStats()})
+    finally:
+        stopRequest.restore()
+        # save whatever was trained since the last checkpoint, even if training was interrupted
+        network.saveCheckpoint(i - lastSaved)
+        network.flushCheckpoints()
+        if useInputPipeline:
+            network.stopInputPipeline()
+        network.stopFaceEvaluator()
+        loader.stop()
+        profiler.close()
+    print("trained " + str(i) + " steps in " + "%.0f" % (time.time() - startTime) + "s")
+    return i
 
+if __name__ == "__main__":
+    runTraining(parseArgs())
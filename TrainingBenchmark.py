@@ -0,0 +1,128 @@
+import sys
+import time
+import shutil
+import tempfile
+import numpy as np
+import tensorflow as tf
+from NeuralNet import NeuralNet
+
+"""
+Stands in for a DataLoader, cycling through a few random batches
+Used so training benchmarks measure the training step rather than image loading
+"""
+class RandomBatchLoader(object):
+    """"""
+
+    def __init__(self, batchSize, imageSize, numBatches=4):
+        self.batches = []
+        for _ in range(numBatches):
+            self.batches += [{"image": np.random.uniform(-1, 1, [batchSize, imageSize, imageSize, 3]).astype(np.float32),
+                              "sex": np.random.choice([-1.0, 1.0], [batchSize, 1]).astype(np.float32),
+                              "age": np.random.uniform(-1, 1, [batchSize, 1]).astype(np.float32)}]
+        self.nextIdx = 0
+
+    def getData(self):
+        batch = self.batches[self.nextIdx]
+        self.nextIdx = (self.nextIdx + 1) % len(self.batches)
+        return batch
+
+"""
+Measures training steps/sec for a freshly initialized network, in its own graph
+Checkpoints are kept in a temporary directory, so existing checkpoints are never restored or overwritten
+
+Params
+    loader:     the DataLoader (or RandomBatchLoader) to pull batches from
+    numSteps:   the number of training steps to time
+    warmup:     the number of steps to run before timing starts
+    inputPipeline:  if true, batches are fed through the network's input pipeline.
+                    otherwise, each batch is passed through feed_dict like the Trainer.py loop
+    networkArgs:    any extra keyword arguments for the NeuralNet (such as fusedTrainStep)
+
+Returns
+    0:  the number of training steps per second
+"""
+def benchmarkTraining(loader, numSteps=50, warmup=5, inputPipeline=False, batch_size=64, image_size=64, noise_size=100, **networkArgs):
+    chkptDir = tempfile.mkdtemp()
+    with tf.Graph().as_default():
+        network = NeuralNet(batch_size=batch_size, image_size=image_size, noise_size=noise_size, chkptDir=chkptDir,
+                            inputPipeline=inputPipeline, **networkArgs)
+    if inputPipeline:
+        network.startInputPipeline(loader)
+    for i in range(warmup + numSteps):
+        if i == warmup:
+            startTime = time.time()
+        if inputPipeline:
+            network.train()
+        else:
+            batchDict = loader.getData()
+            network.train(batchDict["image"], batchDict["sex"], batchDict["age"])
+    stepsPerSec = numSteps / (time.time() - startTime)
+    if inputPipeline:
+        network.stopInputPipeline()
+    network.session.close()
+    shutil.rmtree(chkptDir)
+    return stepsPerSec
+
+"""
+Measures how training steps/sec scale with the number of data-parallel towers on this machine
+The batch size is the same for every tower count, so steps/sec are directly comparable
+
+Params
+    loader:     the DataLoader (or RandomBatchLoader) to pull batches from
+    towerCounts:    the tower counts to try. Each must divide batch_size
+    numSteps:   the number of training steps to time for each tower count
+    batch_size: the total batch size, split between the towers
+    image_size: the size of the images
+    networkArgs:    any extra keyword arguments for the NeuralNet (such as fusedTrainStep or interOpThreads)
+
+Returns
+    0:  a list of dictionaries with the towers, steps/sec, images/sec and speedup over the first tower count
+"""
+def benchmarkScaling(loader, towerCounts=[1, 2, 4, 8], numSteps=30, batch_size=64, image_size=64, **networkArgs):
+    results = []
+    for numTowers in towerCounts:
+        if batch_size % numTowers != 0:
+            print("skipping " + str(numTowers) + " towers: batch size " + str(batch_size) + " doesn't split evenly")
+            continue
+        rate = benchmarkTraining(loader, numSteps=numSteps, batch_size=batch_size, image_size=image_size,
+                                 numTowers=numTowers, **networkArgs)
+        result = {"towers": numTowers, "steps_per_sec": rate, "images_per_sec": rate * batch_size,
+                  "speedup": rate / results[0]["steps_per_sec"] if len(results) > 0 else 1.0}
+        print(str(numTowers) + " towers: " + "%.2f" % rate + " steps/sec (" + "%.2f" % result["speedup"] + "x)")
+        results += [result]
+    return results
+
+if __name__ == "__main__":
+    batch_size = 64
+    image_size = 64
+    scaling = len(sys.argv) > 1 and sys.argv[1] == "scaling"
+    if scaling:
+        sys.argv = sys.argv[:1] + sys.argv[2:]
+    if len(sys.argv) == 3:
+        # benchmark on the real dataset, loading from the packed image shards
+        from ColumnStore import LoadColumnStore
+        from StratifiedSampler import StratifiedSampler
+        from PackedData import LoadPackedData
+        from DataLoader import DataLoader
+        csvdata = LoadColumnStore(sys.argv[1])
+        indices = StratifiedSampler.load(sys.argv[2])
+        packedData = LoadPackedData(csvdata, imageSize=image_size)
+        loader = DataLoader(indices, csvdata, numPerBin=batch_size // indices.numBins, imageSize=image_size,
+                            numWorkerThreads=4, bufferMax=20, useCached=False, packedData=packedData)
+        loader.start()
+    else:
+        print("no (csv_path, indices_path) given; benchmarking with random batches")
+        loader = RandomBatchLoader(batch_size, image_size)
+
+    if scaling:
+        benchmarkScaling(loader, batch_size=batch_size, image_size=image_size, fusedTrainStep=True)
+        exit()
+
+    baseRate = None
+    for inputPipeline, fusedTrainStep in [(False, False), (False, True), (True, False), (True, True)]:
+        rate = benchmarkTraining(loader, inputPipeline=inputPipeline, fusedTrainStep=fusedTrainStep,
+                                 batch_size=batch_size, image_size=image_size)
+        if baseRate is None:
+            baseRate = rate
+        name = ("input pipeline" if inputPipeline else "feed_dict loop") + (", fused step" if fusedTrainStep else "")
+        print(name + ": " + "%.2f" % rate + " steps/sec (" + "%.2f" % (rate / baseRate) + "x)")
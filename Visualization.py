@@ -1,11 +1,11 @@
 import sys
 import os
-import pandas as pd
+import atexit
+import threading
 import  numpy as np
-import pickle
-from DataLoader import getBatch
 from math import ceil
-from scipy.misc import  imsave, imresize
+from collections import deque
+from PIL import Image
 
 """
 function to visualize a batch of data from the dataset
@@ -13,61 +13,185 @@ Will display the entire batch, with each row being a separate age group/gender (
 
 Params
     batchOutput:    the dictionary output from getBatch
-    indices:        the indices file for the dataset
+    indices:        the StratifiedSampler for the dataset
     fileName:       the name of the output png
     maxImgSize:     the size of all sub-images that are combined into the final output
 """
 def visualizeBatch(batchOutput, indices,fileName="batch.png", maxImgSize=64):
     imageVec = batchOutput["image"]
-    numItems = imageVec.shape[0]
-    numRows = len(indices["AgeBinLimits"]) * 2
-    numCols = int(ceil(numItems/numRows))
-    visualizeImages(imageVec, numRows=numRows, numCols=numCols, maxImgSize=maxImgSize, fileName=fileName)
+    numRows = indices.numBins
+    visualizeImages(imageVec, numRows=numRows, maxImgSize=maxImgSize, fileName=fileName)
+
+"""
+Writes rendered grids to png files on a background thread, so callers never wait on encoding or disk
+Canvases are handed back to a pool once written, so the same buffers are reused from call to call
+"""
+class _ImageWriter(object):
+    """"""
+
+    def __init__(self):
+        self._pending = deque()
+        self._pendingCount = threading.Semaphore(0)
+        self._canvases = {}
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._numPending = 0
+        self.errors = 0
+        self.lastError = None
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def getCanvas(self, shape):
+        with self._lock:
+            pool = self._canvases.setdefault(shape, [])
+            if len(pool) > 0:
+                return pool.pop()
+        return np.empty(shape, dtype=np.uint8)
+
+    def write(self, canvas, fileNames):
+        with self._lock:
+            self._numPending = self._numPending + 1
+        self._pending.append((canvas, fileNames))
+        self._pendingCount.release()
+
+    def flush(self):
+        with self._lock:
+            while self._numPending > 0:
+                self._idle.wait()
+            error = self.lastError
+            self.lastError = None
+        if error is not None:
+            raise error
+
+    def _run(self):
+        while True:
+            self._pendingCount.acquire()
+            canvas, fileNames = self._pending.popleft()
+            try:
+                _savePng(canvas, fileNames)
+            except Exception as e:
+                # a failed write is logged and kept for flush, so the thread keeps writing later grids
+                with self._lock:
+                    self.errors = self.errors + 1
+                    self.lastError = e
+                print("failed to write " + ", ".join(fileNames) + ": " + repr(e))
+            finally:
+                with self._lock:
+                    self._canvases[canvas.shape].append(canvas)
+                    self._numPending = self._numPending - 1
+                    self._idle.notify_all()
+
+def _savePng(canvas, fileNames):
+    image = Image.fromarray(canvas[:, :, 0] if canvas.shape[2] == 1 else canvas)
+    for fileName in fileNames:
+        # write to a temp file first, so viewers never see a half-written image
+        base, ext = os.path.splitext(fileName)
+        tmpName = base + ".tmp" + ext
+        image.save(tmpName)
+        os.rename(tmpName, fileName)
+
+_writer = None
+
+"""
+Waits for every image grid queued by visualizeImages to be written to disk
+Raises the last write error since the previous flush, if any grid couldn't be written
+"""
+def flushImages():
+    if _writer is not None:
+        _writer.flush()
+
+def _flushAtExit():
+    try:
+        flushImages()
+    except Exception:
+        # the failed writes were already printed when they happened
+        pass
+
+atexit.register(_flushAtExit)
 
 """
 More general visualization function, that can be used for any set of images (not just from dataset)
 takes in a numpy array of images ([batchSize, rows, cols, channels]), and displays
 a subset of the images in a png file
 
+Tiles are resized before tiling, and the grid is built with a single reshape/transpose copy into a reused
+uint8 canvas. Like scipy's imsave, pixel values are stretched so the darkest value is black and the
+brightest is white. By default the png is written on a background thread; use flushImages to wait for it
+
 Params
     imageMat:   a numpy array of images to display
     numRows:    the number of rows to use in the output
     maxImgSize:     the size of all sub-images that are combined into the final output
-    fileName:       the name of the output png
+    fileName:       the name of the output png, or a list of names to write the same grid to
+    background:     if true, the png is written on a background thread
 """
-def visualizeImages(imageMat, numRows=5, maxImgSize=64, fileName="images_set.png"):
+def visualizeImages(imageMat, numRows=5, maxImgSize=64, fileName="images_set.png", background=True):
+    global _writer
+    fileNames = [fileName] if isinstance(fileName, str) else list(fileName)
     #create directory if necessary
-    path = os.path.dirname(os.path.abspath(fileName))
-    if not os.path.exists(path):
-        os.mkdir(path)
+    for name in fileNames:
+        path = os.path.dirname(os.path.abspath(name))
+        if not os.path.exists(path):
+            os.makedirs(path)
 
     numItems = imageMat.shape[0]
-    numCols = int(ceil(numItems / numRows))
-    imageSize = [imageMat.shape[1], imageMat.shape[2], imageMat.shape[3]]
-    CombinedImage = np.ones([imageSize[0] * numRows, imageSize[1] * numCols, imageSize[2]])
-    i = 0
-    rowStart = 0
-    for r in range(numRows):
-        rowEnd = rowStart + imageSize[0]
-        RowImage = np.zeros([imageSize[0], imageSize[1] * numCols, imageSize[2]])
-        lastStart = 0
-        for c in range(numCols):
-            thisImage = imageMat[i, :, :, :]
-            end = lastStart + imageSize[1]
-            RowImage[:, lastStart:end, :] = thisImage
-            lastStart = end
-            i = i + 1
-            if i >= numItems:
-                break
-        CombinedImage[rowStart:rowEnd, :, :] = RowImage
-        rowStart = rowEnd
-    if maxImgSize is not None:
-        CombinedImage = imresize(CombinedImage, [maxImgSize * numRows, maxImgSize * numCols])
-    if os.path.exists(fileName):
-        os.remove(fileName)
-    imsave(fileName, CombinedImage)
+    numCols = int(ceil(numItems / float(numRows)))
+    tiles = _toUint8(imageMat, hasPadding=numRows * numCols > numItems)
+    if maxImgSize is not None and (tiles.shape[1] != maxImgSize or tiles.shape[2] != maxImgSize):
+        tiles = _resizeTiles(tiles, maxImgSize)
+    tileRows, tileCols, channels = tiles.shape[1], tiles.shape[2], tiles.shape[3]
+
+    shape = (numRows * tileRows, numCols * tileCols, channels)
+    if background and _writer is None:
+        _writer = _ImageWriter()
+    canvas = _writer.getCanvas(shape) if background else np.empty(shape, dtype=np.uint8)
+    # view the canvas as [row, tile row, col, tile col, channel], so every tile is placed in one copy
+    gridView = canvas.reshape([numRows, tileRows, numCols, tileCols, channels])
+    numFull = numItems // numCols
+    if numFull > 0:
+        fullTiles = tiles[:numFull * numCols].reshape([numFull, numCols, tileRows, tileCols, channels])
+        gridView[:numFull] = fullTiles.transpose([0, 2, 1, 3, 4])
+    if numFull < numRows:
+        # the partly filled last row, and any empty rows after it, are left black
+        gridView[numFull:] = 0
+        lastTiles = tiles[numFull * numCols:]
+        gridView[numFull, :, :lastTiles.shape[0]] = lastTiles.transpose([1, 0, 2, 3])
+    if background:
+        _writer.write(canvas, fileNames)
+    else:
+        _savePng(canvas, fileNames)
+
+def _toUint8(imageMat, hasPadding=False):
+    if imageMat.dtype == np.uint8:
+        return imageMat
+    # stretch values to the full 0-255 range, including the black used for empty grid cells
+    low = float(imageMat.min())
+    high = float(imageMat.max())
+    if hasPadding:
+        low = min(low, 0.0)
+        high = max(high, 0.0)
+    scale = 255.0 / (high - low) if high > low else 1.0
+    tiles = (np.asarray(imageMat, dtype=np.float32) - low) * scale
+    np.clip(tiles, 0, 255, out=tiles)
+    tiles += 0.5
+    return tiles.astype(np.uint8)
+
+def _resizeTiles(tiles, size):
+    resized = np.empty([tiles.shape[0], size, size, tiles.shape[3]], dtype=np.uint8)
+    for i in range(tiles.shape[0]):
+        tile = tiles[i, :, :, 0] if tiles.shape[3] == 1 else tiles[i]
+        tile = np.asarray(Image.fromarray(tile).resize((size, size), Image.BILINEAR))
+        resized[i] = tile.reshape([size, size, tiles.shape[3]])
+    return resized
 
 if __name__ == "__main__":
+    # the dataset modules are only needed here, so importing visualizeImages stays lightweight
+    from ColumnStore import LoadColumnStore
+    from StratifiedSampler import StratifiedSampler
+    from DataLoader import getBatch
+    from ImageCache import ImageCache
+
     if len(sys.argv) != 3:
         print("requires 2 parameters (csv_path, indices_path)")
         exit()
@@ -79,14 +203,10 @@ if __name__ == "__main__":
         print("one or both files not found")
         exit()
 
-    print("restoring csv data...")
-    csvdata = pd.read_csv(csvPath)
+    csvdata = LoadColumnStore(csvPath)
 
     print("restoring indices data...")
-    file = open(indicesPath, "rb")
-    indices = pickle.load(file)
-    file.close()
+    indices = StratifiedSampler.load(indicesPath)
 
-    state = None
-    batchData, state, didFinish = getBatch(indices, csvdata, prevState=state, imageSize=64)
+    batchData, didFinish = getBatch(indices, csvdata, imageSize=64, imageCache=ImageCache())
     visualizeBatch(batchData, indices)
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+from BatchCache import WarmStartCache, datasetFingerprint
+
+def _batch(value, batchSize=4, imageSize=8):
+    pixels = np.full([batchSize, imageSize, imageSize, 3], value, dtype=np.uint8)
+    return {"image": (pixels / 127.5 - 1).astype(np.float32),
+            "sex": np.full([batchSize, 1], value % 2, dtype=np.float32),
+            "age": np.full([batchSize, 1], value / 100.0, dtype=np.float32)}
+
+def _emptyBatch(batchSize=4, imageSize=8):
+    return {"image": np.zeros([batchSize, imageSize, imageSize, 3], dtype=np.float32),
+            "sex": np.zeros([batchSize, 1], dtype=np.float32), "age": np.zeros([batchSize, 1], dtype=np.float32)}
+
+def testFingerprintTracksTheData():
+    csvdata = pd.DataFrame({"path": ["a.jpg", "b.jpg"], "age": [20.0, 30.0], "isMale": [1.0, 0.0]})
+    fingerprint = datasetFingerprint(csvdata)
+    assert datasetFingerprint(csvdata.copy()) == fingerprint
+    changed = csvdata.copy()
+    changed.loc[1, "path"] = "c.jpg"
+    assert datasetFingerprint(changed) != fingerprint
+    changed = csvdata.copy()
+    changed.loc[0, "age"] = 21.0
+    assert datasetFingerprint(changed) != fingerprint
+
+def testFullCacheIsRestored(tmp_path):
+    cache = WarmStartCache("f" * 40, 8, 2, 4, cacheDir=str(tmp_path), maxBatches=3)
+    for value in [10, 20, 30, 40]:
+        cache.record(_batch(value))
+    cache.flush()
+    restored = WarmStartCache("f" * 40, 8, 2, 4, cacheDir=str(tmp_path), maxBatches=3)
+    assert restored.remaining() == 3 and not restored.recording
+    out = _emptyBatch()
+    for value in [10, 20, 30]:
+        assert restored.nextBatch(out)
+        expected = _batch(value)
+        np.testing.assert_allclose(out["image"], expected["image"], atol=1e-6)
+        np.testing.assert_array_equal(out["sex"], expected["sex"])
+        np.testing.assert_array_equal(out["age"], expected["age"])
+    assert not restored.nextBatch(out)
+
+def testPartialCacheIsWrittenOnFlush(tmp_path):
+    cache = WarmStartCache("f" * 40, 8, 2, 4, cacheDir=str(tmp_path), maxBatches=8)
+    for value in [10, 20]:
+        cache.record(_batch(value))
+    cache.flush()
+    restored = WarmStartCache("f" * 40, 8, 2, 4, cacheDir=str(tmp_path), maxBatches=8)
+    assert restored.remaining() == 2
+
+def testCacheIsIgnoredForOtherData(tmp_path):
+    cache = WarmStartCache("f" * 40, 8, 2, 4, cacheDir=str(tmp_path), maxBatches=1)
+    cache.record(_batch(10))
+    cache.flush()
+    assert WarmStartCache("e" * 40, 8, 2, 4, cacheDir=str(tmp_path)).remaining() == 0
+    assert WarmStartCache("f" * 40, 8, 1, 2, cacheDir=str(tmp_path)).remaining() == 0
@@ -0,0 +1,62 @@
+import time
+import threading
+import multiprocessing
+import numpy as np
+from BatchRing import BatchRing
+
+def _fill(ring, values, producerNum=0):
+    for value in values:
+        slotNum, slot = ring.acquireFree(producerNum)
+        slot["image"][:] = value
+        slot["sex"][:] = value
+        slot["age"][:] = -value
+        ring.publish(slotNum, info=value, producerNum=producerNum)
+
+def _consume(ring, count):
+    values = []
+    for _ in range(count):
+        slotNum, slot, info = ring.acquireReady()
+        assert np.all(slot["image"] == info) and np.all(slot["age"] == -info)
+        values += [info]
+        ring.release(slotNum)
+    return values
+
+def testSlotsAreConsumedInPublishOrder():
+    ring = BatchRing(3, 2, 4)
+    _fill(ring, [1, 2, 3])
+    assert ring.occupancy() == 3
+    assert _consume(ring, 2) == [1, 2]
+    _fill(ring, [4, 5])
+    assert _consume(ring, 3) == [3, 4, 5]
+    stats = ring.stats()
+    assert stats["produced"] == 5 and stats["consumed"] == 5 and stats["occupancy"] == 0
+
+def testSlotsAreReusedWithoutCopying():
+    ring = BatchRing(2, 1, 2)
+    slotNum, slot = ring.acquireFree()
+    ring.publish(slotNum)
+    readNum, readSlot, _ = ring.acquireReady()
+    assert readNum == slotNum and readSlot["image"] is slot["image"]
+
+def testProducerWaitsForAFreeSlot():
+    ring = BatchRing(2, 1, 2)
+    _fill(ring, [1, 2])
+    producer = threading.Thread(target=_fill, args=[ring, [3]])
+    producer.start()
+    time.sleep(0.2)
+    # the ring is full, so the third batch can't be published until a slot is released
+    assert producer.is_alive() and ring.occupancy() == 2
+    assert _consume(ring, 1) == [1]
+    producer.join(5)
+    assert not producer.is_alive()
+    assert _consume(ring, 2) == [2, 3]
+    assert ring.stats()["producer_stall_sec"] >= 0.1
+
+def testSharedRingAcrossProcesses():
+    ring = BatchRing(2, 2, 4, numProducers=1, shared=True)
+    producer = multiprocessing.Process(target=_fill, args=[ring, list(range(10))])
+    producer.start()
+    # every batch arrives intact and in order, even though the producer reuses the two slots
+    assert _consume(ring, 10) == list(range(10))
+    producer.join()
+    assert ring.stats()["produced"] == 10
@@ -0,0 +1,85 @@
+import os
+import json
+from CheckpointManifest import CheckpointManifest
+
+def _writeCheckpoint(checkpointDir, step, name="model"):
+    # the files a tensorflow Saver writes for one checkpoint
+    for suffix in [".index", ".data-00000-of-00001", ".meta"]:
+        open(os.path.join(checkpointDir, name + "-" + str(step) + suffix), "w").close()
+
+def _save(manifest, step, faceAcc=None):
+    _writeCheckpoint(manifest.checkpointDir, step)
+    return manifest.add(step, dLoss=0.5, gLoss=1.5, faceAcc=faceAcc, faceAccStep=step if faceAcc is not None else None)
+
+def testKeepsTheNewestCheckpoints(tmp_path):
+    manifest = CheckpointManifest(str(tmp_path), "model", maxToKeep=2)
+    for step in [100, 200]:
+        assert _save(manifest, step) == []
+    assert _save(manifest, 300) == [100]
+    assert [entry["step"] for entry in manifest.entries] == [200, 300]
+    assert not any(file.startswith("model-100.") for file in os.listdir(str(tmp_path)))
+    assert manifest.newest()["step"] == 300
+
+def testKeepsTheBestCheckpoint(tmp_path):
+    manifest = CheckpointManifest(str(tmp_path), "model", maxToKeep=2)
+    _save(manifest, 100, faceAcc=0.4)
+    _save(manifest, 200, faceAcc=0.9)
+    assert _save(manifest, 300, faceAcc=0.5) == [100]
+    # the best checkpoint is kept on top of the newest maxToKeep
+    assert _save(manifest, 400, faceAcc=0.6) == []
+    assert _save(manifest, 500, faceAcc=0.7) == [300]
+    assert [entry["step"] for entry in manifest.entries] == [200, 400, 500]
+    assert manifest.best()["step"] == 200
+    assert manifest.newest()["step"] == 500
+    assert os.path.exists(os.path.join(str(tmp_path), "model-200.index"))
+
+def testWithoutKeepBest(tmp_path):
+    manifest = CheckpointManifest(str(tmp_path), "model", maxToKeep=1, keepBest=False)
+    _save(manifest, 100, faceAcc=0.9)
+    assert _save(manifest, 200, faceAcc=0.1) == [100]
+
+def testBestFallsBackToTheNewest(tmp_path):
+    manifest = CheckpointManifest(str(tmp_path), "model")
+    assert manifest.best() is None
+    _save(manifest, 100)
+    _save(manifest, 200)
+    assert manifest.best()["step"] == 200
+
+def testRecordFaceAccKeepsTheClosestMeasurement(tmp_path):
+    manifest = CheckpointManifest(str(tmp_path), "model")
+    _save(manifest, 100)
+    manifest.recordFaceAcc(150, 0.3)
+    manifest.recordFaceAcc(110, 0.7)
+    manifest.recordFaceAcc(190, 0.1)
+    assert manifest.entries[0]["face_acc"] == 0.7 and manifest.entries[0]["face_acc_step"] == 110
+    # rates measured before the first checkpoint have nowhere to go
+    manifest.recordFaceAcc(50, 0.9)
+    assert manifest.entries[0]["face_acc"] == 0.7
+
+def testManifestIsRestored(tmp_path):
+    manifest = CheckpointManifest(str(tmp_path), "model", maxToKeep=2)
+    _save(manifest, 100, faceAcc=0.8)
+    _save(manifest, 200)
+    restored = CheckpointManifest(str(tmp_path), "model", maxToKeep=2)
+    assert restored.entries == json.loads(json.dumps(manifest.entries))
+    assert restored.best()["step"] == 100
+
+def testLegacyDirectoriesAreScanned(tmp_path):
+    for step in [1000, 2000]:
+        _writeCheckpoint(str(tmp_path), step)
+    # an old style single file checkpoint
+    open(os.path.join(str(tmp_path), "model-3000"), "w").close()
+    open(os.path.join(str(tmp_path), "other-4000.index"), "w").close()
+    manifest = CheckpointManifest(str(tmp_path), "model")
+    assert [entry["step"] for entry in manifest.entries] == [1000, 2000, 3000]
+    assert os.path.exists(manifest.manifestPath)
+    assert manifest.paths()[-1] == os.path.join(str(tmp_path), "model-3000")
+
+def testMissingFilesAreSkipped(tmp_path):
+    manifest = CheckpointManifest(str(tmp_path), "model")
+    _save(manifest, 100)
+    _save(manifest, 200)
+    for file in os.listdir(str(tmp_path)):
+        if file.startswith("model-200."):
+            os.remove(os.path.join(str(tmp_path), file))
+    assert manifest.newest()["step"] == 100
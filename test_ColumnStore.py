@@ -0,0 +1,40 @@
+import os
+import numpy as np
+import pandas as pd
+from ColumnStore import writeColumnStore, LoadColumnStore
+
+def _dataframe():
+    csvdata = pd.DataFrame({"path": ["a/1.jpg", "b/2.jpg", "", "c/été.jpg"],
+                            "age": [21.5, 40.0, np.nan, 63.25],
+                            "isMale": [1, 0, 1, 0],
+                            "name": ["Ann", None, "Bo", "Cy"]},
+                           index=[3, 7, 8, 12])
+    return csvdata
+
+def testRoundTrip(tmp_path):
+    csvdata = _dataframe()
+    store = writeColumnStore(csvdata, str(tmp_path / "store"))
+    assert len(store) == 4
+    assert store.columns == list(csvdata.columns)
+    assert list(store.index) == [3, 7, 8, 12]
+    np.testing.assert_array_equal(store["age"], csvdata["age"].values.astype(np.float32))
+    np.testing.assert_array_equal(store["isMale"], csvdata["isMale"].values)
+    assert [store["path"][i] for i in range(4)] == list(csvdata["path"])
+    # missing strings come back empty
+    assert store["name"][1] == ""
+    assert store["name"][np.array([0, 2, 3])] == ["Ann", "Bo", "Cy"]
+    assert "age" in store and "missing" not in store
+
+def testEmptyStringColumn(tmp_path):
+    store = writeColumnStore(pd.DataFrame({"path": ["", ""], "age": [1.0, 2.0]}), str(tmp_path / "store"))
+    assert store["path"][0] == "" and store["path"][1] == ""
+
+def testRebuiltWhenCsvChanges(tmp_path):
+    csvPath = str(tmp_path / "dataset.csv")
+    storeDir = str(tmp_path / "store")
+    _dataframe().to_csv(csvPath, index=False)
+    assert len(LoadColumnStore(csvPath, storeDir)) == 4
+    _dataframe().iloc[:2].to_csv(csvPath, index=False)
+    # make sure the mtime differs even on filesystems with coarse timestamps
+    os.utime(csvPath, (0, 12345))
+    assert len(LoadColumnStore(csvPath, storeDir)) == 2
@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+from CsvStats import computeStats, statsCsv
+from ColumnStore import writeColumnStore
+from StratifiedSampler import StratifiedSampler
+
+def _dataframe(numRows=3000, seed=0):
+    rng = np.random.RandomState(seed)
+    return pd.DataFrame({"path": ["img/" + str(i) + ".jpg" for i in range(numRows)],
+                         "age": rng.uniform(10, 100, size=numRows).round(1),
+                         "isMale": rng.randint(2, size=numRows).astype(np.float64),
+                         "image_width": rng.randint(30, 900, size=numRows),
+                         "image_height": rng.randint(30, 900, size=numRows),
+                         "face_score": np.where(rng.rand(numRows) < 0.1, np.nan, rng.uniform(0, 8, size=numRows))})
+
+# the row by row loops computeStats replaced, used as the reference
+def _loopAgeSex(csvdata, ageRange):
+    resultsArr = np.zeros([ageRange[1] - ageRange[0] + 1, 2], dtype=int)
+    for i in range(len(csvdata.index)):
+        sex = int(csvdata["isMale"][i])
+        age = int(csvdata["age"][i])
+        resultsArr[age - ageRange[0], sex] = resultsArr[age - ageRange[0], sex] + 1
+    return resultsArr
+
+def _loopResolution(csvdata):
+    minRes, maxRes = float("inf"), 0
+    minSize, maxSize = None, None
+    for i in range(len(csvdata.index)):
+        width = csvdata["image_width"][i]
+        height = csvdata["image_height"][i]
+        if width * height > maxRes:
+            maxRes = width * height
+            maxSize = [width, height]
+        if width * height < minRes:
+            minRes = width * height
+            minSize = [width, height]
+    return minSize, maxSize
+
+def testMatchesTheRowLoop():
+    csvdata = _dataframe()
+    stats = computeStats(csvdata, chunkSize=700)
+    np.testing.assert_array_equal(stats["ageSex"].values, _loopAgeSex(csvdata, [10, 100]))
+    minSize, maxSize = _loopResolution(csvdata)
+    assert stats["resolution"]["min"] == minSize and stats["resolution"]["max"] == maxSize
+    assert stats["rows"] == len(csvdata.index)
+    assert stats["faceScore"]["count"].sum() == len(csvdata.index)
+
+def testBinCountsMatchTheSampler():
+    csvdata = _dataframe()
+    stats = computeStats(csvdata)
+    sampler = StratifiedSampler(csvdata)
+    np.testing.assert_array_equal(stats["binCounts"]["count"].values, sampler.binSizes)
+
+def testSourcesAgree(tmp_path):
+    csvdata = _dataframe()
+    csvPath = str(tmp_path / "dataset.csv")
+    csvdata.to_csv(csvPath, index=False)
+    store = writeColumnStore(csvdata, str(tmp_path / "store"))
+    expected = computeStats(csvdata)
+    for source in [csvPath, store]:
+        stats = computeStats(source, chunkSize=1000)
+        pd.testing.assert_frame_equal(stats["ageSex"], expected["ageSex"])
+        pd.testing.assert_frame_equal(stats["binCounts"], expected["binCounts"])
+        pd.testing.assert_frame_equal(stats["faceScore"], expected["faceScore"])
+        assert stats["resolution"] == expected["resolution"]
+
+def testStatsCsvWritesTheAgeSexTable(tmp_path):
+    csvdata = _dataframe(numRows=200)
+    outPath = str(tmp_path / "stats.csv")
+    df = statsCsv(csvdata, outPath=outPath)
+    np.testing.assert_array_equal(pd.read_csv(outPath, index_col=0).values, df.values)
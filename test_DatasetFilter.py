@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+from DatasetFilter import DatasetFilter
+from ColumnStore import writeColumnStore
+
+def _master(numRows=2000, seed=0):
+    rng = np.random.RandomState(seed)
+    return pd.DataFrame({"path": ["img/" + str(i) + ".jpg" for i in range(numRows)],
+                         "face_score": np.where(rng.rand(numRows) < 0.1, np.nan, rng.uniform(-1, 6, size=numRows)),
+                         "image_resolution": rng.randint(0, 300, size=numRows) ** 2,
+                         "age": rng.uniform(-5, 120, size=numRows).round(),
+                         "isMale": np.where(rng.rand(numRows) < 0.1, np.nan, rng.randint(2, size=numRows)),
+                         "image_format": rng.choice(["RGB", "L", "CMYK"], size=numRows, p=[0.8, 0.15, 0.05]),
+                         "second_face": np.where(rng.rand(numRows) < 0.7, np.nan, rng.uniform(0, 5, size=numRows))})
+
+# the chain of dataframe filters combinedMask replaced, used as the reference
+def _filterDataframe(csvData, ageRange, minScore, minRes, filterGender, filterRGB, filterMult):
+    if minScore is not None:
+        csvData = csvData[csvData.face_score > minScore]
+    if minRes is not None:
+        csvData = csvData[csvData.image_resolution > minRes]
+    if ageRange is not None:
+        csvData = csvData[csvData.age > ageRange[0]]
+        csvData = csvData[csvData.age < ageRange[1]]
+    if filterGender:
+        csvData = csvData[csvData.isMale.notnull()]
+    if filterRGB:
+        csvData = csvData[csvData.image_format == "RGB"]
+    if filterMult:
+        csvData = csvData[csvData.second_face.isnull()]
+    return csvData
+
+_settings = [([10, 100], 1, 60*60, True, True, True),
+             ([20, 60], 3, 100*100, True, False, True),
+             (None, None, None, False, False, False),
+             ([0, 200], 0, None, False, True, False)]
+
+def testMatchesTheDataframeFilters(tmp_path):
+    master = _master()
+    store = writeColumnStore(master, str(tmp_path / "store"))
+    for source in [master, store]:
+        datasetFilter = DatasetFilter(source)
+        for ageRange, minScore, minRes, filterGender, filterRGB, filterMult in _settings:
+            mask = datasetFilter.combinedMask(ageRange=ageRange, minScore=minScore, minRes=minRes,
+                                              filterGender=filterGender, filterRGB=filterRGB,
+                                              filterMult=filterMult, printResults=False)
+            expected = _filterDataframe(master, ageRange, minScore, minRes, filterGender, filterRGB, filterMult)
+            assert list(np.nonzero(mask)[0]) == list(expected.index)
+
+def testMasksAreCachedOnDisk(tmp_path):
+    master = _master()
+    cachePath = str(tmp_path / "masks.p")
+    datasetFilter = DatasetFilter(master, cachePath=cachePath, sourceMtime=1.0)
+    expected = datasetFilter.combinedMask(printResults=False)
+    datasetFilter.save()
+
+    restored = DatasetFilter(master, cachePath=cachePath, sourceMtime=1.0)
+    assert len(restored._masks) == 6
+    np.testing.assert_array_equal(restored.combinedMask(printResults=False), expected)
+    # masks saved for a different version of the master table are discarded
+    assert len(DatasetFilter(master, cachePath=cachePath, sourceMtime=2.0)._masks) == 0
@@ -0,0 +1,57 @@
+import os
+import threading
+import multiprocessing
+import numpy as np
+from ImageCache import ImageCache
+
+def _loader(calls):
+    def loadFn(path, imageSize):
+        calls.append(path)
+        return np.full([imageSize, imageSize, 3], len(path), dtype=np.uint8)
+    return loadFn
+
+def testMemoryThenDiskThenMiss(tmp_path):
+    calls = []
+    cache = ImageCache(str(tmp_path), memoryItems=4)
+    first = cache.get("a.jpg", 8, _loader(calls))
+    second = cache.get("a.jpg", 8, _loader(calls))
+    assert calls == ["a.jpg"] and second is first
+    # a new cache over the same directory starts with an empty memory tier, so it reads from disk
+    restored = ImageCache(str(tmp_path), memoryItems=4)
+    np.testing.assert_array_equal(restored.get("a.jpg", 8, _loader(calls)), first)
+    assert calls == ["a.jpg"]
+    # a different size is a different entry
+    restored.get("a.jpg", 4, _loader(calls))
+    assert calls == ["a.jpg", "a.jpg"]
+    stats = restored.stats()
+    assert (stats["memory_hits"], stats["disk_hits"], stats["misses"]) == (0, 1, 1)
+
+def testDiskTierStaysInBudget(tmp_path):
+    imageBytes = 8 * 8 * 3
+    cache = ImageCache(str(tmp_path), maxBytes=imageBytes * 3, memoryItems=0)
+    calls = []
+    for i in range(6):
+        cache.get(str(i) + ".jpg", 8, _loader(calls))
+    stats = cache.stats()
+    assert stats["disk_entries"] == 3 and stats["disk_bytes"] == imageBytes * 3
+    numFiles = sum(len(files) for _, _, files in os.walk(str(tmp_path)))
+    assert numFiles == 3
+    # the oldest entries were evicted, so they're decoded again
+    cache.get("0.jpg", 8, _loader(calls))
+    assert calls[-1] == "0.jpg" and len(calls) == 7
+
+def _hammer(cache, numGets):
+    for _ in range(numGets):
+        cache.get("a.jpg", 8, _loader([]))
+
+def testCountersAreExactAcrossWorkers(tmp_path):
+    cache = ImageCache(str(tmp_path), memoryItems=4)
+    cache.get("a.jpg", 8, _loader([]))
+    # worker processes share the counters, the way the DataLoader's process backend uses the cache
+    workers = [multiprocessing.Process(target=_hammer, args=[cache, 5000]) for _ in range(4)]
+    workers += [threading.Thread(target=_hammer, args=[cache, 5000]) for _ in range(2)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert cache.stats()["memory_hits"] == 6 * 5000
@@ -0,0 +1,44 @@
+import numpy as np
+from Quantization import quantizeInt8, quantizeBfloat16, dequantizeBfloat16
+
+def _weights(shape=[5, 5, 64, 32], seed=0):
+    return np.random.RandomState(seed).normal(0, 0.05, size=shape).astype(np.float32)
+
+def testInt8ScalesEachOutputChannel():
+    weights = _weights()
+    # one channel with much larger weights shouldn't cost the others their precision
+    weights[..., 3] *= 100
+    quantized, scales = quantizeInt8(weights)
+    assert quantized.dtype == np.int8 and quantized.shape == weights.shape
+    assert scales.dtype == np.float32 and scales.shape == (weights.shape[-1],)
+    np.testing.assert_allclose(scales, np.abs(weights).reshape([-1, 32]).max(axis=0) / 127.0, rtol=1e-6)
+    # every channel uses the full int8 range, and rounding is off by at most half a step
+    assert np.all(np.abs(quantized).reshape([-1, 32]).max(axis=0) == 127)
+    error = np.abs(quantized * scales - weights)
+    assert np.all(error <= scales / 2 + 1e-7)
+
+def testInt8ZeroChannel():
+    weights = _weights(shape=[10, 4])
+    weights[:, 1] = 0
+    quantized, scales = quantizeInt8(weights)
+    assert np.all(np.isfinite(scales))
+    assert np.all(quantized[:, 1] == 0)
+
+def testBfloat16RoundTrip():
+    weights = _weights()
+    stored = quantizeBfloat16(weights)
+    assert stored.dtype == np.int16 and stored.shape == weights.shape
+    restored = dequantizeBfloat16(stored)
+    # bfloat16 keeps 7 bits of mantissa, so rounding to nearest is off by at most 2^-8 of the value
+    assert np.all(np.abs(restored - weights) <= np.abs(weights) * 2.0 ** -8)
+    assert np.any(restored != weights)
+
+def testBfloat16ExactValuesAndRounding():
+    values = np.array([0.0, -0.0, 1.0, -2.5, 65280.0, np.inf, -np.inf], dtype=np.float32)
+    np.testing.assert_array_equal(dequantizeBfloat16(quantizeBfloat16(values)), values)
+    # halfway between two bfloat16 values rounds to the one with an even mantissa
+    one = np.float32(1.0).view(np.uint32)
+    halfway = np.array([one + 0x8000, one + 0x18000, one + 0x8001], dtype=np.uint32).view(np.float32)
+    expected = np.array([one, one + 0x20000, one + 0x10000], dtype=np.uint32).view(np.float32)
+    np.testing.assert_array_equal(dequantizeBfloat16(quantizeBfloat16(halfway)), expected)
+    assert np.isnan(dequantizeBfloat16(quantizeBfloat16(np.array([np.nan], dtype=np.float32))))[0]
@@ -0,0 +1,95 @@
+import numpy as np
+from Sampler import runGenerator, randomSample, ageSample, sexInputs, bulkSample
+
+class _FakeSession(object):
+    """"""
+
+    # stands in for the generator: a fixed linear layer followed by batch normalization, so (like the real
+    # generator) each image depends on the statistics of the whole chunk it was generated in
+    def __init__(self, noiseSize, normalize=True):
+        rng = np.random.RandomState(0)
+        self.weights = rng.normal(size=[noiseSize + 2, 12]).astype(np.float32)
+        self.normalize = normalize
+        self.runSizes = []
+
+    def run(self, output, feed_dict):
+        inputs = np.concatenate([feed_dict["noise"], feed_dict["sex"], feed_dict["age"]], axis=1)
+        self.runSizes += [inputs.shape[0]]
+        if not self.normalize:
+            return inputs
+        hidden = inputs.dot(self.weights)
+        mean = hidden.mean(axis=0)
+        variance = hidden.var(axis=0)
+        return ((hidden - mean) / np.sqrt(variance + 1e-8)).reshape([-1, 2, 2, 3])
+
+class _FakeNetwork(object):
+    """"""
+
+    def __init__(self, batch_size=16, noise_size=8, normalize=True):
+        self.batch_size = batch_size
+        self.noise_size = noise_size
+        self.image_size = 2
+        self.session = _FakeSession(noise_size, normalize)
+
+    def getSample(self, noiseMat, genderMat, ageMat, chunkSize=None):
+        return runGenerator(self.session, "output", ["noise", "sex", "age"], noiseMat, genderMat, ageMat,
+                            self.batch_size, chunkSize=chunkSize)
+
+def _inputs(numRows, noiseSize, seed):
+    rng = np.random.RandomState(seed)
+    return (rng.uniform(-1, 1, [numRows, noiseSize]).astype(np.float32), np.ones([numRows, 1], dtype=np.float32),
+            np.zeros([numRows, 1], dtype=np.float32))
+
+def testChunksAreSlicedBackInOrder():
+    network = _FakeNetwork(normalize=False)
+    for sampleSize in [1, 5, 16, 40, 47]:
+        noiseMat, genderMat, ageMat = _inputs(sampleSize, network.noise_size, sampleSize)
+        ageMat[:, 0] = np.arange(sampleSize)
+        result = network.getSample(noiseMat, genderMat, ageMat)
+        np.testing.assert_array_equal(result, np.concatenate([noiseMat, genderMat, ageMat], axis=1))
+
+def testShortChunksArePaddedToTheBatchSize():
+    network = _FakeNetwork()
+    network.getSample(*_inputs(3, network.noise_size, 0))
+    # a larger sample is split into chunks of at least batch_size, with no tiny final chunk
+    network.getSample(*_inputs(40, network.noise_size, 1))
+    network.getSample(*_inputs(40, network.noise_size, 2), chunkSize=4)
+    assert network.session.runSizes == [16, 20, 20, 16, 16, 16, 16, 16, 16, 16, 16, 16, 16]
+
+def testSingleImageDependsOnItsNoise():
+    network = _FakeNetwork()
+    results = []
+    for seed in [1, 2]:
+        noiseMat, genderMat, ageMat = _inputs(1, network.noise_size, seed)
+        # the same filler rows both times, so only the requested noise differs
+        np.random.seed(0)
+        results += [network.getSample(noiseMat, genderMat, ageMat)]
+    assert not np.allclose(results[0], results[1], atol=1e-3)
+    assert np.abs(randomSample(network, 1)).max() > 1e-3
+
+def testAgeSweepKeepsTheNoise():
+    network = _FakeNetwork()
+    faces = []
+    for seed in [1, 2]:
+        noiseArr = np.random.RandomState(seed).uniform(-1, 1, [1, network.noise_size])
+        np.random.seed(0)
+        faces += [ageSample(network, 10, gender=1, noiseArr=noiseArr)]
+    # the rows share one noise vector, so without filler rows batch normalization would remove it entirely
+    assert not np.allclose(faces[0], faces[1], atol=1e-3)
+    assert np.abs(faces[0]).max() < 10
+
+def testSexInputsPairTheSameFaces():
+    noiseArr, genderArr, ageVec = sexInputs(8, 3, age=40)
+    np.testing.assert_array_equal(noiseArr[:3], noiseArr[3:])
+    assert list(genderArr[:, 0]) == [-1, -1, -1, 1, 1, 1]
+    np.testing.assert_allclose(ageVec, -0.2)
+
+def testBulkSamplePadsTheLastChunk(tmp_path):
+    network = _FakeNetwork(batch_size=8)
+    outPath = str(tmp_path / "faces.npy")
+    bulkSample(network, 21, outPath=outPath, chunkImages=10)
+    # the final chunk of 1 face is generated as part of a full batch
+    assert min(network.session.runSizes) == 8
+    faces = np.load(outPath)
+    assert faces.dtype == np.uint8 and faces.shape == (21, 2, 2, 3)
+    assert np.load(str(tmp_path / "faces_labels.npy")).shape == (21, 2)
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+from StratifiedSampler import StratifiedSampler, assignBins
+
+def _csvdata(numRows=500, seed=0):
+    rng = np.random.RandomState(seed)
+    return {"age": rng.randint(15, 90, size=numRows).astype(np.float32),
+            "isMale": rng.randint(2, size=numRows).astype(np.float32)}
+
+def testAssignBinsSkipsOutOfRangeRows():
+    csvdata = {"age": np.array([10, 25, 100, 101, np.nan]), "isMale": np.array([0, 1, 1, 0, 1])}
+    binIds, valid = assignBins(csvdata, [("age", [20, 30, 101]), ("isMale", [0.5, 1.5])])
+    assert list(valid) == [True, True, True, False, False]
+    assert list(binIds[valid]) == [0, 3, 5]
+
+def testBatchesAreBalanced():
+    csvdata = _csvdata()
+    sampler = StratifiedSampler(csvdata, seed=1)
+    binIds, _ = assignBins(csvdata, sampler.strata)
+    batch, _ = sampler.nextBatch(3)
+    assert batch.shape == (sampler.numBins * 3,)
+    assert list(binIds[batch]) == list(np.repeat(np.arange(sampler.numBins), 3))
+
+def testEpochVisitsEveryRow():
+    csvdata = _csvdata()
+    sampler = StratifiedSampler(csvdata, seed=1)
+    seen = set()
+    didFinish = False
+    while not didFinish:
+        batch, didFinish = sampler.nextBatch(4)
+        seen.update(batch.tolist())
+    assert seen == set(sampler.order.tolist())
+
+def testStateRestoresTheSameBatches():
+    csvdata = _csvdata()
+    sampler = StratifiedSampler(csvdata, seed=2)
+    sampler.nextBatch(4)
+    sampler.newEpoch()
+    sampler.nextBatch(4)
+    state = sampler.getState()
+    expected = []
+    for _ in range(3):
+        expected += [sampler.nextBatch(4)[0].copy()]
+    sampler.newEpoch()
+    expected += [sampler.nextBatch(4)[0].copy()]
+
+    restored = StratifiedSampler(csvdata, seed=99)
+    restored.setState(state)
+    for i in range(3):
+        np.testing.assert_array_equal(restored.nextBatch(4)[0], expected[i])
+    # the random number generator is restored too, so later epochs shuffle the same way
+    restored.newEpoch()
+    np.testing.assert_array_equal(restored.nextBatch(4)[0], expected[3])
+
+def testStateRejectsDifferentData():
+    sampler = StratifiedSampler(_csvdata(seed=0))
+    with pytest.raises(ValueError):
+        StratifiedSampler(_csvdata(seed=1)).setState(sampler.getState())
+
+def testSaveAndLoad(tmp_path):
+    sampler = StratifiedSampler(_csvdata(), seed=3)
+    sampler.nextBatch(2)
+    path = str(tmp_path / "indices.p")
+    sampler.save(path)
+    loaded = StratifiedSampler.load(path)
+    np.testing.assert_array_equal(loaded.nextBatch(2)[0], sampler.nextBatch(2)[0])